@@ -1,6 +1,6 @@
 from uuid import uuid4
 
-from sqlalchemy import Column, String, DateTime, ForeignKey
+from sqlalchemy import Column, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime
 
@@ -9,11 +9,17 @@ from database.db import (Base)
 
 
 class ChatHistory(Base):
+    __table_args__ = (
+        Index("ix_chathistorys_user_id_session_id_timestamp", "user_id", "session_id", "timestamp"),
+        Index("ix_chathistorys_user_id_timestamp", "user_id", "timestamp"),
+    )
 
     message: Mapped[str] = Column(String)
     role: Mapped[str] = Column(String)
     timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
     session_id: Mapped[str] = mapped_column(String, default=lambda: uuid4().hex)
+    # Ключ идемпотентности записи из очереди write-behind
+    message_key: Mapped[str | None] = mapped_column(String, unique=True, nullable=True)
 
     user = relationship("User", back_populates="chat_history")
@@ -0,0 +1,24 @@
+from datetime import datetime
+
+from sqlalchemy import String, DateTime, Integer, ForeignKey, Index
+from sqlalchemy.orm import Mapped, mapped_column
+
+from database.db import (Base)
+
+# Длина превью (заголовка) сессии — начало первого сообщения пользователя
+SESSION_TITLE_LENGTH = 100
+
+
+class ChatSession(Base):
+    """Метаданные сессии чата; поддерживаются при записи сообщений в chathistorys"""
+    __tablename__ = "chat_sessions"
+    __table_args__ = (
+        Index("ix_chat_sessions_user_id_started_at", "user_id", "started_at"),
+    )
+
+    session_id: Mapped[str] = mapped_column(String, unique=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
+    started_at: Mapped[datetime] = mapped_column(DateTime)
+    last_message_at: Mapped[datetime] = mapped_column(DateTime)
+    message_count: Mapped[int] = mapped_column(Integer, default=0)
+    title: Mapped[str | None] = mapped_column(String, nullable=True)
@@ -1,21 +1,26 @@
-import json
+from fastapi import APIRouter, Request
 
-from fastapi import Body, APIRouter, Request
-
-from app.routers.index import redis_client
 from app.services.get_token import get_user_id
-from app.utils.variables import CONFIG_KEY, DEFAULT_CONFIG
+from app.services import retrieval
+from app.services.user_config import AIConfig, config_cache
+from app.utils.redis import get_redis_client
 
 router = APIRouter(prefix='/config')
 
 @router.post("/set_config")
-async def set_config(request: Request, data: dict = Body(...)):
+async def set_config(request: Request, data: AIConfig):
     """
     Сохраняет конфигурацию ИИ в Redis под ключом пользователя
+    и оповещает открытые сокеты об изменении.
+    Поля, которых нет в запросе, сохраняют текущие значения
     """
     user_id = get_user_id(request)
-    user_config_key = f"chat:{user_id}:config"
-    await redis_client.set(user_config_key, json.dumps(data))
+    current = await config_cache.get(user_id)
+    config = current.model_copy(update=data.model_dump(exclude_unset=True))
+    await config_cache.set(user_id, config)
+    if config.retrieval:
+        # Уже сохранённая история попадёт в индекс в фоне
+        await retrieval.enqueue(get_redis_client(), user_id)
     return {"status": "ok", "message": "Настройки обновлены"}
 
 
@@ -26,8 +31,4 @@ async def get_config(request: Request):
     Возвращает конфигурацию ИИ пользователя
     """
     user_id = get_user_id(request)
-    user_config_key = f"chat:{user_id}:config"
-    config_json = await redis_client.get(user_config_key)
-    if config_json:
-        return json.loads(config_json)
-    return DEFAULT_CONFIG
+    return await config_cache.get(user_id)
@@ -1,28 +1,23 @@
-from fastapi import Depends, Request, HTTPException, APIRouter
+from fastapi import Depends, Request, APIRouter
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
-from jose import jwt, JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.services.history_view import get_user_sessions
+from app.services.history_view import get_user_sessions, get_session_messages
+from auth.service.token_verify import current_user_id
 from database.db_depends import get_db
-from settings import settings
 
 router = APIRouter(prefix="/history", tags=["history"])
 templates = Jinja2Templates(directory="app/templates")
 
 @router.get("/", response_class=HTMLResponse)
-async def history(request: Request, db: AsyncSession = Depends(get_db)):
-
-    token = request.cookies.get("access_token")
-    if not token:
-        raise HTTPException(401, "Not authenticated")
-
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_id = int(payload.get("id"))
-    except JWTError:
-        raise HTTPException(401, "Invalid token")
-
+async def history(request: Request, user_id: int = Depends(current_user_id), db: AsyncSession = Depends(get_db)):
     sessions = await get_user_sessions(user_id, db)
     return templates.TemplateResponse("history.html", {"request": request, "sessions": sessions})
+
+
+@router.get("/session/{session_id}")
+async def session_messages(session_id: str, user_id: int = Depends(current_user_id),
+                           db: AsyncSession = Depends(get_db)):
+    messages = await get_session_messages(user_id, session_id, db)
+    return {"messages": [{"role": m.role, "message": m.message} for m in messages]}
@@ -1,209 +1,253 @@
-import base64
-import json
+import asyncio
+import logging
+from datetime import datetime
 
-from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect, Depends, status
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 
 from dotenv import load_dotenv
-from jose import jwt, JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.services.save_history_from_redis import save_history_from_redis
+from app.services.attachments import attachments_prompt, save_upload
+from app.services.context_builder import encoding_name_for_model
+from app.services.fanout import chat_fanout
+from app.services.generations import generation_runner
+from app.services.history_codec import decode_entry, encode_entry, lrange_raw
+from app.services.history_writer import current_session_id, start_new_session
 from app.utils.redis import get_redis_client
-from app.utils.variables import CONFIG_KEY, DEFAULT_CONFIG
-from app.services.get_ai import get_client_for_model
-from app.services.gpt import process_message
-from dao.dao import ChatHistoryDAO
+from app.utils.serialization import dumps, loads
+from app.utils.telemetry import ACTIVE_WEBSOCKETS, span
+from app.utils.variables import ATTACHMENT_MAX_BYTES
+from app.services.get_ai import get_client_for_model, client_registry, llm_router
+from app.services.gpt import history_keys, load_cached_session, restore_session, stream_message
+from app.services.response_cache import response_cache
+from app.services.state_lifecycle import state_lifecycle, touch
+from app.services.user_config import config_cache
+from auth.service.current_user import get_current_admin_user
+from auth.service.token_verify import current_user_id, optional_user_id
+from dao.dao import ChatHistoryDAO, SESSIONS_PAGE_SIZE
+from database.db import async_session_maker
 from database.db_depends import get_db
-from settings import settings
 
 load_dotenv()
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
 
+logger = logging.getLogger(__name__)
+
 redis_client = get_redis_client()
 @router.get("/", response_class=HTMLResponse)
-async def root(request: Request, db: AsyncSession = Depends(get_db)):
-    token = request.cookies.get("access_token")
-    if not token:
-        return templates.TemplateResponse("index.html", {"request": request, "sessions": []})
-
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_id = int(payload.get("id"))
-    except JWTError:
+async def root(request: Request, user_id: int | None = Depends(optional_user_id),
+               db: AsyncSession = Depends(get_db)):
+    if user_id is None:
         return templates.TemplateResponse("index.html", {"request": request, "sessions": []})
 
     sessions = await ChatHistoryDAO.get_sessions_summary(db, user_id)
     return templates.TemplateResponse("index.html", {"request": request, "sessions": sessions})
 
 @router.post("/reset_chat")
-async def reset_chat(request: Request, db: AsyncSession = Depends(get_db)):
-    token = request.cookies.get("access_token")
-    if not token:
-        raise HTTPException(status_code=401, detail="No token")
-
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_id = int(payload.get("id"))
+async def reset_chat(user_id: int = Depends(current_user_id)):
+    # История уже сохраняется в БД в фоне после каждого хода — просто начинаем новую сессию
+    await start_new_session(user_id)
 
-        # Сохраняем текущую историю в БД перед очисткой
-        await save_history_from_redis(user_id, db, limit=200)
-
-        history_key = f"chat:{user_id}:history"
-        await redis_client.delete(history_key)
-        return {"status": "ok", "message": "История чата очищена"}
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    history_key = f"chat:{user_id}:history"
+    await redis_client.delete(*history_keys(history_key))
+    # Остальные вкладки пользователя тоже очищают чат
+    await chat_fanout.reset(user_id, origin="")
+    return {"status": "ok", "message": "История чата очищена"}
 
 @router.websocket("/ws/chat")
-async def websocket_endpoint(websocket: WebSocket, db: AsyncSession = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket, user_id: int | None = Depends(optional_user_id)):
     await websocket.accept()
-    print("🔌 WebSocket открыт")
-
-    user_id = None  # Инициализируем переменную
+    ACTIVE_WEBSOCKETS.inc()
+    logger.info("WebSocket открыт", extra={"user_id": user_id})
 
+    subscription = None
+    forwarder = None
     try:
-        token = websocket.cookies.get("access_token")
-        if not token:
+        if user_id is None:
             await websocket.close()
-            print("❌ WebSocket закрыт — токен отсутствует")
+            logger.info("WebSocket закрыт — токен отсутствует или недействителен")
             return
 
-        try:
-            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-            user_id = int(payload.get("id"))
-        except JWTError:
-            await websocket.close()
-            print("❌ WebSocket закрыт — токен недействителен")
-            return
-
-        print(f"👤 user_id: {user_id}")
         history_key = f"chat:{user_id}:history"
 
-        # 📦 Отправляем историю
-        stored = await redis_client.lrange(history_key, 0, -1)
-        parsed_history = [json.loads(i) for i in stored]
-        await websocket.send_text(json.dumps({"history": parsed_history}))
-        print("📤 История отправлена")
+        # ⚙️ Загружаем конфиг пользователя один раз при подключении
+        await config_cache.get(user_id)
+
+        # ⏳ Открытый чат — активность: продлеваем TTL состояния разговора
+        async with redis_client.pipeline(transaction=False) as pipe:
+            await touch(pipe, user_id).execute()
+
+        # 📡 Подписка на события вкладок пользователя (на любом воркере) — до чтения истории,
+        # чтобы ничего не потерять между чтением и первым полученным событием
+        subscription = await chat_fanout.subscribe(user_id)
+        inflight = await generation_runner.current(user_id)
+
+        # 📦 Отправляем историю и идущую генерацию — клиент запросит её фреймы с последнего полученного offset
+        stored = await lrange_raw(redis_client, history_key, 0, -1)
+        await websocket.send_text(dumps({"history": [decode_entry(entry) for entry in stored]}))
+        if inflight:
+            await websocket.send_text(dumps({"inflight": inflight}))
+        forwarder = asyncio.create_task(_forward(websocket, subscription))
 
         while True:
             data = await websocket.receive_text()
-            print(f"📨 Получено: {data}")
-            parsed_data = json.loads(data)
+            parsed_data = loads(data)
+
+            # 🔁 Догон генерации после переподключения: {"resume": {"generation": id, "offset": последний offset}}
+            if parsed_data.get("resume"):
+                resume = parsed_data["resume"]
+                await generation_runner.resume(subscription, resume["generation"], resume.get("offset") or "0-0")
+                continue
 
             if parsed_data.get("message") == "__reset__":
-                await redis_client.delete(history_key)
-                await websocket.send_text(json.dumps({"history": []}))
-                print("🧹 История очищена")
+                await redis_client.delete(*history_keys(history_key))
+                await start_new_session(user_id)
+                await chat_fanout.reset(user_id, subscription.origin)
+                await websocket.send_text(dumps({"history": []}))
+                logger.info("История очищена", extra={"user_id": user_id})
                 continue
 
             user_msg = parsed_data.get("message")
+            # Сессию могли сменить в другой вкладке
+            session_id = await current_session_id(user_id)
 
-            if "files" in parsed_data and parsed_data["files"]:
-                files_text = await process_files(parsed_data["files"])
-                user_msg += f"\n\n[Вложенные файлы:]\n{files_text}"
+            # ⚙️ Конфиг пользователя берётся из кэша процесса (без запроса в Redis на каждое сообщение)
+            config = await config_cache.get(user_id)
 
-            # ⚙️ Загружаем конфиг пользователя
-            config_data = await redis_client.hgetall(f"{CONFIG_KEY}:{user_id}") or DEFAULT_CONFIG
-            system_prompt = config_data.get("prompt", DEFAULT_CONFIG["prompt"])
-            model = config_data.get("model", DEFAULT_CONFIG["model"])
-            temperature = float(config_data.get("temperature", DEFAULT_CONFIG["temperature"]))
-            frequency_penalty = float(config_data.get("frequency_penalty", DEFAULT_CONFIG["frequency_penalty"]))
-            presence_penalty = float(config_data.get("presence_penalty", DEFAULT_CONFIG["presence_penalty"]))
+            # 📎 Вложения загружены заранее через /api/attachments — в промпт идут только нужные фрагменты
+            prompt_msg = user_msg
+            if parsed_data.get("attachments"):
+                with span("attachments", config.model):
+                    files_text = await attachments_prompt(redis_client, user_id, parsed_data["attachments"], user_msg)
+                if files_text:
+                    prompt_msg += f"\n\n{files_text}"
 
             # 🤖 Получаем клиента по модели
-            client = get_client_for_model(model)
+            client = get_client_for_model(config.model)
 
-            # 🧠 Обработка сообщения
-            reply = await process_message(
-                user_id=user_id,
-                user_message=user_msg,
+            # 🧠 Генерация идёт в отдельной задаче и не прерывается при обрыве сокета;
+            # её фреймы приходят во все вкладки через _forward
+            await generation_runner.start(subscription, user_msg, config.model, stream_message(
+                user_message=prompt_msg,
                 redis_client=redis_client,
-                system_prompt=system_prompt,
+                system_prompt=config.prompt,
                 history_key=history_key,
-                model=model,
+                model=config.model,
                 client=client,
-                temperature=temperature,
-                frequency_penalty=frequency_penalty,
-                presence_penalty=presence_penalty,
-            )
-
-            # 📤 Отправляем ответ клиенту
-            await websocket.send_text(json.dumps({"role": "assistant", "content": reply}))
+                temperature=config.temperature,
+                frequency_penalty=config.frequency_penalty,
+                presence_penalty=config.presence_penalty,
+                summarize=config.summarize,
+                cache=config.cache,
+                semantic_cache=config.semantic_cache,
+                retrieval=config.retrieval,
+                user_id=user_id,
+                session_id=session_id,
+            ))
 
     except WebSocketDisconnect:
-        print("❌ Отключение WebSocket")
-        if user_id:  # Проверяем, что user_id определен
-            try:
-                await save_history_from_redis(user_id, db, limit=10)
-            except Exception as e:
-                print(f"❌ Ошибка при сохранении истории: {e}")
-
-    except Exception as e:
-        print(f"❌ Ошибка WebSocket: {e}")
+        # История уже поставлена в очередь на сохранение после каждого хода
+        logger.info("Отключение WebSocket", extra={"user_id": user_id})
+
+    except Exception:
+        logger.exception("Ошибка WebSocket", extra={"user_id": user_id})
         try:
             await websocket.close()
         except Exception:
-            print("⚠️ WebSocket уже был закрыт")
-
+            logger.warning("WebSocket уже был закрыт")
 
+    finally:
+        if forwarder is not None:
+            forwarder.cancel()
+        if subscription is not None:
+            await chat_fanout.unsubscribe(subscription)
+        ACTIVE_WEBSOCKETS.dec()
 
 
-
-async def process_files(file_list):
-    """Обработка вложенных файлов"""
-    combined = []
-    for file_b64 in file_list:
-        try:
-            content = base64.b64decode(file_b64).decode("utf-8")
-            combined.append(content)
-        except Exception as e:
-            combined.append(f"[Ошибка файла: {e}]")
-    return "\n\n".join(combined)
+async def _forward(websocket: WebSocket, subscription):
+    """Отправляет в сокет по порядку фреймы генераций и события других вкладок пользователя"""
+    try:
+        async for frame in generation_runner.frames(subscription):
+            await websocket.send_text(dumps(frame))
+        # Вкладка отстала — закрываем, клиент переподключится и догонит генерацию по offset
+        await websocket.close(code=1013)
+    except (WebSocketDisconnect, RuntimeError):
+        # Сокет уже закрыт — основной обработчик завершит подписку
+        pass
 
 
+@router.post("/api/attachments")
+async def upload_attachment(request: Request, name: str, user_id: int = Depends(current_user_id)):
+    """Загрузка вложения: тело запроса — содержимое файла, принимается потоком"""
+    content_length = request.headers.get("content-length")
+    if content_length and int(content_length) > ATTACHMENT_MAX_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"Файл больше {ATTACHMENT_MAX_BYTES // (1024 * 1024)} МБ")
 
+    # Фрагменты считаются токенизатором текущей модели пользователя
+    config = await config_cache.get(user_id)
+    return await save_upload(redis_client, user_id, name, request.stream(), encoding_name_for_model(config.model))
 
 
 @router.get("/load_session")
-async def load_session(request: Request, session_id: str, db: AsyncSession = Depends(get_db)):
-    token = request.cookies.get("access_token")
-    if not token:
-        raise HTTPException(401)
-
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_id = int(payload.get("id"))
-    except JWTError:
-        raise HTTPException(401)
-
+async def load_session(session_id: str, user_id: int = Depends(current_user_id)):
     history_key = f"chat:{user_id}:history"
-    messages = await ChatHistoryDAO.get_by_session(db, user_id, session_id)
-
-    # загружаем в Redis
-    await redis_client.delete(history_key)
-    for msg in messages:
-        await redis_client.rpush(history_key, json.dumps({
-            "role": msg.role,
-            "content": msg.message
-        }))
-    await redis_client.set(f"chat:{user_id}:__LOADED_FROM_DB__", "1", ex=3600)
-    print(f"🚩 Установлен флаг LOADED_FROM_DB для user_id={user_id}")
+
+    # Сессия, недавно загружавшаяся из БД, берётся из кэша в Redis
+    entries = await load_cached_session(redis_client, user_id, session_id)
+    from_cache = entries is not None
+    if not from_cache:
+        # Соединение с БД берётся только при промахе кэша и не удерживается на время записи в Redis
+        async with async_session_maker() as db:
+            messages = await ChatHistoryDAO.get_by_session(db, user_id, session_id)
+        if not messages:
+            # Неизвестная сессия: текущая история и сессия остаются как есть
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Сессия не найдена")
+        entries = [encode_entry(msg.role, msg.message) for msg in messages]
+
+    # загружаем в Redis одной транзакцией
+    await restore_session(redis_client, user_id, history_key, session_id, entries, cache=not from_cache)
     return {"status": "ok"}
 
 @router.get("/api/sessions")
-async def get_sessions(request: Request, db: AsyncSession = Depends(get_db)):
-    token = request.cookies.get("access_token")
-    if not token:
+async def get_sessions(before: datetime | None = None, before_id: str | None = None,
+                       user_id: int | None = Depends(optional_user_id), db: AsyncSession = Depends(get_db)):
+    if user_id is None:
         return {"sessions": []}
 
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_id = int(payload.get("id"))
-    except JWTError:
-        return {"sessions": []}
+    # Пагинация по ключу: ?before=<start_time>&before_id=<session_id> последней сессии предыдущей страницы
+    cursor = (before, before_id) if before and before_id else None
+    sessions = await ChatHistoryDAO.get_sessions_summary(db, user_id, before=cursor)
+    next_cursor = None
+    if len(sessions) == SESSIONS_PAGE_SIZE:
+        next_cursor = {"before": sessions[-1].start_time, "before_id": sessions[-1].session_id}
+    return {"sessions": sessions, "next": next_cursor}
 
-    sessions = await ChatHistoryDAO.get_sessions_summary(db, user_id)
-    return {"sessions": sessions}
+
+# Служебная статистика ниже доступна только администраторам
+
+@router.get("/api/provider_pool", dependencies=[Depends(get_current_admin_user)])
+async def provider_pool():
+    """Метрики пула соединений к провайдерам ИИ"""
+    return client_registry.metrics()
+
+
+@router.get("/api/llm_endpoints", dependencies=[Depends(get_current_admin_user)])
+async def llm_endpoints():
+    """Задержки (p50/p95), доля ошибок и состояние эндпоинтов провайдеров"""
+    return llm_router.metrics()
+
+
+@router.get("/api/response_cache", dependencies=[Depends(get_current_admin_user)])
+async def response_cache_metrics():
+    """Попадания и промахи кэша ответов модели"""
+    return response_cache.metrics()
+
+
+@router.get("/api/redis_state", dependencies=[Depends(get_current_admin_user)])
+async def redis_state():
+    """Число и объём ключей состояния чатов в Redis по видам (последний проход по ключам)"""
+    return await state_lifecycle.report() or {}
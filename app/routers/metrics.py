@@ -0,0 +1,21 @@
+import os
+
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+
+from app.services.pool_metrics import pool_metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Метрики в формате Prometheus"""
+    # Пулы процесса, обслуживающего запрос, — без задержки до следующего снятия
+    pool_metrics.sample()
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Под gunicorn с несколькими воркерами метрики собираются из файлов всех процессов
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,223 @@
+import asyncio
+import codecs
+import math
+import os
+import re
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from fastapi import HTTPException, status
+
+from app.services.context_builder import count_tokens
+from app.utils.serialization import dumps, loads
+from app.utils.variables import (
+    ATTACHMENT_CHUNK_TOKENS, ATTACHMENT_MAX_BYTES, ATTACHMENT_MAX_FILES, ATTACHMENT_TOKEN_BUDGET, ATTACHMENT_TTL,
+    ATTACHMENT_WORKERS,
+)
+from settings import settings
+
+try:
+    from charset_normalizer import from_bytes
+except ImportError:  # без него — UTF-8/BOM и запасной cp1251
+    from_bytes = None
+
+ATTACHMENTS_DIR = settings.ATTACHMENTS_DIR or os.path.join(tempfile.gettempdir(), "chat-attachments")
+# Сколько байт в начале файла проверяется на признаки двоичных данных
+BINARY_PROBE_BYTES = 8192
+
+# Запись на диск, определение кодировки и нарезка на фрагменты — в отдельном пуле, а не в event loop
+_executor = ThreadPoolExecutor(max_workers=ATTACHMENT_WORKERS, thread_name_prefix="attachments")
+
+_WORD_RE = re.compile(r"\w{3,}")
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+def attachment_key(user_id: int, attachment_id: str) -> str:
+    return f"chat:{user_id}:attachment:{attachment_id}"
+
+
+def decode_text(data: bytes) -> str:
+    """
+    Декодирует содержимое текстового файла: BOM, затем UTF-8, затем определение
+    кодировки через charset_normalizer (если установлен), в крайнем случае cp1251.
+    :raises ValueError: файл не похож на текстовый
+    """
+    for bom, encoding in _BOMS:
+        if data.startswith(bom):
+            return data.decode(encoding)
+    if b"\x00" in data[:BINARY_PROBE_BYTES]:
+        raise ValueError("файл не текстовый")
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        pass
+    if from_bytes is not None:
+        best = from_bytes(data).best()
+        if best is not None:
+            return str(best)
+    return data.decode("cp1251", errors="replace")
+
+
+def _pieces(text: str, encoding_name: str):
+    """Абзацы текста; слишком длинные абзацы режутся по строкам, а строки — по символам"""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        tokens = count_tokens(paragraph, encoding_name)
+        if tokens <= ATTACHMENT_CHUNK_TOKENS:
+            yield paragraph, tokens
+            continue
+        for line in paragraph.splitlines():
+            tokens = count_tokens(line, encoding_name)
+            if tokens <= ATTACHMENT_CHUNK_TOKENS:
+                yield line, tokens
+                continue
+            # Примерная длина фрагмента в символах исходя из плотности токенов строки
+            width = max(1, len(line) * ATTACHMENT_CHUNK_TOKENS // tokens)
+            for start in range(0, len(line), width):
+                part = line[start:start + width]
+                yield part, count_tokens(part, encoding_name)
+
+
+def split_chunks(text: str, encoding_name: str) -> list[tuple[str, int]]:
+    """Нарезает текст на фрагменты до ATTACHMENT_CHUNK_TOKENS токенов: [(текст, токены)]"""
+    chunks = []
+    current, current_tokens = [], 0
+    for piece, tokens in _pieces(text, encoding_name):
+        if current and current_tokens + tokens > ATTACHMENT_CHUNK_TOKENS:
+            chunks.append(("\n\n".join(current), current_tokens))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append(("\n\n".join(current), current_tokens))
+    return chunks
+
+
+def _extract(path: str, encoding_name: str) -> list[tuple[str, int]]:
+    with open(path, "rb") as f:
+        data = f.read()
+    return split_chunks(decode_text(data), encoding_name)
+
+
+def select_chunks(files: list[dict], query: str, budget: int = ATTACHMENT_TOKEN_BUDGET) -> list[list[int]]:
+    """
+    Выбирает фрагменты вложений, наиболее близкие к сообщению пользователя, в пределах бюджета токенов.
+    Если все вложения помещаются в бюджет — берутся целиком. Релевантность — BM25 по словам
+    запроса с IDF по всем фрагментам всех файлов.
+    :return: номера выбранных фрагментов для каждого файла (по порядку в файле)
+    """
+    chunks = [(i, j, text, tokens) for i, file in enumerate(files) for j, (text, tokens) in enumerate(file["chunks"])]
+    if sum(tokens for *_, tokens in chunks) <= budget:
+        return [list(range(len(file["chunks"]))) for file in files]
+
+    terms = set(_WORD_RE.findall(query.lower()))
+    frequencies = [Counter(w for w in _WORD_RE.findall(text.lower()) if w in terms) for _, _, text, _ in chunks]
+    document_frequency = Counter(term for tf in frequencies for term in tf)
+    n = len(chunks)
+
+    def score(k: int) -> float:
+        return sum(
+            math.log(1 + n / document_frequency[term]) * count / (count + 1.2)
+            for term, count in frequencies[k].items()
+        )
+
+    # При равной релевантности (в т.ч. нулевой) предпочтение — началу файлов
+    ranked = sorted(range(n), key=lambda k: (-score(k), chunks[k][1], chunks[k][0]))
+    selected = [[] for _ in files]
+    used = 0
+    for k in ranked:
+        i, j, _, tokens = chunks[k]
+        if used + tokens > budget:
+            continue
+        selected[i].append(j)
+        used += tokens
+    return [sorted(indices) for indices in selected]
+
+
+def _format(files: list[dict], selected: list[list[int]]) -> str:
+    parts = ["[Вложенные файлы:]"]
+    for file, indices in zip(files, selected):
+        total = len(file["chunks"])
+        if len(indices) == total:
+            header = f"### {file['name']}"
+        else:
+            header = f"### {file['name']} (фрагменты {', '.join(str(j + 1) for j in indices)} из {total})"
+        body, previous = [], None
+        for j in indices:
+            if previous is not None and j != previous + 1:
+                body.append("…")
+            body.append(file["chunks"][j][0])
+            previous = j
+        parts.append(header + "\n" + "\n\n".join(body))
+    return "\n\n".join(parts)
+
+
+async def save_upload(redis_client, user_id: int, name: str, stream, encoding_name: str) -> dict:
+    """
+    Принимает файл потоком: части пишутся во временный файл по мере поступления
+    (в памяти не больше одной части), размер ограничен ATTACHMENT_MAX_BYTES.
+    Текст извлекается и нарезается на фрагменты в пуле потоков, фрагменты
+    сохраняются в Redis на ATTACHMENT_TTL, временный файл удаляется.
+    :raises HTTPException: 413 — файл слишком большой, 415 — файл не текстовый
+    """
+    loop = asyncio.get_running_loop()
+    attachment_id = uuid4().hex
+    os.makedirs(ATTACHMENTS_DIR, exist_ok=True)
+    path = os.path.join(ATTACHMENTS_DIR, f"{attachment_id}.part")
+
+    size = 0
+    f = await loop.run_in_executor(_executor, open, path, "wb")
+    try:
+        try:
+            async for part in stream:
+                size += len(part)
+                if size > ATTACHMENT_MAX_BYTES:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                        detail=f"Файл больше {ATTACHMENT_MAX_BYTES // (1024 * 1024)} МБ")
+                await loop.run_in_executor(_executor, f.write, part)
+        finally:
+            await loop.run_in_executor(_executor, f.close)
+        chunks = await loop.run_in_executor(_executor, _extract, path, encoding_name)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=f"{name}: {e}")
+    finally:
+        await loop.run_in_executor(_executor, os.remove, path)
+
+    key = attachment_key(user_id, attachment_id)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping={"name": name, "size": size, "chunks": dumps(chunks)})
+        pipe.expire(key, ATTACHMENT_TTL)
+        await pipe.execute()
+    return {"id": attachment_id, "name": name, "size": size, "chunks": len(chunks)}
+
+
+async def attachments_prompt(redis_client, user_id: int, attachment_ids: list[str], query: str) -> str:
+    """Текст вложений для промпта: только фрагменты, относящиеся к сообщению, в пределах бюджета токенов"""
+    attachment_ids = attachment_ids[:ATTACHMENT_MAX_FILES]
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for attachment_id in attachment_ids:
+            pipe.hmget(attachment_key(user_id, attachment_id), "name", "chunks")
+        stored = await pipe.execute()
+
+    files = [
+        {"name": name, "chunks": chunks}
+        for name, chunks in stored
+        if name is not None
+    ]
+    if not files:
+        return ""
+
+    def build() -> str:
+        for file in files:
+            file["chunks"] = loads(file["chunks"])
+        return _format(files, select_chunks(files, query))
+
+    return await asyncio.get_running_loop().run_in_executor(_executor, build)
@@ -0,0 +1,187 @@
+import hashlib
+from functools import lru_cache
+
+import tiktoken
+
+from app.services.history_codec import decode_entry, lrange_raw
+from app.utils.serialization import loads
+from app.utils.variables import CONTEXT_TOKEN_BUDGETS, DEFAULT_CONTEXT_TOKEN_BUDGET, REPLY_TOKEN_RESERVE
+
+# Служебные токены, которые API добавляет к каждому сообщению (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Сколько последних сообщений истории рассматривать при упаковке контекста
+MAX_CONTEXT_MESSAGES = 50
+
+
+def encoding_name_for_model(model: str) -> str:
+    """
+    Кодировка токенизатора для семейства модели.
+    Для DeepSeek локального токенизатора в tiktoken нет — cl100k_base даёт близкую оценку.
+    """
+    if model.startswith(("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4")):
+        return "o200k_base"
+    return "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(name: str) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(name)
+
+
+def count_tokens(text: str, encoding_name: str) -> int:
+    return len(_get_encoding(encoding_name).encode(text, disallowed_special=()))
+
+
+def token_budget_for_model(model: str) -> int:
+    """Бюджет контекста по самому длинному совпавшему префиксу модели"""
+    matches = [prefix for prefix in CONTEXT_TOKEN_BUDGETS if model.startswith(prefix)]
+    if not matches:
+        return DEFAULT_CONTEXT_TOKEN_BUDGET
+    return CONTEXT_TOKEN_BUDGETS[max(matches, key=len)]
+
+
+def message_digest(content: str) -> str:
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+
+
+def _token_field(encoding_name: str, content: str) -> str:
+    return f"{encoding_name}:{message_digest(content)}"
+
+
+def summary_key(history_key: str) -> str:
+    return f"{history_key}:summary"
+
+
+def tokens_key(history_key: str) -> str:
+    return f"{history_key}:tokens"
+
+
+def seq_key(history_key: str) -> str:
+    """Сколько сообщений всего добавлено в историю — абсолютная позиция конца списка"""
+    return f"{history_key}:seq"
+
+
+def summary_start(history: list[dict], summary: dict | None, end: int) -> int:
+    """
+    Индекс первого сообщения истории, ещё не вошедшего в сводку.
+    history — последние сообщения, end — абсолютная позиция конца истории (load_history);
+    summary["until"] — абсолютная позиция, до которой сообщения свёрнуты. Позиции не
+    сдвигаются при обрезке списка и не зависят от текста, поэтому одинаковые сообщения
+    не путаются. Если свёрнутые сообщения уже вытеснены из списка — вся история новее сводки.
+    """
+    # Сводки старого формата хранили дайджест текста — граница по ним неизвестна
+    if not summary or not isinstance(summary.get("until"), int):
+        return 0
+    return min(max(summary["until"] - (end - len(history)), 0), len(history))
+
+
+def pack_history(history: list[dict], counts: list[int], budget: int) -> list[dict]:
+    """
+    Берёт самые свежие сообщения истории, пока они помещаются в budget.
+    counts[i] — число токенов сообщения history[i] с учётом служебных.
+    """
+    packed_from = len(history)
+    used = 0
+    for i in range(len(history) - 1, -1, -1):
+        if used + counts[i] > budget:
+            break
+        used += counts[i]
+        packed_from = i
+    return history[packed_from:]
+
+
+async def load_history(redis_client, history_key: str, count: int = MAX_CONTEXT_MESSAGES):
+    """
+    Читает последние count сообщений истории, сохранённую сводку и абсолютную позицию
+    конца истории одним обращением к Redis
+    """
+    async with redis_client.pipeline(transaction=False) as pipe:
+        lrange_raw(pipe, history_key, -count, -1)
+        pipe.get(summary_key(history_key))
+        pipe.get(seq_key(history_key))
+        pipe.llen(history_key)
+        raw_history, raw_summary, seq, length = await pipe.execute()
+
+    history = [decode_entry(item) for item in raw_history]
+
+    # дополнительно меняем роль "bot" на "assistant"
+    for msg in history:
+        if msg.get("role") == "bot":
+            msg["role"] = "assistant"
+
+    # У истории, созданной до появления счётчика, позиции отсчитываются от начала списка
+    end = max(int(seq or 0), length)
+    return history, loads(raw_summary) if raw_summary else None, end
+
+
+async def token_counts(redis_client, history_key: str, encoding_name: str, history: list[dict]) -> list[int]:
+    """
+    Число токенов каждого сообщения (с учётом служебных). Значения кэшируются
+    в Redis-хэше {history_key}:tokens, поэтому токенизируются только новые сообщения.
+    """
+    if not history:
+        return []
+
+    key = tokens_key(history_key)
+    fields = [_token_field(encoding_name, msg["content"]) for msg in history]
+    cached = await redis_client.hmget(key, fields)
+    counts = []
+    missing = {}
+    for msg, field, value in zip(history, fields, cached):
+        if value is None:
+            value = count_tokens(msg["content"], encoding_name)
+            missing[field] = value
+        counts.append(int(value) + MESSAGE_OVERHEAD_TOKENS)
+
+    if missing:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(key, mapping=missing)
+            pipe.hlen(key)
+            _, cached_fields = await pipe.execute()
+        # Хэш не должен расти бесконечно: удаляем записи вытесненных из истории сообщений
+        if cached_fields > 2 * MAX_CONTEXT_MESSAGES:
+            await redis_client.delete(key)
+            await redis_client.hset(key, mapping=dict(zip(fields, (c - MESSAGE_OVERHEAD_TOKENS for c in counts))))
+
+    return counts
+
+
+def recalled_prompt(recalled: list[dict]) -> str:
+    lines = ["Фрагменты из прошлых сессий пользователя (используй, если они относятся к вопросу):"]
+    for record in recalled:
+        role = "пользователь" if record["role"] == "user" else "ассистент"
+        date = (record.get("timestamp") or "")[:10]
+        lines.append(f"- [{date}, {role}] {record['text']}")
+    return "\n".join(lines)
+
+
+async def build_context(redis_client, history_key: str, model: str, system_prompt: str, user_message: str,
+                        recalled: list[dict] | None = None):
+    """
+    Формирует payload для API: системный промпт, сводку ранних сообщений (если есть),
+    найденные фрагменты прошлых сессий (recalled), столько последних сообщений истории,
+    сколько помещается в бюджет модели, и новое сообщение.
+    """
+    encoding_name = encoding_name_for_model(model)
+
+    history, summary, end = await load_history(redis_client, history_key)
+    # Сообщения, уже свёрнутые в сводку, в контекст не попадают
+    history = history[summary_start(history, summary, end):]
+    counts = await token_counts(redis_client, history_key, encoding_name, history)
+
+    head = [{"role": "system", "content": system_prompt}]
+    if summary:
+        head.append({"role": "system", "content": f"Краткое содержание предыдущей беседы:\n{summary['content']}"})
+    if recalled:
+        head.append({"role": "system", "content": recalled_prompt(recalled)})
+
+    fixed = (
+        sum(count_tokens(msg["content"], encoding_name) for msg in head)
+        + count_tokens(user_message, encoding_name)
+        + (len(head) + 1) * MESSAGE_OVERHEAD_TOKENS
+    )
+    budget = token_budget_for_model(model) - REPLY_TOKEN_RESERVE - fixed
+
+    return head + pack_history(history, counts, max(budget, 0)) + [
+        {"role": "user", "content": user_message}
+    ]
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from uuid import uuid4
+
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from app.utils.redis import get_redis_client
+from app.utils.serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# Сколько событий может накопиться у медленной вкладки, прежде чем её отключат для пересинхронизации
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+def events_channel(user_id: int) -> str:
+    return f"chat:{user_id}:events"
+
+
+@dataclass(eq=False)
+class Subscription:
+    user_id: int
+    origin: str = field(default_factory=lambda: uuid4().hex)
+    queue: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE))
+    # Генерации, которые отслеживает вкладка: id генерации -> последний отправленный offset
+    offsets: dict[str, str] = field(default_factory=dict)
+
+
+class ChatFanout:
+    """
+    Рассылка событий чата всем открытым вкладкам пользователя — на любом воркере и любой реплике.
+
+    События (сообщение пользователя, фреймы генерации, сброс истории) публикуются
+    в канал chat:{user_id}:events. Каждый процесс держит одно pub/sub-соединение
+    и подписан только на каналы пользователей, у которых в нём есть открытые
+    сокеты; полученные события раскладываются по очередям локальных подписок.
+    Упорядочивание и догон фреймов генерации — в app.services.generations.
+    """
+
+    def __init__(self, redis_client):
+        self._redis = redis_client
+        self._pubsub = None
+        self._local: dict[int, set[Subscription]] = {}
+        self._task: asyncio.Task | None = None
+
+    async def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(user_id)
+        subscriptions = self._local.setdefault(user_id, set())
+        first = not subscriptions
+        subscriptions.add(subscription)
+        if first:
+            if self._pubsub is None:
+                self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            await self._pubsub.subscribe(events_channel(user_id))
+            if self._task is None:
+                self._task = asyncio.create_task(self._listen())
+        return subscription
+
+    async def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._local.get(subscription.user_id)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self._local[subscription.user_id]
+            await self._pubsub.unsubscribe(events_channel(subscription.user_id))
+
+    def _dispatch(self, channel: str, data: str):
+        user_id = int(channel.split(":")[1])
+        event = loads(data)
+        for subscription in list(self._local.get(user_id, ())):
+            # Вкладка, от которой пришло событие, уже его показала
+            if event.get("origin") == subscription.origin:
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Вкладка не успевает читать — пусть переподключится и догонит генерацию по offset
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                subscription.queue.put_nowait(None)
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+                if message is not None and message["type"] == "message":
+                    self._dispatch(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except (RedisConnectionError, OSError) as e:
+                # При переподключении pub/sub сам восстанавливает подписки; пропущенное догоняется по offset
+                logger.warning("Потеряно соединение рассылки чата: %s", e)
+                await asyncio.sleep(1)
+            except Exception:
+                logger.exception("Ошибка рассылки чата")
+
+    async def publish(self, user_id: int, origin: str, frame: dict):
+        await self._redis.publish(events_channel(user_id), dumps({"origin": origin, "frame": frame}))
+
+    async def reset(self, user_id: int, origin: str):
+        """Сообщает всем вкладкам пользователя, что история очищена"""
+        await self.publish(user_id, origin, {"history": []})
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+
+
+chat_fanout = ChatFanout(get_redis_client())
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import time
+from uuid import uuid4
+
+from fastapi import HTTPException
+
+from app.services.fanout import Subscription, events_channel
+from app.utils.redis import get_redis_client
+from app.utils.serialization import dumps, loads
+from app.utils.telemetry import TURN_SECONDS, span
+
+logger = logging.getLogger(__name__)
+
+# Сколько живёт поток фреймов генерации после последнего фрейма
+GENERATION_TTL = 600
+# Отметка текущей генерации живёт, пока её продлевает воркер: после его падения она
+# истекает через GENERATION_LIVENESS_TTL, а не висит до конца GENERATION_TTL
+GENERATION_LIVENESS_TTL = 30
+GENERATION_HEARTBEAT_INTERVAL = 10
+# Сколько ждать незавершённые генерации при остановке процесса, секунд
+SHUTDOWN_TIMEOUT = 25
+
+# Добавляет фрейм в поток генерации и публикует его вместе с полученным id записи (offset)
+APPEND_FRAME_SCRIPT = """
+local id = redis.call('XADD', KEYS[1], '*', 'frame', ARGV[1])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+redis.call('PUBLISH', KEYS[2], '{"generation":"' .. ARGV[3] .. '","offset":"' .. id .. '","frame":' .. ARGV[1] .. '}')
+return id
+"""
+
+# Снимает отметку текущей генерации, только если это всё ещё она
+CLEAR_CURRENT_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'id') == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Продлевает отметку текущей генерации, только если это всё ещё она
+REFRESH_CURRENT_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'id') == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+end
+return 0
+"""
+
+
+def generation_key(user_id: int, generation_id: str) -> str:
+    # Поток лежит в пространстве ключей пользователя: догнать можно только свою генерацию
+    return f"chat:{user_id}:generation:{generation_id}"
+
+
+def current_generation_key(user_id: int) -> str:
+    return f"chat:{user_id}:generation"
+
+
+def _offset(offset: str) -> tuple[int, int]:
+    ms, seq = offset.split("-")
+    return int(ms), int(seq)
+
+
+class GenerationRunner:
+    """
+    Генерации ответов, не зависящие от сокета.
+
+    Каждый ход получает id генерации; вызов провайдера выполняется в отдельной
+    задаче, которая дописывает фреймы в Redis Stream chat:{user_id}:generation:{id}
+    (с TTL) и публикует их в канал пользователя с offset — id записи в потоке. Если сокет
+    оборвался, генерация продолжается; переподключившийся клиент присылает id
+    генерации и последний полученный offset и догоняет недостающие фреймы из
+    потока, не запуская модель заново.
+    """
+
+    def __init__(self, redis_client):
+        self._redis = redis_client
+        self._append = redis_client.register_script(APPEND_FRAME_SCRIPT)
+        self._clear_current = redis_client.register_script(CLEAR_CURRENT_SCRIPT)
+        self._refresh_current = redis_client.register_script(REFRESH_CURRENT_SCRIPT)
+        # Ссылки на задачи генераций, чтобы их не собрал сборщик мусора до завершения
+        self._tasks: set[asyncio.Task] = set()
+
+    async def current(self, user_id: int) -> dict | None:
+        """Генерация, которая сейчас идёт у пользователя: {"generation", "message"}"""
+        current = await self._redis.hgetall(current_generation_key(user_id))
+        if not current:
+            return None
+        return {"generation": current["id"], "message": current["message"]}
+
+    async def start(self, subscription: Subscription, message: str, model: str, frames) -> str:
+        """
+        Запускает генерацию: frames — асинхронный генератор фреймов (stream_message).
+        Сообщение пользователя с id генерации сразу рассылается остальным вкладкам.
+        """
+        user_id = subscription.user_id
+        generation_id = uuid4().hex
+        # Своя вкладка отслеживает генерацию с самого начала
+        subscription.offsets[generation_id] = "0-0"
+
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(current_generation_key(user_id), mapping={"id": generation_id, "message": message})
+            pipe.expire(current_generation_key(user_id), GENERATION_LIVENESS_TTL)
+            pipe.publish(events_channel(user_id), dumps({
+                "origin": subscription.origin,
+                "frame": {"user_message": message, "generation": generation_id},
+            }))
+            await pipe.execute()
+
+        task = asyncio.create_task(self._produce(user_id, generation_id, model, frames))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return generation_id
+
+    async def _produce(self, user_id: int, generation_id: str, model: str, frames):
+        keys = [generation_key(user_id, generation_id), events_channel(user_id)]
+        started = time.perf_counter()
+        heartbeat = asyncio.create_task(self._heartbeat(user_id, generation_id))
+        try:
+            with span("turn", model, user_id=user_id):
+                try:
+                    async for frame in frames:
+                        await self._append(keys=keys, args=[dumps(frame), GENERATION_TTL, generation_id])
+                except HTTPException as e:
+                    await self._append(keys=keys, args=[dumps({"error": e.detail, "done": True}),
+                                                        GENERATION_TTL, generation_id])
+                except Exception:
+                    logger.exception("Ошибка генерации", extra={"user_id": user_id, "generation": generation_id})
+                    await self._append(keys=keys, args=[dumps({"error": "Ошибка генерации ответа", "done": True}),
+                                                        GENERATION_TTL, generation_id])
+            TURN_SECONDS.labels(model).observe(time.perf_counter() - started)
+            logger.info("Ход обработан", extra={
+                "user_id": user_id, "model": model, "generation": generation_id,
+                "seconds": round(time.perf_counter() - started, 3),
+            })
+        finally:
+            heartbeat.cancel()
+            await self._clear_current(keys=[current_generation_key(user_id)], args=[generation_id])
+
+    async def _heartbeat(self, user_id: int, generation_id: str):
+        """Продлевает отметку текущей генерации, пока её задача жива (в том числе в очереди планировщика)"""
+        while True:
+            await asyncio.sleep(GENERATION_HEARTBEAT_INTERVAL)
+            try:
+                await self._refresh_current(keys=[current_generation_key(user_id)],
+                                            args=[generation_id, GENERATION_LIVENESS_TTL])
+            except Exception:
+                logger.exception("Не удалось продлить отметку генерации",
+                                 extra={"user_id": user_id, "generation": generation_id})
+
+    async def resume(self, subscription: Subscription, generation_id: str, offset: str = "0-0"):
+        """Просит выдать вкладке фреймы генерации после offset (в общей очереди, чтобы сохранить порядок)"""
+        await subscription.queue.put({"resume": generation_id, "offset": offset})
+
+    async def _catch_up(self, subscription: Subscription, generation_id: str, offset: str):
+        entries = await self._redis.xrange(generation_key(subscription.user_id, generation_id),
+                                           min=f"({offset}", max="+")
+        subscription.offsets[generation_id] = offset
+        for entry_id, fields in entries:
+            frame = self._track(subscription, generation_id, entry_id, loads(fields["frame"]))
+            if frame is not None:
+                yield frame
+
+    @staticmethod
+    def _track(subscription: Subscription, generation_id: str, offset: str, frame: dict) -> dict | None:
+        """Пропускает фреймы, которые вкладка уже получила, и запоминает последний offset"""
+        last = subscription.offsets.get(generation_id)
+        # Фреймы генерации, которую вкладка не отслеживает, придут ей при догоне
+        if last is None or _offset(offset) <= _offset(last):
+            return None
+        if frame.get("done"):
+            subscription.offsets.pop(generation_id)
+        else:
+            subscription.offsets[generation_id] = offset
+        return {**frame, "generation": generation_id, "offset": offset}
+
+    async def frames(self, subscription: Subscription):
+        """
+        Фреймы для отправки во вкладку по порядку: события других вкладок, фреймы
+        отслеживаемых генераций и догон по запросам resume. Заканчивается, если
+        вкладка не успевала читать и её очередь переполнилась.
+        """
+        while True:
+            event = await subscription.queue.get()
+            if event is None:
+                return
+            if "resume" in event:
+                async for frame in self._catch_up(subscription, event["resume"], event["offset"]):
+                    yield frame
+                continue
+            if "generation" in event:
+                frame = self._track(subscription, event["generation"], event["offset"], event["frame"])
+                if frame is not None:
+                    yield frame
+                continue
+
+            frame = event["frame"]
+            if "generation" in frame:
+                # Ход начат в другой вкладке — отслеживаем его генерацию с начала
+                subscription.offsets.setdefault(frame["generation"], "0-0")
+            yield frame
+
+    async def stop(self):
+        """Даёт незавершённым генерациям время закончиться, затем отменяет оставшиеся"""
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=SHUTDOWN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+generation_runner = GenerationRunner(get_redis_client())
@@ -1,15 +1,141 @@
-import os
-
+import httpx
 from openai import AsyncOpenAI
 
+from app.services.llm_router import Endpoint, LLMRouter, RoutedClient, load_endpoints
+from settings import settings
+
+DEEPSEEK_BASE_URL = settings.DEEPSEEK_BASE_URL
+OPENAI_BASE_URL = settings.OPENAI_BASE_URL
+
+# Настройки общего пула соединений к провайдерам
+POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60)
+POOL_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+
+class _CountingTransport(httpx.AsyncHTTPTransport):
+    """
+    Транспорт httpx, считающий запросы, новые TCP-соединения и TLS-рукопожатия
+    через trace-расширение httpcore
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.requests = 0
+        self.in_flight = 0
+        self.connections = 0
+        self.handshakes = 0
+
+    async def _trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self.connections += 1
+        elif event_name == "connection.start_tls.complete":
+            self.handshakes += 1
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions["trace"] = self._trace
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            self.in_flight -= 1
+            raise
+        # Соединение считается занятым, пока тело ответа (в т.ч. поток) не дочитано
+        response.stream = _ReleasingStream(response.stream, self)
+        return response
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Обёртка над телом ответа, освобождающая счётчик in_flight при закрытии"""
+
+    def __init__(self, stream, transport: _CountingTransport):
+        self._stream = stream
+        self._transport = transport
+        self._closed = False
+
+    async def __aiter__(self):
+        async for part in self._stream:
+            yield part
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._transport.in_flight -= 1
+
+
+class ProviderClientRegistry:
+    """
+    Реестр долгоживущих клиентов AsyncOpenAI, ключ — base_url провайдера.
+    Все клиенты используют один пул соединений httpx (HTTP/2, keep-alive).
+    """
+
+    def __init__(self):
+        self._transport: _CountingTransport | None = None
+        self._http_client: httpx.AsyncClient | None = None
+        self._clients: dict[str, AsyncOpenAI] = {}
+
+    def startup(self):
+        """Создаёт общий пул соединений; вызывается один раз при старте приложения"""
+        if self._http_client is not None:
+            return
+        self._transport = _CountingTransport(http2=True, limits=POOL_LIMITS)
+        self._http_client = httpx.AsyncClient(transport=self._transport, timeout=POOL_TIMEOUT)
+
+    async def aclose(self):
+        """Закрывает клиентов и пул соединений при остановке приложения"""
+        if self._http_client is None:
+            return
+        await self._http_client.aclose()
+        self._http_client = None
+        self._transport = None
+        self._clients.clear()
+
+    def get(self, base_url: str, api_key: str) -> AsyncOpenAI:
+        if self._http_client is None:
+            self.startup()
+        client = self._clients.get(base_url)
+        if client is None:
+            client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=self._http_client)
+            self._clients[base_url] = client
+        return client
+
+    def metrics(self) -> dict:
+        """Метрики пула: занятые соединения, переиспользования, рукопожатия"""
+        t = self._transport
+        if t is None:
+            return {"clients": 0, "requests": 0, "in_use": 0, "connections": 0, "reuses": 0, "handshakes": 0}
+        return {
+            "clients": len(self._clients),
+            "requests": t.requests,
+            "in_use": t.in_flight,
+            "connections": t.connections,
+            "reuses": max(t.requests - t.connections, 0),
+            "handshakes": t.handshakes,
+        }
+
+
+client_registry = ProviderClientRegistry()
+
+
+llm_router = LLMRouter(client_registry.get, hedging=settings.LLM_HEDGING)
+load_endpoints(llm_router, [
+    Endpoint(family="deepseek", name="deepseek", base_url=DEEPSEEK_BASE_URL, api_key=settings.DEEPSEEK_API_KEY),
+    Endpoint(family="openai", name="openai", base_url=OPENAI_BASE_URL, api_key=settings.OPENAI_API_KEY),
+])
+
+
+def provider_for_model(model_name: str) -> str:
+    return "deepseek" if model_name.startswith("deepseek") else "openai"
+
 
-def get_client_for_model(model_name: str) -> AsyncOpenAI:
+def get_client_for_model(model_name: str) -> RoutedClient:
     """
-    Выбор клиента AsyncOpenAI в зависимости от названия модели
+    Клиент для семейства модели: запросы распределяются роутером между
+    эндпоинтами этого семейства (самый быстрый здоровый, с переключением при ошибках)
     :param model_name:
     :return:
     """
-    if model_name.startswith("deepseek"):
-        return AsyncOpenAI(api_key=os.getenv("DEEPSEEK_API_KEY"), base_url="https://api.deepseek.com")
-    else:
-        return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
\ No newline at end of file
+    return llm_router.client(provider_for_model(model_name))
@@ -1,7 +1,8 @@
-from jose import jwt, JWTError
-from settings import settings
+from jose import JWTError
 from fastapi import WebSocket, Request
 
+from auth.service.token_verify import verify_token
+
 
 def extract_token_from_scope(scope) -> str:
     if isinstance(scope, Request) or isinstance(scope, WebSocket):
@@ -15,7 +16,7 @@ def extract_token_from_scope(scope) -> str:
 def get_user_id(scope: Request | WebSocket) -> int:
     token = extract_token_from_scope(scope)
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        payload = verify_token(token)
         return int(payload.get("id"))
     except JWTError:
         raise RuntimeError("Невалидный токен")
\ No newline at end of file
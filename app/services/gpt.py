@@ -1,58 +1,286 @@
-import json
+import asyncio
+import logging
+import time
+from datetime import datetime
+
 from openai import AsyncOpenAI
 
-MAX_HISTORY_MESSAGES = 4
+from app.services.context_builder import (
+    build_context, encoding_name_for_model, load_history, seq_key, summary_key, summary_start, token_counts,
+    tokens_key,
+)
+from app.services.get_ai import provider_for_model
+from app.services.history_codec import decode_entries, encode_entries, encode_entry, get_raw
+from app.services.history_writer import SESSION_CACHE_TTL, append_turn, session_cache_key, session_key
+from app.services.response_cache import response_cache
+from app.services.retrieval import retrieval_index
+from app.services.scheduler import PRIORITY_BACKGROUND, estimate_cost, llm_scheduler
+from app.services.state_lifecycle import touch
+from app.utils.serialization import dumps
+from app.utils.telemetry import TOKENS_PER_SECOND, TTFT_SECONDS, observe_stage, span
+from app.utils.variables import SUMMARY_KEEP_MESSAGES, SUMMARY_MODELS, SUMMARY_TRIGGER_TOKENS
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
 MAX_STORED_MESSAGES = 50
+HISTORY_TTL = settings.CHAT_STATE_TTL
+
+SUMMARY_PROMPT = (
+    "Сожми переписку пользователя с ассистентом в краткое содержание на языке переписки. "
+    "Сохрани факты, решения, договорённости и открытые вопросы. Не добавляй ничего от себя."
+)
 
+# Дописывает сообщения в историю, обрезает её и сдвигает счётчик позиций {history_key}:seq.
+# История без счётчика (созданная до его появления) начинает отсчёт с текущей длины списка.
+APPEND_HISTORY_SCRIPT = """
+local length = redis.call('RPUSH', KEYS[1], unpack(ARGV, 2))
+redis.call('LTRIM', KEYS[1], -tonumber(ARGV[1]), -1)
+local added = #ARGV - 1
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    redis.call('SET', KEYS[2], length - added)
+end
+return redis.call('INCRBY', KEYS[2], added)
+"""
 
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора до завершения
+_background_tasks: set[asyncio.Task] = set()
 
 
-async def process_message(user_message: str, redis_client, system_prompt: str, history_key: str, model: str,
-                          client: AsyncOpenAI, temperature: float, frequency_penalty: float, presence_penalty: float):
+def history_keys(history_key: str) -> list[str]:
+    """Все ключи Redis, относящиеся к истории чата: сам список, кэш токенов, сводка и счётчик позиций"""
+    return [history_key, tokens_key(history_key), summary_key(history_key), seq_key(history_key)]
+
+
+async def _save_turn(redis_client, history_key: str, user_message: str, reply: str,
+                     user_id: int | None = None, session_id: str | None = None, started_at: datetime | None = None):
     """
-    Обрабатывает новое сообщение пользователя и взаимодействует с OpenAI API,
-    сохраняя историю в Redis как список элементов.
+    Сохраняет пару сообщений (пользователь + ассистент) в Redis, обрезает список
+    до MAX_STORED_MESSAGES и продлевает TTL — одной транзакцией (MULTI/EXEC).
+    Если передан session_id, в той же транзакции ход ставится в очередь на запись в БД.
     """
-    # 1) Читаем всю историю списка из Redis
-    raw_history = await redis_client.lrange(history_key, 0, -1)
-    full_history = [json.loads(item) for item in raw_history]
+    append = redis_client.register_script(APPEND_HISTORY_SCRIPT)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        await append(
+            keys=[history_key, seq_key(history_key)],
+            args=[MAX_STORED_MESSAGES, encode_entry("user", user_message), encode_entry("assistant", reply)],
+            client=pipe,
+        )
+        if user_id is not None:
+            # Скользящий TTL всего состояния разговора: история, токены, сводка, текущая сессия
+            touch(pipe, user_id)
+        else:
+            pipe.expire(history_key, HISTORY_TTL)
+            pipe.expire(tokens_key(history_key), HISTORY_TTL)
+            pipe.expire(seq_key(history_key), HISTORY_TTL)
+        if session_id is not None:
+            append_turn(pipe, user_id, session_id, user_message, reply, started_at or datetime.now())
+            # Кэшированная копия сессии больше не актуальна
+            pipe.delete(session_cache_key(user_id, session_id))
+        await pipe.execute()
+
 
-    # дополнительно меняем роль "bot" на "assistant"
-    for msg in full_history:
-        if msg.get("role") == "bot":
-            msg["role"] = "assistant"
+async def load_cached_session(redis_client, user_id: int, session_id: str) -> list[bytes | str] | None:
+    """Записи истории сессии, ранее загруженной из БД, если они ещё в кэше"""
+    cached = await get_raw(redis_client, session_cache_key(user_id, session_id))
+    return decode_entries(cached) if cached is not None else None
 
-    # 2) Обрезаем историю для контекста модели
-    trimmed_history = full_history[-MAX_HISTORY_MESSAGES:]
 
-    # 3) Формируем payload для API: системный промпт, сокращённая история, новое сообщение
-    messages = [
-        {"role": "system", "content": system_prompt}
-    ] + trimmed_history + [
-        {"role": "user", "content": user_message}
-    ]
+async def restore_session(redis_client, user_id: int, history_key: str, session_id: str, entries: list[bytes | str],
+                          cache: bool = True):
+    """
+    Загружает сессию в Redis одной транзакцией: очистка ключей истории, один
+    вариадический RPUSH, обрезка, TTL и переключение текущей сессии на session_id.
+    entries — уже закодированные записи истории (encode_entry; старые JSON-записи тоже допустимы).
+    """
+    entries = entries[-MAX_STORED_MESSAGES:]
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(*history_keys(history_key))
+        if entries:
+            pipe.rpush(history_key, *entries)
+            pipe.set(seq_key(history_key), len(entries))
+        # Новые сообщения дописываются в загруженную сессию
+        pipe.set(session_key(user_id), session_id)
+        touch(pipe, user_id)
+        if cache:
+            pipe.set(session_cache_key(user_id, session_id), encode_entries(entries), ex=SESSION_CACHE_TTL)
+        await pipe.execute()
 
+
+async def summarize_history(redis_client, history_key: str, model: str, client: AsyncOpenAI,
+                            user_id: int | None = None):
     """
-    Отправляет запрос в OpenAI API для получения ответа.
+    Сворачивает ранние сообщения истории в сводку, если несвёрнутая часть
+    превысила SUMMARY_TRIGGER_TOKENS. Последние SUMMARY_KEEP_MESSAGES сообщений
+    остаются дословно. Сводка хранится в отдельном ключе {history_key}:summary.
     """
+    lock_key = f"{history_key}:summary:lock"
+    if not await redis_client.set(lock_key, "1", nx=True, ex=120):
+        return
+
+    try:
+        history, summary, end = await load_history(redis_client, history_key, MAX_STORED_MESSAGES)
+        start = summary_start(history, summary, end)
+        pending = history[start:]
+        if len(pending) <= SUMMARY_KEEP_MESSAGES:
+            return
+
+        counts = await token_counts(redis_client, history_key, encoding_name_for_model(model), pending)
+        if sum(counts) <= SUMMARY_TRIGGER_TOKENS:
+            return
+
+        to_summarize = pending[:-SUMMARY_KEEP_MESSAGES]
+        transcript = "\n\n".join(f"{msg['role']}: {msg['content']}" for msg in to_summarize)
+        if summary:
+            transcript = f"Предыдущее краткое содержание:\n{summary['content']}\n\nНовые сообщения:\n{transcript}"
+
+        provider = provider_for_model(model)
+        messages = [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript},
+        ]
+        # Сводка — фоновая работа: уступает место интерактивным запросам
+        ticket = llm_scheduler.submit(
+            user_id, provider, PRIORITY_BACKGROUND, cost=estimate_cost(messages)
+        ) if user_id is not None else None
+        tokens_used = 0
+        try:
+            if ticket:
+                await llm_scheduler.wait(ticket)
+            response = await client.chat.completions.create(
+                model=SUMMARY_MODELS[provider],
+                messages=messages,
+                temperature=0.2,
+            )
+            tokens_used = response.usage.total_tokens if response.usage else None
+        finally:
+            if ticket:
+                await llm_scheduler.release(ticket, tokens_used)
+        content = response.choices[0].message.content.strip()
+
+        await redis_client.set(
+            summary_key(history_key),
+            # Граница — абсолютная позиция сообщения, а не его текст: повторы не сбивают её
+            dumps({"content": content, "until": end - len(history) + start + len(to_summarize)}),
+            ex=HISTORY_TTL,
+        )
+        logger.info("Свёрнуто %d сообщений в сводку", len(to_summarize), extra={"history_key": history_key})
+    except Exception:
+        logger.exception("Ошибка при построении сводки")
+    finally:
+        await redis_client.delete(lock_key)
+
+
+def schedule_summary(redis_client, history_key: str, model: str, client: AsyncOpenAI, user_id: int | None = None):
+    """Запускает построение сводки в фоне, вне критического пути ответа"""
+    task = asyncio.create_task(summarize_history(redis_client, history_key, model, client, user_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def _record_generation(model: str, seconds: float, usage: dict | None):
+    """Длительность генерации и скорость в токенах ответа в секунду"""
+    observe_stage("generation", model, seconds)
+    if usage and usage.get("completion_tokens") and seconds > 0:
+        TOKENS_PER_SECOND.labels(model).observe(usage["completion_tokens"] / seconds)
+
+
+async def _recall(retrieval: bool, user_id: int | None, user_message: str, session_id: str | None):
+    """Фрагменты прошлых сессий, близкие к сообщению, если пользователь включил поиск по истории"""
+    if not retrieval or user_id is None:
+        return None
+    try:
+        return await retrieval_index.search(user_id, user_message, exclude_session=session_id)
+    except Exception as e:
+        # Без найденных фрагментов ответ всё равно будет получен
+        logger.warning("Поиск по истории недоступен: %s", e)
+        return None
+
+
+async def stream_message(user_message: str, redis_client, system_prompt: str, history_key: str, model: str,
+                         client: AsyncOpenAI, temperature: float, frequency_penalty: float, presence_penalty: float,
+                         summarize: bool = False, cache: bool = False, semantic_cache: bool = False,
+                         retrieval: bool = False, user_id: int | None = None, session_id: str | None = None):
+    """
+    Обрабатывает новое сообщение пользователя и отдаёт ответ модели по мере генерации.
+
+    Генерирует фреймы {"delta": ...} для каждого фрагмента ответа и финальный
+    {"done": True, "usage": ...}. Собранный ответ записывается в Redis один раз,
+    после завершения потока.
+    """
+    started_at = datetime.now()
+    with span("recall", model):
+        recalled = await _recall(retrieval, user_id, user_message, session_id)
+    with span("context", model):
+        messages = await build_context(redis_client, history_key, model, system_prompt, user_message, recalled)
+
+    cached = None
+    if cache:
+        with span("cache_lookup", model):
+            cached = await response_cache.lookup(messages, model, temperature, frequency_penalty, presence_penalty,
+                                                  semantic=semantic_cache)
+        if cached.reply is not None:
+            # Попадание в кэш: ответ целиком одним фреймом, без обращения к провайдеру
+            yield {"delta": cached.reply}
+            with span("persist", model):
+                await _save_turn(redis_client, history_key, user_message, cached.reply, user_id, session_id,
+                                 started_at)
+            yield {"done": True, "usage": None, "cached": cached.tier}
+            return
 
-    response = await client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-        frequency_penalty=frequency_penalty,
-        presence_penalty=presence_penalty
-    )
-    # Извлекает ответ ИИ из полученного ответа от API и очищает лишние пробелы.
+    # Слот у провайдера выдаёт планировщик; пока ждём — сообщаем клиенту позицию в очереди
+    ticket = llm_scheduler.submit(
+        user_id, provider_for_model(model), cost=estimate_cost(messages)
+    ) if user_id is not None else None
+    parts = []
+    usage = None
+    first_token_at = None
+    try:
+        if ticket:
+            # Внутри генератора с yield — время этапа пишется напрямую, без span
+            queued = time.perf_counter()
+            async for position in llm_scheduler.positions(ticket):
+                yield {"queue": position}
+            observe_stage("queue", model, time.perf_counter() - queued)
 
-    reply = response.choices[0].message.content.strip()
+        requested = time.perf_counter()
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            frequency_penalty=frequency_penalty,
+            presence_penalty=presence_penalty,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
 
-    # 5) Сохраняем новые сообщения в Redis (список)
-    await redis_client.rpush(history_key, json.dumps({"role": "user", "content": user_message}))
-    await redis_client.rpush(history_key, json.dumps({"role": "assistant", "content": reply}))
-    # 6) Обрезаем список до последних MAX_STORED_MESSAGES элементов
-    await redis_client.ltrim(history_key, -MAX_STORED_MESSAGES, -1)
+        async for chunk in stream:
+            # Последний чанк при include_usage приходит без choices, только с usage
+            if chunk.usage is not None:
+                usage = chunk.usage.model_dump()
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    TTFT_SECONDS.labels(model).observe(first_token_at - requested)
+                parts.append(delta)
+                yield {"delta": delta}
+    finally:
+        if ticket:
+            # Без usage расход неизвестен: если ответ начался, резерв остаётся списанным
+            await llm_scheduler.release(ticket, usage["total_tokens"] if usage else None if parts else 0)
 
-    # 7) Возвращаем ответ ИИ
-    return reply
+    if first_token_at is not None:
+        _record_generation(model, time.perf_counter() - first_token_at, usage)
+    reply = "".join(parts).strip()
+    with span("persist", model):
+        await _save_turn(redis_client, history_key, user_message, reply, user_id, session_id, started_at)
+    if cached and reply:
+        # Пустой ответ (провайдер не прислал текста) не кэшируется — иначе он повторялся бы при каждом попадании
+        await response_cache.store(cached, reply)
+    if summarize:
+        schedule_summary(redis_client, history_key, model, client, user_id)
 
+    yield {"done": True, "usage": usage}
@@ -0,0 +1,67 @@
+import msgpack
+import zstandard
+from redis.client import NEVER_DECODE
+
+from app.utils.serialization import loads
+from app.utils.variables import HISTORY_COMPRESS_MIN_BYTES, HISTORY_ZSTD_LEVEL
+
+# Формат записи истории chat:{user_id}:history — первый байт записи.
+# Записи старого формата — JSON-строки {"role", "content"}, они начинаются с "{" и читаются как раньше.
+FORMAT_MSGPACK = 1
+FORMAT_MSGPACK_ZSTD = 2
+
+# Роль хранится номером; роли вне списка — строкой
+ROLES = ("user", "assistant", "system")
+_ROLE_CODES = {role: code for code, role in enumerate(ROLES)} | {"bot": 1}
+
+_compressor = zstandard.ZstdCompressor(level=HISTORY_ZSTD_LEVEL)
+_decompressor = zstandard.ZstdDecompressor()
+
+
+def encode_entry(role: str, content: str) -> bytes:
+    """
+    Запись истории: версия формата + msgpack [роль, текст]. Длинные сообщения
+    дополнительно сжимаются zstd, если это действительно уменьшает запись.
+    """
+    packed = msgpack.packb([_ROLE_CODES.get(role, role), content])
+    if len(packed) >= HISTORY_COMPRESS_MIN_BYTES:
+        compressed = _compressor.compress(packed)
+        if len(compressed) < len(packed):
+            return bytes((FORMAT_MSGPACK_ZSTD,)) + compressed
+    return bytes((FORMAT_MSGPACK,)) + packed
+
+
+def decode_entry(raw: bytes | str) -> dict:
+    """Запись истории любого формата -> {"role", "content"}"""
+    if isinstance(raw, str) or raw[:1] == b"{":
+        return loads(raw)
+    version, body = raw[0], raw[1:]
+    if version == FORMAT_MSGPACK_ZSTD:
+        body = _decompressor.decompress(body)
+    elif version != FORMAT_MSGPACK:
+        raise ValueError(f"Неизвестный формат записи истории: {version}")
+    role, content = msgpack.unpackb(body)
+    return {"role": ROLES[role] if isinstance(role, int) else role, "content": content}
+
+
+def encode_entries(entries: list[bytes | str]) -> bytes:
+    """Список записей истории одним значением (кэш сессии, загруженной из БД)"""
+    return msgpack.packb([entry.encode() if isinstance(entry, str) else entry for entry in entries])
+
+
+def decode_entries(raw: bytes) -> list[bytes | str]:
+    # Кэш старого формата — JSON-массив JSON-строк
+    if raw[:1] == b"[":
+        return loads(raw)
+    return msgpack.unpackb(raw)
+
+
+# Клиент Redis создан с decode_responses=True, а записи истории — байты:
+# их читают командами без декодирования ответа (для клиента и для pipeline)
+
+def lrange_raw(redis_client, key: str, start: int, end: int):
+    return redis_client.execute_command("LRANGE", key, start, end, **{NEVER_DECODE: []})
+
+
+def get_raw(redis_client, key: str):
+    return redis_client.execute_command("GET", key, **{NEVER_DECODE: []})
@@ -2,12 +2,13 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from dao.dao import ChatHistoryDAO
 
+HISTORY_PAGE_SIZE = 50
+
 
 async def get_user_sessions(user_id: int, session: AsyncSession):
-    messages = await ChatHistoryDAO.get_by_user(session, user_id)
+    """Сводка по сессиям пользователя; сообщения сессии подгружаются отдельно при раскрытии"""
+    return await ChatHistoryDAO.get_sessions_summary(session, user_id, limit=HISTORY_PAGE_SIZE)
 
-    sessions = {}
-    for msg in messages:
-        sessions.setdefault(msg.session_id, []).append(msg)
 
-    return sessions
\ No newline at end of file
+async def get_session_messages(user_id: int, session_id: str, session: AsyncSession):
+    return await ChatHistoryDAO.get_by_session(session, user_id, session_id)
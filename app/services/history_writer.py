@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime
+from uuid import uuid4
+
+from redis.exceptions import ResponseError
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models.chat_history import ChatHistory
+from app.models.chat_session import ChatSession, SESSION_TITLE_LENGTH
+from app.services.retrieval import enqueue as enqueue_for_retrieval
+from app.services.save_history_from_redis import _cleanup_old_sessions
+from app.utils.log import setup_logging
+from app.utils.redis import get_redis_client
+from database.db import async_session_maker
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "chat:history:stream"
+GROUP_NAME = "history-writers"
+BATCH_SIZE = 500
+BLOCK_MS = 1000
+# Через сколько миллисекунд неподтверждённая запись считается брошенной и забирается другим воркером
+CLAIM_IDLE_MS = 60_000
+# Потребитель без неподтверждённых записей, не читавший группу столько миллисекунд, считается
+# остановленным (перезапуск воркера меняет pid в имени) и удаляется из группы
+CONSUMER_IDLE_MS = 3_600_000
+PRUNE_INTERVAL = 600
+SESSIONS_LIMIT = 10
+# Сколько хранится в Redis копия сессии, загруженной из БД
+SESSION_CACHE_TTL = 3600
+
+redis_client = get_redis_client()
+
+
+def session_key(user_id: int) -> str:
+    return f"chat:{user_id}:session"
+
+
+def session_cache_key(user_id: int, session_id: str) -> str:
+    return f"chat:{user_id}:session_cache:{session_id}"
+
+
+async def current_session_id(user_id: int) -> str:
+    """Идентификатор текущей сессии чата пользователя; создаётся при первом обращении"""
+    key = session_key(user_id)
+    await redis_client.set(key, uuid4().hex, nx=True, ex=settings.CHAT_STATE_TTL)
+    return await redis_client.get(key)
+
+
+async def start_new_session(user_id: int, session_id: str | None = None) -> str:
+    """Начинает новую сессию (или продолжает загруженную из БД session_id)"""
+    session_id = session_id or uuid4().hex
+    await redis_client.set(session_key(user_id), session_id, ex=settings.CHAT_STATE_TTL)
+    return session_id
+
+
+def append_turn(pipe, user_id: int, session_id: str, user_message: str, reply: str, started_at: datetime):
+    """
+    Добавляет завершённый ход диалога в Redis Stream в составе переданного pipeline,
+    чтобы запись в историю и в очередь на сохранение была одной транзакцией.
+    """
+    pipe.xadd(STREAM_KEY, {
+        "turn_id": uuid4().hex,
+        "user_id": user_id,
+        "session_id": session_id,
+        "user": user_message,
+        "assistant": reply,
+        "user_ts": started_at.isoformat(),
+        "assistant_ts": datetime.now().isoformat(),
+    })
+
+
+def _session_rows(inserted) -> list[dict]:
+    """Агрегирует реально вставленные сообщения по сессиям для обновления chat_sessions"""
+    sessions = {}
+    for session_id, user_id, timestamp, role, message in inserted:
+        row = sessions.setdefault(session_id, {
+            "session_id": session_id,
+            "user_id": user_id,
+            "started_at": timestamp,
+            "last_message_at": timestamp,
+            "message_count": 0,
+            "title": None,
+        })
+        row["message_count"] += 1
+        row["started_at"] = min(row["started_at"], timestamp)
+        row["last_message_at"] = max(row["last_message_at"], timestamp)
+        if role == "user" and row["title"] is None:
+            row["title"] = message[:SESSION_TITLE_LENGTH]
+    return list(sessions.values())
+
+
+async def _upsert_sessions(db, rows: list[dict]):
+    stmt = insert(ChatSession)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["session_id"],
+        set_={
+            "message_count": ChatSession.message_count + stmt.excluded.message_count,
+            "started_at": func.least(ChatSession.started_at, stmt.excluded.started_at),
+            "last_message_at": func.greatest(ChatSession.last_message_at, stmt.excluded.last_message_at),
+            "title": func.coalesce(ChatSession.title, stmt.excluded.title),
+        },
+    )
+    await db.execute(stmt, rows)
+
+
+def _rows(entries) -> list[dict]:
+    rows = []
+    for _, fields in entries:
+        for role in ("user", "assistant"):
+            rows.append({
+                # Ключ идемпотентности: повторная доставка записи не создаёт дубликатов
+                "message_key": f"{fields['turn_id']}:{role}",
+                "user_id": int(fields["user_id"]),
+                "session_id": fields["session_id"],
+                "role": role,
+                "message": fields[role],
+                "timestamp": datetime.fromisoformat(fields[f"{role}_ts"]),
+            })
+    return rows
+
+
+class HistoryWriter:
+    """
+    Фоновая запись истории чата в Postgres (write-behind).
+
+    Читает ходы диалога из Redis Stream через consumer group, пачками вставляет
+    их в chathistorys и только после commit подтверждает (XACK) — доставка
+    at-least-once, дубликаты отсекаются по уникальному message_key.
+    Несколько реплик приложения делят одну группу; записи упавшего воркера
+    забираются остальными через XAUTOCLAIM, а сами остановленные потребители
+    раз в PRUNE_INTERVAL удаляются из группы (prune_consumers).
+    """
+
+    def __init__(self, consumer_name: str | None = None):
+        self.consumer_name = consumer_name or f"{socket.gethostname()}-{os.getpid()}"
+        self._task: asyncio.Task | None = None
+        self._pruned_at = 0.0
+
+    async def _ensure_group(self):
+        try:
+            await redis_client.xgroup_create(STREAM_KEY, GROUP_NAME, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _read_batch(self):
+        # Сначала забираем записи, зависшие у упавших (или у нас самих после ошибки) воркеров
+        claimed = await redis_client.xautoclaim(
+            STREAM_KEY, GROUP_NAME, self.consumer_name, min_idle_time=CLAIM_IDLE_MS, start_id="0-0", count=BATCH_SIZE
+        )
+        if claimed[1]:
+            return claimed[1]
+        response = await redis_client.xreadgroup(
+            GROUP_NAME, self.consumer_name, {STREAM_KEY: ">"}, count=BATCH_SIZE, block=BLOCK_MS
+        )
+        return response[0][1] if response else []
+
+    async def prune_consumers(self) -> list[str]:
+        """
+        Удаляет из группы потребителей остановленных воркеров (XGROUP DELCONSUMER).
+        Потребитель с неподтверждёнными записями не трогаем: их заберёт XAUTOCLAIM,
+        а удаление потребителя вместе с ними потеряло бы эти записи из PEL.
+        """
+        consumers = await redis_client.xinfo_consumers(STREAM_KEY, GROUP_NAME)
+        stale = [
+            consumer["name"] for consumer in consumers
+            if consumer["name"] != self.consumer_name and not consumer["pending"]
+            and consumer["idle"] >= CONSUMER_IDLE_MS
+        ]
+        removed = []
+        for name in stale:
+            # Между XINFO и удалением потребитель мог получить записи — проверяем ещё раз
+            if not (await redis_client.xpending_range(STREAM_KEY, GROUP_NAME, "-", "+", 1, consumername=name)):
+                await redis_client.xgroup_delconsumer(STREAM_KEY, GROUP_NAME, name)
+                removed.append(name)
+        if removed:
+            logger.info("Удалены остановленные потребители: %s", ", ".join(removed))
+        return removed
+
+    async def flush(self, entries):
+        rows = _rows(entries)
+        async with async_session_maker() as db:
+            stmt = (
+                insert(ChatHistory)
+                .on_conflict_do_nothing(index_elements=["message_key"])
+                .returning(ChatHistory.session_id, ChatHistory.user_id, ChatHistory.timestamp,
+                           ChatHistory.role, ChatHistory.message)
+            )
+            # RETURNING отдаёт только вставленные строки — повторная доставка не увеличит счётчики сессий
+            inserted = (await db.execute(stmt, rows)).all()
+            session_rows = _session_rows(inserted)
+            if session_rows:
+                await _upsert_sessions(db, session_rows)
+            await db.commit()
+            for user_id in {row["user_id"] for row in rows}:
+                await _cleanup_old_sessions(db, user_id, sessions_limit=SESSIONS_LIMIT)
+
+        ids = [entry_id for entry_id, _ in entries]
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.xack(STREAM_KEY, GROUP_NAME, *ids)
+            pipe.xdel(STREAM_KEY, *ids)
+            # Новые сообщения в БД — их нужно дописать в индекс поиска по истории
+            enqueue_for_retrieval(pipe, *{row["user_id"] for row in rows})
+            await pipe.execute()
+        logger.info("Сохранено %d сообщений в БД (%d ходов)", len(rows), len(entries))
+
+    async def run(self):
+        await self._ensure_group()
+        while True:
+            try:
+                entries = await self._read_batch()
+                if entries:
+                    await self.flush(entries)
+                if time.monotonic() - self._pruned_at >= PRUNE_INTERVAL:
+                    self._pruned_at = time.monotonic()
+                    await self.prune_consumers()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Записи остаются неподтверждёнными и будут повторно обработаны
+                logger.exception("Ошибка при сохранении истории")
+                await asyncio.sleep(1)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+history_writer = HistoryWriter()
+
+
+if __name__ == "__main__":
+    # Отдельный пул воркеров: python -m app.services.history_writer
+    setup_logging()
+    asyncio.run(HistoryWriter().run())
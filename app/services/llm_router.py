@@ -0,0 +1,252 @@
+import asyncio
+import json
+import logging
+import statistics
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Окно статистики по эндпоинту и правила отключения нездоровых
+STATS_WINDOW = 100
+MIN_SAMPLES_FOR_HEDGE = 20
+MAX_ERROR_RATE = 0.5
+FAILURES_TO_OPEN = 3
+COOLDOWN_SECONDS = 30
+
+
+@dataclass
+class Endpoint:
+    family: str
+    name: str
+    base_url: str
+    api_key: str
+    # Имя модели на этом эндпоинте, если оно отличается от запрошенного (например, локальный сервер)
+    model: str | None = None
+    latencies: deque = field(default_factory=lambda: deque(maxlen=STATS_WINDOW))
+    outcomes: deque = field(default_factory=lambda: deque(maxlen=STATS_WINDOW))
+    consecutive_failures: int = 0
+    open_until: float = 0.0
+
+    def record(self, latency: float | None, ok: bool):
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(latency)
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= FAILURES_TO_OPEN:
+                self.open_until = time.monotonic() + COOLDOWN_SECONDS
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.open_until and self.error_rate < MAX_ERROR_RATE
+
+    def quantile(self, q: float) -> float | None:
+        if len(self.latencies) < 2:
+            return None
+        return statistics.quantiles(self.latencies, n=100, method="inclusive")[int(q * 100) - 1]
+
+
+class _Completions:
+    def __init__(self, router: "LLMRouter", family: str):
+        self._router = router
+        self._family = family
+
+    async def create(self, **kwargs):
+        return await self._router.create(self._family, **kwargs)
+
+
+class _Chat:
+    def __init__(self, router: "LLMRouter", family: str):
+        self.completions = _Completions(router, family)
+
+
+class RoutedClient:
+    """Клиент с интерфейсом AsyncOpenAI (chat.completions.create), запросы которого идут через LLMRouter"""
+
+    def __init__(self, router: "LLMRouter", family: str):
+        self.chat = _Chat(router, family)
+
+
+class LLMRouter:
+    """
+    Маршрутизация запросов между несколькими эндпоинтами одного семейства моделей
+    (OpenAI, DeepSeek, любой OpenAI-совместимый сервер).
+
+    По каждому эндпоинту ведётся скользящая статистика задержки (для потоковых
+    ответов — время до первого токена) и доли ошибок. Запрос уходит на самый
+    быстрый здоровый эндпоинт, при ошибке — на следующий. Эндпоинт после
+    FAILURES_TO_OPEN ошибок подряд выключается на COOLDOWN_SECONDS.
+
+    При включённом хеджировании, если первый эндпоинт не ответил за свой p95,
+    запускается запрос на второй; побеждает первый ответивший, второй отменяется.
+    """
+
+    def __init__(self, client_factory, hedging: bool = False):
+        self._client_factory = client_factory
+        self._hedging = hedging
+        self._endpoints: dict[str, list[Endpoint]] = {}
+
+    def add(self, endpoint: Endpoint):
+        self._endpoints.setdefault(endpoint.family, []).append(endpoint)
+
+    def client(self, family: str) -> RoutedClient:
+        return RoutedClient(self, family)
+
+    def candidates(self, family: str) -> list[Endpoint]:
+        """Эндпоинты по возрастанию p50; без статистики — первыми, чтобы её набрать; нездоровые — в конце"""
+        endpoints = self._endpoints.get(family, [])
+
+        def sort_key(endpoint: Endpoint):
+            p50 = endpoint.quantile(0.5)
+            return (not endpoint.healthy, p50 is not None, p50 or 0.0)
+
+        return sorted(endpoints, key=sort_key)
+
+    async def _attempt(self, endpoint: Endpoint, kwargs: dict):
+        """
+        Один запрос к эндпоинту. Для потока ответом считается первый чанк:
+        возвращается (поток, первый чанк), задержка записывается как TTFT.
+        """
+        client = self._client_factory(endpoint.base_url, endpoint.api_key)
+        request = dict(kwargs, model=endpoint.model or kwargs["model"])
+        started = time.monotonic()
+        try:
+            response = await client.chat.completions.create(**request)
+            if request.get("stream"):
+                try:
+                    first = await response.__anext__()
+                except StopAsyncIteration:
+                    first = None
+                except BaseException:
+                    # Поток уже открыт: при ошибке или отмене (проигрыш в хедже) закрываем соединение
+                    await response.close()
+                    raise
+                response = (response, first)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            endpoint.record(None, ok=False)
+            raise
+        endpoint.record(time.monotonic() - started, ok=True)
+        return response
+
+    async def _race(self, primary: Endpoint, backup: Endpoint, kwargs: dict):
+        """Хеджированный запрос: backup стартует, если primary не ответил за свой p95"""
+        first = asyncio.create_task(self._attempt(primary, kwargs))
+        done, _ = await asyncio.wait({first}, timeout=primary.quantile(0.95))
+        if done:
+            if first.exception() is None:
+                return first.result()
+            # primary упал раньше своего p95 — backup запускается сразу, а не пропускается
+            logger.warning("Эндпоинт %s недоступен: %s", primary.name, first.exception(),
+                           extra={"endpoint": primary.name})
+            return await self._attempt(backup, kwargs)
+
+        second = asyncio.create_task(self._attempt(backup, kwargs))
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winners = [task for task in done if task.exception() is None]
+            if winners:
+                for loser in pending:
+                    loser.cancel()
+                # Проигравший мог успеть ответить до отмены — как и одновременный ответ, его поток закрываем
+                for result in await asyncio.gather(*pending, return_exceptions=True):
+                    if not isinstance(result, BaseException):
+                        await self._discard(result)
+                for extra in winners[1:]:
+                    await self._discard(extra.result())
+                return winners[0].result()
+            error = next(iter(done)).exception()
+        raise error
+
+    @staticmethod
+    async def _discard(response):
+        if isinstance(response, tuple):
+            await response[0].close()
+
+    async def create(self, family: str, **kwargs):
+        candidates = self.candidates(family)
+        if not candidates:
+            raise RuntimeError(f"Нет эндпоинтов для семейства моделей {family}")
+
+        error = None
+        i = 0
+        while i < len(candidates):
+            endpoint = candidates[i]
+            backup = candidates[i + 1] if i + 1 < len(candidates) else None
+            hedge = (self._hedging and backup is not None and backup.healthy
+                     and len(endpoint.latencies) >= MIN_SAMPLES_FOR_HEDGE)
+            try:
+                if hedge:
+                    response = await self._race(endpoint, backup, kwargs)
+                    i += 2
+                else:
+                    response = await self._attempt(endpoint, kwargs)
+                    i += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Переходим на следующий эндпоинт (после хеджа — на следующий за обоими)
+                name = f"{endpoint.name}, {backup.name}" if hedge else endpoint.name
+                logger.warning("Эндпоинт %s недоступен: %s", name, e, extra={"endpoint": name})
+                error = e
+                i += 2 if hedge else 1
+                continue
+
+            if kwargs.get("stream"):
+                return self._replay(*response)
+            return response
+        raise error
+
+    @staticmethod
+    async def _replay(stream, first):
+        """Поток с уже полученным первым чанком; соединение с провайдером закрывается и при досрочной остановке"""
+        try:
+            if first is None:
+                return
+            yield first
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.close()
+
+    def metrics(self) -> list[dict]:
+        return [
+            {
+                "family": endpoint.family,
+                "name": endpoint.name,
+                "healthy": endpoint.healthy,
+                "p50": endpoint.quantile(0.5),
+                "p95": endpoint.quantile(0.95),
+                "error_rate": endpoint.error_rate,
+                "samples": len(endpoint.outcomes),
+            }
+            for endpoints in self._endpoints.values()
+            for endpoint in endpoints
+        ]
+
+
+def load_endpoints(router: LLMRouter, default_endpoints: list[Endpoint]):
+    """Эндпоинты по умолчанию плюс дополнительные из settings.LLM_ENDPOINTS"""
+    for endpoint in default_endpoints:
+        router.add(endpoint)
+    if settings.LLM_ENDPOINTS:
+        for item in json.loads(settings.LLM_ENDPOINTS):
+            router.add(Endpoint(
+                family=item["family"],
+                name=item.get("name", item["base_url"]),
+                base_url=item["base_url"],
+                api_key=item.get("api_key", "local"),
+                model=item.get("model"),
+            ))
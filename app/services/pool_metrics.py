@@ -0,0 +1,78 @@
+import asyncio
+import logging
+
+from app.services.get_ai import client_registry
+from app.utils.redis import get_redis_client
+from app.utils.telemetry import (
+    DB_POOL_IN_USE, DB_POOL_OVERFLOW, DB_POOL_SIZE, DB_POOL_UTILIZATION, PROVIDER_POOL_CONNECTIONS,
+    PROVIDER_POOL_IN_USE, REDIS_POOL_IN_USE, REDIS_POOL_SIZE,
+)
+from database.db import engine
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Как часто процесс обновляет метрики своих пулов, секунд
+POOL_SAMPLE_INTERVAL = 5
+
+
+class PoolMetrics:
+    """
+    Метрики насыщения пулов соединений процесса: провайдеры ИИ, БД, Redis.
+
+    Значения снимаются по публичной статистике пулов и пишутся в обычные Gauge —
+    раз в POOL_SAMPLE_INTERVAL и перед отдачей /metrics. В отличие от set_function,
+    такие значения попадают в файлы multiprocess-режима prometheus_client, поэтому
+    под gunicorn /metrics показывает сумму по всем живым воркерам, а не по одному.
+    """
+
+    def __init__(self, redis_client):
+        self._redis = redis_client
+        self._task: asyncio.Task | None = None
+
+    def sample(self) -> dict:
+        providers = client_registry.metrics()
+        pool = engine.pool
+        redis_pool = self._redis.connection_pool
+        values = {
+            "provider_in_use": providers["in_use"],
+            "provider_connections": providers["connections"],
+            "db_in_use": pool.checkedout(),
+            "db_size": pool.size(),
+            "db_overflow": max(pool.overflow(), 0),
+            "redis_in_use": redis_pool.in_use,
+            "redis_size": redis_pool.max_connections,
+        }
+        PROVIDER_POOL_IN_USE.set(values["provider_in_use"])
+        PROVIDER_POOL_CONNECTIONS.set(values["provider_connections"])
+        DB_POOL_IN_USE.set(values["db_in_use"])
+        DB_POOL_SIZE.set(values["db_size"])
+        DB_POOL_OVERFLOW.set(values["db_overflow"])
+        DB_POOL_UTILIZATION.set(values["db_in_use"] / (settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW))
+        REDIS_POOL_IN_USE.set(values["redis_in_use"])
+        REDIS_POOL_SIZE.set(values["redis_size"])
+        return values
+
+    async def run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception:
+                logger.exception("Ошибка снятия метрик пулов соединений")
+            await asyncio.sleep(POOL_SAMPLE_INTERVAL)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+pool_metrics = PoolMetrics(get_redis_client())
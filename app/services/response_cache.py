@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import json
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from app.utils.redis import get_redis_client
+from app.utils.variables import (
+    RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL, SEMANTIC_CACHE_MODEL, SEMANTIC_CACHE_SIZE,
+    SEMANTIC_CACHE_THRESHOLD,
+)
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # семантический уровень необязателен
+    SentenceTransformer = None
+
+CACHE_PREFIX = "chat:response_cache"
+LRU_KEY = f"{CACHE_PREFIX}:lru"
+
+
+@dataclass
+class CacheLookup:
+    key: str
+    scope: str
+    prompt: str | None
+    reply: str | None = None
+    tier: str | None = None
+    # Эмбеддинг prompt, посчитанный при поиске: store переиспользует его для индекса
+    vector: np.ndarray | None = None
+
+
+class _SemanticIndex:
+    """
+    Индекс эмбеддингов последних запросов в памяти процесса (кольцевой буфер).
+    Поиск — косинусное сходство нормированных векторов через скалярное произведение.
+    """
+
+    def __init__(self, size: int):
+        self._size = size
+        self._vectors: np.ndarray | None = None
+        self._keys: list[str | None] = [None] * size
+        self._scopes: list[str | None] = [None] * size
+        self._next = 0
+
+    def add(self, vector: np.ndarray, scope: str, key: str):
+        if self._vectors is None:
+            self._vectors = np.zeros((self._size, vector.shape[0]), dtype=np.float32)
+        self._vectors[self._next] = vector
+        self._keys[self._next] = key
+        self._scopes[self._next] = scope
+        self._next = (self._next + 1) % self._size
+
+    def search(self, vector: np.ndarray, scope: str, threshold: float) -> str | None:
+        if self._vectors is None:
+            return None
+        scores = self._vectors @ vector
+        for i in np.argsort(scores)[::-1]:
+            if scores[i] < threshold:
+                return None
+            if self._scopes[i] == scope:
+                return self._keys[i]
+        return None
+
+
+class ResponseCache:
+    """
+    Кэш ответов модели в Redis перед вызовом провайдера.
+
+    Точный уровень: ключ — хэш модели, параметров генерации и всего payload
+    (системный промпт, история, сообщение). Записи живут RESPONSE_CACHE_TTL,
+    число записей ограничено RESPONSE_CACHE_MAX_ENTRIES с вытеснением давно
+    не использованных (sorted set со временем последнего обращения).
+
+    Семантический уровень (опционально, нужен sentence-transformers): для
+    вопросов без истории ищет похожий ранее заданный вопрос с тем же
+    системным промптом и параметрами.
+    """
+
+    def __init__(self, redis_client):
+        self._redis = redis_client
+        self._index = _SemanticIndex(SEMANTIC_CACHE_SIZE)
+        self._encoder = None
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+
+    @staticmethod
+    def _digest(payload) -> str:
+        return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+    async def _embed(self, text: str) -> np.ndarray:
+        if self._encoder is None:
+            self._encoder = await asyncio.to_thread(SentenceTransformer, SEMANTIC_CACHE_MODEL, device="cpu")
+        vector = await asyncio.to_thread(self._encoder.encode, text, normalize_embeddings=True)
+        return np.asarray(vector, dtype=np.float32)
+
+    async def lookup(self, messages: list[dict], model: str, temperature: float, frequency_penalty: float,
+                     presence_penalty: float, semantic: bool = False) -> CacheLookup:
+        params = [model, temperature, frequency_penalty, presence_penalty]
+        key = f"{CACHE_PREFIX}:{self._digest(params + [messages])}"
+        # Семантический поиск имеет смысл только для самостоятельных вопросов (system + user)
+        standalone = semantic and SentenceTransformer is not None and len(messages) == 2
+        lookup = CacheLookup(
+            key=key,
+            scope=self._digest(params + [messages[0]["content"]]),
+            prompt=messages[-1]["content"] if standalone else None,
+        )
+
+        reply = await self._redis.get(key)
+        if reply is not None:
+            lookup.reply, lookup.tier = reply, "exact"
+        elif lookup.prompt is not None:
+            lookup.vector = await self._embed(lookup.prompt)
+            similar_key = self._index.search(lookup.vector, lookup.scope, SEMANTIC_CACHE_THRESHOLD)
+            if similar_key is not None:
+                reply = await self._redis.get(similar_key)
+                if reply is not None:
+                    lookup.key, lookup.reply, lookup.tier = similar_key, reply, "semantic"
+
+        if lookup.reply is None:
+            self.stats["misses"] += 1
+        else:
+            self.stats[f"{lookup.tier}_hits"] += 1
+            await self._redis.zadd(LRU_KEY, {lookup.key: time.time()})
+        return lookup
+
+    async def store(self, lookup: CacheLookup, reply: str):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.set(lookup.key, reply, ex=RESPONSE_CACHE_TTL)
+            pipe.zadd(LRU_KEY, {lookup.key: time.time()})
+            pipe.zcard(LRU_KEY)
+            _, _, size = await pipe.execute()
+
+        # Вытесняем давно не использованные записи сверх лимита
+        if size > RESPONSE_CACHE_MAX_ENTRIES:
+            evicted = await self._redis.zpopmin(LRU_KEY, size - RESPONSE_CACHE_MAX_ENTRIES)
+            if evicted:
+                await self._redis.delete(*(key for key, _ in evicted))
+
+        if lookup.prompt is not None:
+            vector = lookup.vector if lookup.vector is not None else await self._embed(lookup.prompt)
+            self._index.add(vector, lookup.scope, lookup.key)
+
+    def metrics(self) -> dict:
+        total = sum(self.stats.values())
+        hits = self.stats["exact_hits"] + self.stats["semantic_hits"]
+        return {**self.stats, "hit_rate": hits / total if total else 0.0}
+
+
+response_cache = ResponseCache(get_redis_client())
@@ -0,0 +1,313 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+
+import numpy as np
+from redis.exceptions import ResponseError
+from sqlalchemy import select
+
+from app.models.chat_history import ChatHistory
+from app.services.user_config import config_cache
+from app.utils.redis import get_redis_client
+from app.utils.variables import (
+    RETRIEVAL_BATCH_SIZE, RETRIEVAL_MIN_SCORE, RETRIEVAL_MODEL, RETRIEVAL_SNIPPET_CHARS, RETRIEVAL_TOP_K,
+)
+from database.db import async_session_maker
+from settings import settings
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # без модели эмбеддингов поиск по прошлым сессиям отключён
+    SentenceTransformer = None
+
+logger = logging.getLogger(__name__)
+
+# Пользователи, у которых появились новые сообщения в БД (заполняет HistoryWriter).
+# Индекс лежит в локальных файлах каждого хоста, поэтому событие должен получить каждый хост:
+# у хоста своя consumer group, а воркеры хоста делят её между собой.
+INDEX_STREAM_KEY = "chat:retrieval:stream"
+INDEX_STREAM_MAXLEN = 10_000
+INDEX_READ_COUNT = 16
+LOCK_TTL = 300
+POLL_INTERVAL = 5
+# Поиск идёт блоками строк, чтобы не переводить в float32 весь индекс сразу
+SEARCH_BLOCK_ROWS = 16384
+# Кандидатов на блок — с запасом на отброшенные сообщения текущей сессии
+CANDIDATES_FACTOR = 4
+
+
+def enqueue(pipe, *user_ids: int):
+    """Ставит пользователей в очередь на индексацию на всех хостах (в составе переданного pipeline)"""
+    for user_id in user_ids:
+        pipe.xadd(INDEX_STREAM_KEY, {"user_id": user_id}, maxlen=INDEX_STREAM_MAXLEN, approximate=True)
+    return pipe
+
+
+class UserIndex:
+    """
+    Файловый индекс сообщений одного пользователя:
+    {uid}.vec  — нормированные эмбеддинги float16 подряд, читаются через memmap;
+    {uid}.meta — JSON-строки с фрагментами сообщений, {uid}.off — смещения этих строк (uint64);
+    {uid}.json — состояние: число записей, размерность, модель, последний проиндексированный id.
+
+    Видны только первые count записей из состояния. Состояние заменяется атомарно
+    после дозаписи, поэтому хвост, оставшийся от прерванной дозаписи, отбрасывается.
+    """
+
+    def __init__(self, directory: str, user_id: int):
+        base = os.path.join(directory, str(user_id))
+        self.vec_path = f"{base}.vec"
+        self.meta_path = f"{base}.meta"
+        self.off_path = f"{base}.off"
+        self.state_path = f"{base}.json"
+
+    def state(self) -> dict:
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"count": 0, "dim": None, "model": None, "last_id": 0, "meta_size": 0}
+
+    def _save_state(self, state: dict):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def reset(self):
+        for path in (self.vec_path, self.meta_path, self.off_path, self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def append(self, vectors: np.ndarray, records: list[dict], last_id: int, model: str):
+        state = self.state()
+        count = state["count"]
+        if records:
+            dim = vectors.shape[1]
+            with open(self.vec_path, "ab") as vec, open(self.off_path, "ab") as off, \
+                    open(self.meta_path, "ab") as meta:
+                vec.truncate(count * dim * 2)
+                off.truncate(count * 8)
+                meta.truncate(state["meta_size"])
+
+                position = state["meta_size"]
+                offsets = []
+                for record in records:
+                    line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+                    offsets.append(position)
+                    meta.write(line)
+                    position += len(line)
+                off.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+                vec.write(np.ascontiguousarray(vectors, dtype=np.float16).tobytes())
+            state.update(count=count + len(records), dim=dim, meta_size=position)
+        state.update(last_id=last_id, model=model)
+        self._save_state(state)
+
+    def search(self, query: np.ndarray, k: int, exclude_session: str | None = None) -> list[dict]:
+        state = self.state()
+        count, dim = state["count"], state["dim"]
+        if not count:
+            return []
+
+        vectors = np.memmap(self.vec_path, dtype=np.float16, mode="r", shape=(count, dim))
+        query = np.asarray(query, dtype=np.float32)
+        candidates = k * CANDIDATES_FACTOR
+        block_scores, block_ids = [], []
+        for start in range(0, count, SEARCH_BLOCK_ROWS):
+            scores = np.asarray(vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32) @ query
+            if len(scores) > candidates:
+                top = np.argpartition(-scores, candidates - 1)[:candidates]
+            else:
+                top = np.arange(len(scores))
+            block_scores.append(scores[top])
+            block_ids.append(top + start)
+        scores = np.concatenate(block_scores)
+        ids = np.concatenate(block_ids)
+
+        offsets = np.memmap(self.off_path, dtype=np.uint64, mode="r", shape=(count,))
+        results = []
+        with open(self.meta_path, "rb") as meta:
+            for i in np.argsort(-scores):
+                if scores[i] < RETRIEVAL_MIN_SCORE:
+                    break
+                meta.seek(int(offsets[ids[i]]))
+                record = json.loads(meta.readline())
+                # Сообщения текущей сессии и так есть в контексте
+                if record["session_id"] == exclude_session:
+                    continue
+                record["score"] = float(scores[i])
+                results.append(record)
+                if len(results) == k:
+                    break
+        return results
+
+
+class RetrievalIndex:
+    """
+    Поиск по прошлым сессиям пользователя (включается в конфиге, поле retrieval).
+
+    Сообщения из chathistorys кодируются локальной моделью эмбеддингов на CPU
+    пачками по RETRIEVAL_BATCH_SIZE и дописываются в файловый индекс пользователя
+    (UserIndex) — инкрементально, по возрастанию id, в фоновой задаче. Индекс
+    переживает удаление старых сессий из БД, поэтому бот может вспомнить и их.
+
+    Файлы индекса локальны для хоста: каждый хост читает очередь через свою
+    consumer group и дописывает свою копию индекса, а блокировка пользователя
+    берётся в пределах хоста — она разводит только воркеры, пишущие в одни файлы.
+    """
+
+    def __init__(self, redis_client, directory: str, host: str | None = None):
+        self._redis = redis_client
+        self._directory = directory
+        self.host = host or socket.gethostname()
+        self._group = f"retrieval:{self.host}"
+        self._encoder = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def available(self) -> bool:
+        return SentenceTransformer is not None
+
+    def _index(self, user_id: int) -> UserIndex:
+        return UserIndex(self._directory, user_id)
+
+    async def _encode(self, texts: list[str]) -> np.ndarray:
+        if self._encoder is None:
+            self._encoder = await asyncio.to_thread(SentenceTransformer, RETRIEVAL_MODEL, device="cpu")
+        return await asyncio.to_thread(
+            self._encoder.encode, texts, batch_size=64, normalize_embeddings=True, convert_to_numpy=True
+        )
+
+    async def search(self, user_id: int, query: str, exclude_session: str | None = None,
+                     k: int = RETRIEVAL_TOP_K) -> list[dict]:
+        """Самые близкие к запросу сообщения из прошлых сессий пользователя"""
+        if not self.available:
+            return []
+        vector = (await self._encode([query]))[0]
+        return await asyncio.to_thread(self._index(user_id).search, vector, k, exclude_session)
+
+    async def index_user(self, user_id: int) -> int:
+        """Дописывает в индекс сообщения, сохранённые после последнего проиндексированного id"""
+        index = self._index(user_id)
+        os.makedirs(self._directory, exist_ok=True)
+        state = await asyncio.to_thread(index.state)
+        if state["model"] not in (None, RETRIEVAL_MODEL):
+            # Сменилась модель — векторы несовместимы, индекс строится заново
+            await asyncio.to_thread(index.reset)
+            state = await asyncio.to_thread(index.state)
+
+        last_id = state["last_id"]
+        indexed = 0
+        while True:
+            async with async_session_maker() as db:
+                result = await db.execute(
+                    select(ChatHistory.id, ChatHistory.session_id, ChatHistory.role, ChatHistory.message,
+                           ChatHistory.timestamp)
+                    .where(ChatHistory.user_id == user_id, ChatHistory.id > last_id)
+                    .order_by(ChatHistory.id)
+                    .limit(RETRIEVAL_BATCH_SIZE)
+                )
+                rows = result.all()
+            if not rows:
+                break
+
+            rows_with_text = [row for row in rows if row.message and row.message.strip()]
+            vectors = await self._encode([row.message for row in rows_with_text]) if rows_with_text else None
+            records = [
+                {
+                    "id": row.id,
+                    "session_id": row.session_id,
+                    "role": row.role,
+                    "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+                    "text": row.message[:RETRIEVAL_SNIPPET_CHARS],
+                }
+                for row in rows_with_text
+            ]
+            last_id = rows[-1].id
+            await asyncio.to_thread(index.append, vectors, records, last_id, RETRIEVAL_MODEL)
+            indexed += len(records)
+            if len(rows) < RETRIEVAL_BATCH_SIZE:
+                break
+        return indexed
+
+    async def _requeue(self, user_id: int):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            await enqueue(pipe, user_id).execute()
+
+    async def _index_if_enabled(self, user_id: int):
+        config = await config_cache.get(user_id)
+        if not config.retrieval:
+            return
+        # Один пользователь индексируется одним воркером хоста
+        lock_key = f"chat:retrieval:lock:{self.host}:{user_id}"
+        if not await self._redis.set(lock_key, 1, nx=True, ex=LOCK_TTL):
+            await self._requeue(user_id)
+            return
+        try:
+            indexed = await self.index_user(user_id)
+            if indexed:
+                logger.info("Проиндексировано %d сообщений", indexed, extra={"user_id": user_id})
+        except Exception:
+            await self._requeue(user_id)
+            raise
+        finally:
+            await self._redis.delete(lock_key)
+
+    async def _ensure_group(self):
+        try:
+            # Новый хост начинает с событий, ещё оставшихся в потоке
+            await self._redis.xgroup_create(INDEX_STREAM_KEY, self._group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def poll(self) -> list[int]:
+        """Индексирует пользователей из очередной порции событий группы этого хоста"""
+        response = await self._redis.xreadgroup(
+            # Порции всегда подтверждаются, поэтому воркеры хоста читают под одним именем потребителя
+            self._group, self.host, {INDEX_STREAM_KEY: ">"}, count=INDEX_READ_COUNT
+        )
+        entries = response[0][1] if response else []
+        if not entries:
+            return []
+        # Повторные события одного пользователя в порции — одна дозапись индекса
+        user_ids = list(dict.fromkeys(int(fields["user_id"]) for _, fields in entries))
+        try:
+            for user_id in user_ids:
+                try:
+                    await self._index_if_enabled(user_id)
+                except Exception:
+                    # Пользователь уже снова поставлен в очередь (_index_if_enabled)
+                    logger.exception("Ошибка индексации истории", extra={"user_id": user_id})
+        finally:
+            await self._redis.xack(INDEX_STREAM_KEY, self._group, *(entry_id for entry_id, _ in entries))
+        return user_ids
+
+    async def run(self):
+        await self._ensure_group()
+        while True:
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка индексации истории")
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def start(self):
+        if self._task is None and self.available:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+retrieval_index = RetrievalIndex(get_redis_client(), settings.RETRIEVAL_INDEX_DIR)
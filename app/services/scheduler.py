@@ -0,0 +1,291 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from uuid import uuid4
+
+from fastapi import HTTPException, status
+
+from app.utils.redis import get_redis_client
+from app.utils.variables import (
+    PROVIDER_MAX_CONCURRENT, PROVIDER_TOKENS_PER_MINUTE, REPLY_TOKEN_RESERVE, SCHEDULER_QUEUE_TIMEOUT,
+    USER_MAX_CONCURRENT, USER_TOKENS_PER_MINUTE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: меньше — важнее
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Аренда слота истекает сама, если процесс упал и не освободил его
+LEASE_TTL = 300
+# Как часто диспетчер повторяет попытки, даже если его не будили
+DISPATCH_INTERVAL = 0.1
+
+# Оценка стоимости запроса: символов промпта на токен (с запасом для кириллицы)
+CHARS_PER_TOKEN = 3
+
+# Одна попытка выдать слоты всем ожидающим билетам процесса — за одно обращение к Redis.
+# Для каждого билета: лимиты параллельности (sorted set аренд) и token bucket (хэш tokens/ts)
+# пользователя и провайдера. Слот выдаётся, только если в обоих bucket'ах хватает токенов
+# на оценку стоимости запроса, и эта оценка сразу резервируется (списывается); разницу
+# с фактическим расходом выравнивает RELEASE_SCRIPT. Пользователь или провайдер, упёршийся
+# в лимит, пропускается до конца прохода, чтобы более дешёвые билеты из конца очереди
+# не обгоняли более ранние.
+# KEYS — по 4 ключа на билет (_keys); ARGV — now, lease_ttl, лимиты пользователя и
+# по 4 значения на билет: lease_id, стоимость, лимиты провайдера.
+# Возвращает по числу на билет: 0 — слот выдан, 1 — упёрлись в лимиты пользователя, 2 — провайдера.
+DISPATCH_SCRIPT = """
+local now = tonumber(ARGV[1])
+local lease_ttl = tonumber(ARGV[2])
+local user_max = tonumber(ARGV[3])
+local user_rate = tonumber(ARGV[4])
+local blocked = {}
+local results = {}
+
+local function bucket_tokens(key, per_minute)
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or per_minute
+    local ts = tonumber(state[2]) or now
+    return math.min(per_minute, tokens + (now - ts) * per_minute / 60)
+end
+
+local function leases(key)
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now)
+    return redis.call('ZCARD', key)
+end
+
+for i = 0, #KEYS / 4 - 1 do
+    local user_leases, provider_leases, user_bucket, provider_bucket = KEYS[i * 4 + 1], KEYS[i * 4 + 2],
+        KEYS[i * 4 + 3], KEYS[i * 4 + 4]
+    local lease_id = ARGV[i * 4 + 5]
+    local cost = tonumber(ARGV[i * 4 + 6])
+    local provider_max = tonumber(ARGV[i * 4 + 7])
+    local provider_rate = tonumber(ARGV[i * 4 + 8])
+    -- Запрос дороже минутного лимита резервирует весь bucket, а не ждёт вечно
+    local user_cost = math.min(cost, user_rate)
+    local provider_cost = math.min(cost, provider_rate)
+
+    local result
+    if blocked[provider_leases] then
+        result = 2
+    elseif blocked[user_leases] then
+        result = 1
+    else
+        local user_tokens = bucket_tokens(user_bucket, user_rate)
+        local provider_tokens = bucket_tokens(provider_bucket, provider_rate)
+        if leases(user_leases) >= user_max or user_tokens < user_cost then
+            blocked[user_leases] = true
+            result = 1
+        elseif leases(provider_leases) >= provider_max or provider_tokens < provider_cost then
+            blocked[provider_leases] = true
+            result = 2
+        else
+            redis.call('ZADD', user_leases, now + lease_ttl, lease_id)
+            redis.call('ZADD', provider_leases, now + lease_ttl, lease_id)
+            redis.call('EXPIRE', user_leases, lease_ttl)
+            redis.call('EXPIRE', provider_leases, lease_ttl)
+            redis.call('HSET', user_bucket, 'tokens', user_tokens - user_cost, 'ts', now)
+            redis.call('HSET', provider_bucket, 'tokens', provider_tokens - provider_cost, 'ts', now)
+            redis.call('EXPIRE', user_bucket, 120)
+            redis.call('EXPIRE', provider_bucket, 120)
+            result = 0
+        end
+    end
+    results[i + 1] = result
+end
+return results
+"""
+
+# Освобождение слота и расчёт по токенам: возвращает в оба bucket'а резерв,
+# сделанный при выдаче слота, и списывает фактический расход
+RELEASE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local lease_id = ARGV[2]
+local reserved = tonumber(ARGV[3])
+local used = tonumber(ARGV[4])
+
+redis.call('ZREM', KEYS[1], lease_id)
+redis.call('ZREM', KEYS[2], lease_id)
+
+for i, per_minute in ipairs({tonumber(ARGV[5]), tonumber(ARGV[6])}) do
+    local key = KEYS[2 + i]
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or per_minute
+    local ts = tonumber(state[2]) or now
+    tokens = tokens + (now - ts) * per_minute / 60 + math.min(reserved, per_minute) - used
+    redis.call('HSET', key, 'tokens', math.min(per_minute, tokens), 'ts', now)
+    redis.call('EXPIRE', key, 120)
+end
+return 1
+"""
+
+
+def estimate_cost(messages: list[dict], reply_tokens: int = REPLY_TOKEN_RESERVE) -> int:
+    """Грубая оценка стоимости запроса в токенах (промпт + ответ) для резерва в bucket'ах"""
+    return sum(len(msg["content"]) for msg in messages) // CHARS_PER_TOKEN + reply_tokens
+
+
+@dataclass(eq=False)
+class Ticket:
+    user_id: int
+    provider: str
+    priority: int
+    # Оценка стоимости в токенах: резервируется при выдаче слота
+    cost: int = 0
+    lease_id: str = field(default_factory=lambda: uuid4().hex)
+    granted: bool = False
+    position: int | None = None
+    updates: asyncio.Queue = field(default_factory=asyncio.Queue)
+
+
+class LLMScheduler:
+    """
+    Планировщик вызовов LLM.
+
+    Лимиты параллельности и скорости (токенов в минуту) на пользователя и на
+    провайдера хранятся в Redis, поэтому действуют сразу на все реплики.
+    Ожидающие запросы процесса выстраиваются в справедливую очередь: сначала
+    по классу приоритета, внутри класса — по кругу между пользователями, чтобы
+    один пользователь с множеством сокетов не занимал всю очередь.
+    """
+
+    def __init__(self, redis_client):
+        self._redis = redis_client
+        self._dispatch_script = redis_client.register_script(DISPATCH_SCRIPT)
+        self._release = redis_client.register_script(RELEASE_SCRIPT)
+        # priority -> user_id -> очередь билетов пользователя (в порядке прихода пользователей)
+        self._waiting: dict[int, OrderedDict[int, deque[Ticket]]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    @staticmethod
+    def _keys(ticket: Ticket) -> list[str]:
+        return [
+            f"sched:leases:user:{ticket.user_id}",
+            f"sched:leases:provider:{ticket.provider}",
+            f"sched:bucket:user:{ticket.user_id}",
+            f"sched:bucket:provider:{ticket.provider}",
+        ]
+
+    def _order(self) -> list[Ticket]:
+        """Справедливый порядок обслуживания ожидающих билетов"""
+        order = []
+        for priority in sorted(self._waiting):
+            queues = self._waiting[priority].values()
+            for round_ in itertools.zip_longest(*queues):
+                order.extend(ticket for ticket in round_ if ticket is not None)
+        return order
+
+    def _remove(self, ticket: Ticket):
+        users = self._waiting.get(ticket.priority, {})
+        queue = users.get(ticket.user_id)
+        if queue is None or ticket not in queue:
+            return
+        queue.remove(ticket)
+        if not queue:
+            del users[ticket.user_id]
+        if not users:
+            self._waiting.pop(ticket.priority, None)
+
+    async def _try_acquire(self, tickets: list[Ticket]) -> list[int]:
+        """Попытка выдать слоты билетам в порядке очереди — один вызов скрипта на все билеты"""
+        keys, args = [], [time.time(), LEASE_TTL, USER_MAX_CONCURRENT, USER_TOKENS_PER_MINUTE]
+        for ticket in tickets:
+            keys.extend(self._keys(ticket))
+            args.extend([
+                ticket.lease_id, ticket.cost,
+                PROVIDER_MAX_CONCURRENT[ticket.provider], PROVIDER_TOKENS_PER_MINUTE[ticket.provider],
+            ])
+        return await self._dispatch_script(keys=keys, args=args)
+
+    async def _dispatch(self):
+        order = self._order()
+        position = 0
+        for ticket, result in zip(order, await self._try_acquire(order)):
+            if result == 0:
+                self._remove(ticket)
+                ticket.granted = True
+                ticket.updates.put_nowait(None)
+                continue
+            if ticket.position != position:
+                ticket.position = position
+                ticket.updates.put_nowait(position)
+            position += 1
+
+    async def _run(self):
+        while True:
+            try:
+                # asyncio.timeout, а не wait_for: в 3.11 wait_for теряет отмену (stop), если
+                # событие выставлено в тот же момент
+                async with asyncio.timeout(DISPATCH_INTERVAL):
+                    await self._wakeup.wait()
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self._waiting:
+                continue
+            try:
+                await self._dispatch()
+            except Exception:
+                logger.exception("Ошибка планировщика")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def submit(self, user_id: int, provider: str, priority: int = PRIORITY_INTERACTIVE, cost: int = 0) -> Ticket:
+        """cost — оценка стоимости запроса в токенах (estimate_cost)"""
+        self.start()
+        ticket = Ticket(user_id=user_id, provider=provider, priority=priority, cost=cost)
+        self._waiting.setdefault(priority, OrderedDict()).setdefault(user_id, deque()).append(ticket)
+        self._wakeup.set()
+        return ticket
+
+    async def positions(self, ticket: Ticket):
+        """
+        Ждёт выдачи слота, по пути отдавая позицию билета в очереди при каждом её изменении.
+        :raises HTTPException: 429, если слот не выдан за SCHEDULER_QUEUE_TIMEOUT
+        """
+        deadline = time.monotonic() + SCHEDULER_QUEUE_TIMEOUT
+        while not ticket.granted:
+            try:
+                position = await asyncio.wait_for(ticket.updates.get(), timeout=deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                self._remove(ticket)
+                raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="LLM queue timeout")
+            if position is not None:
+                yield position
+
+    async def wait(self, ticket: Ticket):
+        async for _ in self.positions(ticket):
+            pass
+
+    async def release(self, ticket: Ticket, tokens_used: int | None = None):
+        """
+        Освобождает слот (или убирает билет из очереди) и выравнивает резерв по фактическому
+        расходу. tokens_used=None — расход неизвестен, резерв остаётся списанным.
+        """
+        if not ticket.granted:
+            self._remove(ticket)
+            return
+        await self._release(keys=self._keys(ticket), args=[
+            time.time(), ticket.lease_id, ticket.cost, ticket.cost if tokens_used is None else tokens_used,
+            USER_TOKENS_PER_MINUTE, PROVIDER_TOKENS_PER_MINUTE[ticket.provider],
+        ])
+        self._wakeup.set()
+
+
+llm_scheduler = LLMScheduler(get_redis_client())
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import time
+
+from redis.exceptions import ResponseError
+
+from app.services.history_writer import GROUP_NAME, STREAM_KEY, session_key
+from app.utils.redis import get_redis_client
+from app.utils.serialization import dumps, loads
+from app.utils.telemetry import REDIS_STATE_BYTES, REDIS_STATE_KEYS
+from app.utils.variables import STATE_SCAN_COUNT, STATE_SWEEP_INTERVAL
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = "chat:lifecycle:lock"
+REPORT_KEY = "chat:lifecycle:report"
+# Ключи состояния разговора: живут CHAT_STATE_TTL с момента последней активности
+CONVERSATION_KINDS = ("history", "history:tokens", "history:summary", "history:seq", "session")
+SCAN_BATCH = 500
+
+
+def conversation_keys(user_id: int) -> list[str]:
+    history_key = f"chat:{user_id}:history"
+    return [history_key, f"{history_key}:tokens", f"{history_key}:summary", f"{history_key}:seq", session_key(user_id)]
+
+
+def touch(pipe, user_id: int, ttl: int = settings.CHAT_STATE_TTL):
+    """Продлевает TTL состояния разговора (в составе переданного pipeline)"""
+    for key in conversation_keys(user_id):
+        pipe.expire(key, ttl)
+    return pipe
+
+
+def key_kind(key: str) -> str:
+    """Вид ключа для отчёта: chat:42:history:tokens -> history:tokens, chat:42:attachment:ab12 -> attachment"""
+    if key == STREAM_KEY:
+        # Общая очередь HistoryWriter, не история разговора
+        return "history:stream"
+    parts = key.split(":")
+    if len(parts) < 3:
+        return parts[-1]
+    if parts[1].isdigit():
+        if parts[2] == "history":
+            return ":".join(parts[2:])
+        return parts[2]
+    return parts[1]
+
+
+def is_conversation_key(key: str) -> bool:
+    """Ключ состояния разговора одного пользователя (chat:<id>:…) — только такие получают скользящий TTL"""
+    parts = key.split(":")
+    return len(parts) >= 3 and parts[1].isdigit() and key_kind(key) in CONVERSATION_KINDS
+
+
+class StateLifecycle:
+    """
+    Жизненный цикл состояния чатов в Redis.
+
+    Ключи разговора (история, кэш токенов, сводка, текущая сессия) получают
+    скользящий TTL: он продлевается на каждом ходе и при открытии чата, поэтому
+    истекает только состояние брошенных разговоров. Сама история к этому моменту
+    уже в Postgres — каждый ход ставится в очередь HistoryWriter в той же
+    транзакции, что и запись в Redis.
+
+    Раз в STATE_SWEEP_INTERVAL один из воркеров проходит ключи chat:* через SCAN:
+    - выдаёт TTL ключам разговора, оставшимся без него (созданным до появления TTL);
+    - если в очереди HistoryWriter есть несохранённые ходы старше срока жизни
+      разговора (запись в БД отстала или стоит), откладывает истечение ключей
+      разговора на следующий проход — ничего не пропадает раньше записи в БД;
+    - считает число и объём ключей каждого вида (redis_state_keys, redis_state_bytes
+      и /api/redis_state) для оценки размера инстанса Redis.
+    """
+
+    def __init__(self, redis_client, ttl: int = settings.CHAT_STATE_TTL):
+        self._redis = redis_client
+        self._ttl = ttl
+        self._task: asyncio.Task | None = None
+
+    async def _oldest_unsaved(self) -> float | None:
+        """Время (unix, сек) самого старого хода, ещё не сохранённого HistoryWriter, или None"""
+        try:
+            groups = await self._redis.xinfo_groups(STREAM_KEY)
+        except ResponseError:
+            return None
+        group = next((group for group in groups if group["name"] == GROUP_NAME), None)
+        if group is None:
+            return None
+
+        ids = []
+        # Выданные воркерам, но не подтверждённые
+        if group["pending"]:
+            ids.append((await self._redis.xpending(STREAM_KEY, GROUP_NAME))["min"])
+        # Ещё не прочитанные группой
+        unread = await self._redis.xrange(STREAM_KEY, min=f"({group['last-delivered-id']}", count=1)
+        if unread:
+            ids.append(unread[0][0])
+        if not ids:
+            return None
+        return min(int(entry_id.split("-")[0]) for entry_id in ids) / 1000
+
+    async def _batches(self):
+        batch = []
+        async for key in self._redis.scan_iter(match="chat:*", count=STATE_SCAN_COUNT):
+            batch.append(key)
+            if len(batch) == SCAN_BATCH:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async def sweep(self) -> dict:
+        started = time.perf_counter()
+        hold = 2 * STATE_SWEEP_INTERVAL
+        oldest_unsaved = await self._oldest_unsaved()
+        # Несохранённый ход может принадлежать разговору, который истекает до следующего прохода
+        lagging = oldest_unsaved is not None and oldest_unsaved < time.time() - self._ttl + hold
+        kinds: dict[str, dict] = {}
+        migrated = held = 0
+
+        async for keys in self._batches():
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.ttl(key)
+                    pipe.memory_usage(key)
+                results = await pipe.execute()
+
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for key, ttl, size in zip(keys, results[::2], results[1::2]):
+                    if ttl == -2:
+                        continue  # ключ истёк во время прохода
+                    kind = key_kind(key)
+                    stats = kinds.setdefault(kind, {"keys": 0, "bytes": 0, "without_ttl": 0})
+                    stats["keys"] += 1
+                    stats["bytes"] += size or 0
+                    if not is_conversation_key(key):
+                        stats["without_ttl"] += ttl == -1
+                    elif ttl == -1:
+                        pipe.expire(key, self._ttl)
+                        migrated += 1
+                    elif lagging and ttl < hold:
+                        pipe.expire(key, hold)
+                        held += 1
+                await pipe.execute()
+
+        report = {
+            "at": int(time.time()),
+            "seconds": round(time.perf_counter() - started, 3),
+            "oldest_unsaved_age": round(time.time() - oldest_unsaved) if oldest_unsaved else None,
+            "ttl_assigned": migrated,
+            "expiry_held": held,
+            "kinds": kinds,
+        }
+        await self._redis.set(REPORT_KEY, dumps(report))
+        REDIS_STATE_KEYS.clear()
+        REDIS_STATE_BYTES.clear()
+        for kind, stats in kinds.items():
+            REDIS_STATE_KEYS.labels(kind).set(stats["keys"])
+            REDIS_STATE_BYTES.labels(kind).set(stats["bytes"])
+        return report
+
+    async def report(self) -> dict | None:
+        """Отчёт последнего прохода (любого воркера)"""
+        raw = await self._redis.get(REPORT_KEY)
+        return loads(raw) if raw else None
+
+    async def run(self):
+        while True:
+            try:
+                # Один проход на интервал для всех воркеров и реплик
+                if await self._redis.set(LOCK_KEY, 1, nx=True, ex=STATE_SWEEP_INTERVAL):
+                    report = await self.sweep()
+                    logger.info("Проход по состоянию Redis", extra={
+                        key: value for key, value in report.items() if key != "kinds"
+                    })
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка прохода по состоянию Redis")
+            await asyncio.sleep(STATE_SWEEP_INTERVAL)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+state_lifecycle = StateLifecycle(get_redis_client())
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+
+from pydantic import BaseModel
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from app.utils.redis import get_redis_client
+from app.utils.variables import CONFIG_CHANNEL, CONFIG_CACHE_TTL, DEFAULT_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class AIConfig(BaseModel):
+    """Настройки ИИ пользователя — единственное представление конфига"""
+    prompt: str = DEFAULT_CONFIG["prompt"]
+    model: str = DEFAULT_CONFIG["model"]
+    temperature: float = DEFAULT_CONFIG["temperature"]
+    frequency_penalty: float = DEFAULT_CONFIG["frequency_penalty"]
+    presence_penalty: float = DEFAULT_CONFIG["presence_penalty"]
+    summarize: bool = DEFAULT_CONFIG["summarize"]
+    cache: bool = DEFAULT_CONFIG["cache"]
+    semantic_cache: bool = DEFAULT_CONFIG["semantic_cache"]
+    retrieval: bool = DEFAULT_CONFIG["retrieval"]
+
+
+def config_key(user_id: int) -> str:
+    return f"chat:{user_id}:config"
+
+
+class UserConfigCache:
+    """
+    Кэш конфигов пользователей в памяти процесса с TTL.
+    Хранилище в Redis — JSON-строка по ключу chat:{user_id}:config.
+    Изменения рассылаются через канал CONFIG_CHANNEL, чтобы открытые сокеты
+    во всех процессах сразу видели новые настройки.
+    """
+
+    def __init__(self, redis_client, ttl: float = CONFIG_CACHE_TTL):
+        self._redis = redis_client
+        self._ttl = ttl
+        self._cache: dict[int, tuple[AIConfig, float]] = {}
+        self._listener: asyncio.Task | None = None
+
+    async def get(self, user_id: int) -> AIConfig:
+        cached = self._cache.get(user_id)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        raw = await self._redis.get(config_key(user_id))
+        config = AIConfig.model_validate_json(raw) if raw else AIConfig()
+        self._cache[user_id] = (config, time.monotonic() + self._ttl)
+        return config
+
+    async def set(self, user_id: int, config: AIConfig):
+        await self._redis.set(config_key(user_id), config.model_dump_json())
+        self._cache[user_id] = (config, time.monotonic() + self._ttl)
+        await self._redis.publish(CONFIG_CHANNEL, str(user_id))
+
+    def invalidate(self, user_id: int):
+        self._cache.pop(user_id, None)
+
+    async def _listen(self):
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(CONFIG_CHANNEL)
+        try:
+            while True:
+                try:
+                    async for message in pubsub.listen():
+                        if message.get("type") == "message":
+                            self.invalidate(int(message["data"]))
+                except (RedisConnectionError, OSError) as e:
+                    # При обрыве соединения сбрасываем весь кэш и переподписываемся
+                    logger.warning("Потеряна подписка на %s: %s", CONFIG_CHANNEL, e)
+                    self._cache.clear()
+                    await asyncio.sleep(1)
+                    await pubsub.subscribe(CONFIG_CHANNEL)
+        finally:
+            await pubsub.close()
+
+    def start(self):
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+
+config_cache = UserConfigCache(get_redis_client())
@@ -0,0 +1,49 @@
+import atexit
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+from settings import settings
+
+# Стандартные атрибуты LogRecord; всё остальное — поля, переданные через extra
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener: QueueListener | None = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение и поля из extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        payload.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS})
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: str = settings.LOG_LEVEL):
+    """
+    Логи в JSON. В обработчике запроса запись только кладётся в очередь,
+    форматирование и вывод выполняет отдельный поток QueueListener.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    _listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(level)
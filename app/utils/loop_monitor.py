@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from app.utils.telemetry import LOOP_LAG_SECONDS, LOOP_STALLS
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Как часто задача в event loop отмечает пульс, секунд
+HEARTBEAT_INTERVAL = 0.05
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _location(frame) -> str:
+    """Ближайшая к месту блокировки строка кода проекта (или самая глубокая, если кода проекта в стеке нет)"""
+    fallback = None
+    while frame is not None:
+        path = frame.f_code.co_filename
+        if fallback is None:
+            fallback = f"{os.path.basename(path)}:{frame.f_lineno}"
+        if path.startswith(_PROJECT_ROOT) and "site-packages" not in path:
+            return f"{os.path.relpath(path, _PROJECT_ROOT)}:{frame.f_lineno}"
+        frame = frame.f_back
+    return fallback or "unknown"
+
+
+class LoopMonitor:
+    """
+    Сторож event loop.
+
+    Задача в loop раз в HEARTBEAT_INTERVAL отмечает пульс и пишет запаздывание
+    в event_loop_lag_seconds. Отдельный поток следит за пульсом: если loop не
+    отвечает дольше stall_ms, он снимает стек потока loop — код, который его
+    сейчас блокирует, — пишет его в лог и увеличивает event_loop_stalls_total
+    с меткой места блокировки. Одно зависание сообщается один раз.
+    """
+
+    def __init__(self, stall_ms: int):
+        self._stall = stall_ms / 1000
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: int | None = None
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    async def _beat(self):
+        while True:
+            expected = time.monotonic() + HEARTBEAT_INTERVAL
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            now = time.monotonic()
+            LOOP_LAG_SECONDS.observe(max(now - expected, 0))
+            self._heartbeat = now
+
+    def _watch(self):
+        reported = False
+        while not self._stopped.wait(self._stall / 4):
+            stalled = time.monotonic() - self._heartbeat - HEARTBEAT_INTERVAL
+            if stalled < self._stall:
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            location = _location(frame)
+            LOOP_STALLS.labels(location).inc()
+            logger.warning("Event loop заблокирован дольше %.0f мс", stalled * 1000, extra={
+                "location": location, "stack": "".join(traceback.format_stack(frame)),
+            })
+
+    def start(self):
+        if self._task is not None or self._stall <= 0:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await asyncio.to_thread(self._thread.join)
+        self._thread = None
+
+
+loop_monitor = LoopMonitor(settings.LOOP_STALL_MS)
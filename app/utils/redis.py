@@ -1,14 +1,64 @@
 import os
+import time
+
 import redis.asyncio as redis
 from dotenv import load_dotenv
+from redis.asyncio.client import Pipeline
+
+from app.utils.telemetry import REDIS_SECONDS
 
 load_dotenv()
 
-_redis = redis.from_url(
+
+class _InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            REDIS_SECONDS.labels("MULTI" if self.is_transaction else "PIPELINE").observe(time.perf_counter() - started)
+
+
+class _InstrumentedRedis(redis.Redis):
+    """Клиент Redis, замеряющий задержку каждой команды и пайплайна (redis_command_seconds)"""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_SECONDS.labels(str(args[0]).upper()).observe(time.perf_counter() - started)
+
+    def pipeline(self, transaction: bool = True, shard_hint: str | None = None) -> Pipeline:
+        return _InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class _CountingConnectionPool(redis.ConnectionPool):
+    """Пул соединений Redis с публичным числом выданных соединений (in_use) для метрик насыщения"""
+
+    def reset(self):
+        self._leased = set()
+        super().reset()
+
+    @property
+    def in_use(self) -> int:
+        return len(self._leased)
+
+    async def get_connection(self, command_name, *keys, **options):
+        connection = await super().get_connection(command_name, *keys, **options)
+        self._leased.add(connection)
+        return connection
+
+    async def release(self, connection):
+        self._leased.discard(connection)
+        await super().release(connection)
+
+
+_redis = _InstrumentedRedis(connection_pool=_CountingConnectionPool.from_url(
     os.getenv("REDIS_URL"),
     decode_responses=True,
     max_connections=50
-)
+))
 
 def get_redis_client():
-    return _redis
\ No newline at end of file
+    return _redis
@@ -0,0 +1,41 @@
+import json
+
+from settings import settings
+
+try:
+    import orjson
+except ImportError:  # без orjson — msgspec или стандартный json
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def _stdlib():
+    return lambda obj: json.dumps(obj, ensure_ascii=False, separators=(",", ":")), json.loads
+
+
+def _orjson():
+    return lambda obj: orjson.dumps(obj).decode(), orjson.loads
+
+
+def _msgspec():
+    encoder, decoder = msgspec.json.Encoder(), msgspec.json.Decoder()
+    return lambda obj: encoder.encode(obj).decode(), decoder.decode
+
+
+def _select(name: str):
+    if name == "auto":
+        name = "orjson" if orjson is not None else "msgspec" if msgspec is not None else "json"
+    if name == "orjson" and orjson is not None:
+        return name, *_orjson()
+    if name == "msgspec" and msgspec is not None:
+        return name, *_msgspec()
+    return "json", *_stdlib()
+
+
+# JSON для записей истории в Redis, событий рассылки и фреймов WebSocket.
+# Все реализации пишут UTF-8 без \u-экранирования и читают записи друг друга.
+backend, dumps, loads = _select(settings.JSON_BACKEND)
@@ -0,0 +1,94 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+from prometheus_client import Counter, Gauge, Histogram
+
+try:
+    from opentelemetry import trace
+    _tracer = trace.get_tracer("chat")
+except ImportError:  # без OpenTelemetry этапы пишутся только в гистограммы
+    _tracer = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+TURN_SECONDS = Histogram(
+    "chat_turn_seconds", "Время хода диалога от получения сообщения до последнего фрейма",
+    ["model"], buckets=LATENCY_BUCKETS,
+)
+TTFT_SECONDS = Histogram(
+    "chat_ttft_seconds", "Время от запроса к провайдеру до первого токена ответа",
+    ["model"], buckets=LATENCY_BUCKETS,
+)
+TOKENS_PER_SECOND = Histogram(
+    "chat_generation_tokens_per_second", "Скорость генерации ответа (токенов ответа в секунду)",
+    ["model"], buckets=(1, 5, 10, 20, 40, 80, 160, 320),
+)
+STAGE_SECONDS = Histogram(
+    "chat_stage_seconds", "Длительность этапов хода диалога",
+    ["stage", "model"], buckets=LATENCY_BUCKETS,
+)
+REDIS_SECONDS = Histogram(
+    "redis_command_seconds", "Задержка команд Redis (MULTI/PIPELINE — пайплайн целиком)",
+    ["command"], buckets=FAST_BUCKETS,
+)
+DB_SECONDS = Histogram(
+    "db_query_seconds", "Задержка SQL-запросов по типу запроса",
+    ["statement"], buckets=FAST_BUCKETS,
+)
+DB_CONNECTION_HELD_SECONDS = Histogram(
+    "db_connection_held_seconds", "Сколько соединение с БД удерживается между выдачей из пула и возвратом",
+    buckets=LATENCY_BUCKETS,
+)
+LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds", "Запаздывание пробуждения задачи в event loop относительно расписания",
+    buckets=FAST_BUCKETS,
+)
+LOOP_STALLS = Counter(
+    "event_loop_stalls", "Блокировки event loop дольше LOOP_STALL_MS по месту в коде", ["location"],
+)
+REDIS_STATE_KEYS = Gauge(
+    "redis_state_keys", "Число ключей chat:* в Redis по виду (последний проход StateLifecycle)",
+    ["kind"], multiprocess_mode="max",
+)
+REDIS_STATE_BYTES = Gauge(
+    "redis_state_bytes", "Объём ключей chat:* в Redis по виду, байт (MEMORY USAGE)",
+    ["kind"], multiprocess_mode="max",
+)
+ACTIVE_WEBSOCKETS = Gauge("chat_active_websockets", "Открытые WebSocket-соединения чата", multiprocess_mode="livesum")
+
+# Насыщение пулов соединений. Каждый процесс пишет свои значения раз в POOL_SAMPLE_INTERVAL
+# (app.services.pool_metrics), под gunicorn они суммируются по живым воркерам
+PROVIDER_POOL_IN_USE = Gauge("provider_pool_in_use", "Занятые соединения к провайдерам ИИ", multiprocess_mode="livesum")
+PROVIDER_POOL_CONNECTIONS = Gauge(
+    "provider_pool_connections_total", "Открыто соединений к провайдерам ИИ", multiprocess_mode="livesum",
+)
+DB_POOL_IN_USE = Gauge("db_pool_in_use", "Занятые соединения пула БД", multiprocess_mode="livesum")
+DB_POOL_SIZE = Gauge("db_pool_size", "Размер пула БД", multiprocess_mode="livesum")
+DB_POOL_OVERFLOW = Gauge("db_pool_overflow", "Соединения БД сверх размера пула", multiprocess_mode="livesum")
+DB_POOL_UTILIZATION = Gauge(
+    "db_pool_utilization", "Доля занятых соединений БД от максимума (пул + overflow), самый загруженный воркер",
+    multiprocess_mode="livemax",
+)
+REDIS_POOL_IN_USE = Gauge("redis_pool_in_use", "Занятые соединения пула Redis", multiprocess_mode="livesum")
+REDIS_POOL_SIZE = Gauge("redis_pool_size", "Максимум соединений пула Redis", multiprocess_mode="livesum")
+
+
+def observe_stage(stage: str, model: str, seconds: float):
+    STAGE_SECONDS.labels(stage, model).observe(seconds)
+
+
+@contextmanager
+def span(stage: str, model: str = "", **attributes):
+    """
+    Замер этапа: гистограмма chat_stage_seconds и, если установлен OpenTelemetry, span.
+    Не оборачивайте в span участки асинхронных генераторов, содержащие yield —
+    для них время пишется через observe_stage.
+    """
+    started = time.perf_counter()
+    tracing = _tracer.start_as_current_span(stage, attributes={"model": model, **attributes}) if _tracer else nullcontext()
+    with tracing:
+        try:
+            yield
+        finally:
+            observe_stage(stage, model, time.perf_counter() - started)
@@ -1,12 +1,85 @@
 
 
-CONFIG_KEY = "global_ai_config"
+CONFIG_CHANNEL = "chat:config:updates"
+CONFIG_CACHE_TTL = 300
 HISTORY_KEY = "chat_history"
 
+# Проход по состоянию чатов в Redis (TTL, объём по видам ключей): интервал, секунд, и COUNT для SCAN
+STATE_SWEEP_INTERVAL = 300
+STATE_SCAN_COUNT = 1000
+
+# Записи истории в Redis: msgpack, а начиная с этого размера (байт) — ещё и zstd
+HISTORY_COMPRESS_MIN_BYTES = 256
+HISTORY_ZSTD_LEVEL = 3
+
 DEFAULT_CONFIG = {
     "prompt": "Ты дружелюбный помощник.",
     "model": "deepseek-chat",
     "temperature": 0.2,
     "frequency_penalty": 0.1,
-    "presence_penalty": 0.2
-}
\ No newline at end of file
+    "presence_penalty": 0.2,
+    # Сводка и кэш ответов меняют поведение чата (сжатая история, повтор прежнего ответа),
+    # поэтому включаются пользователем в настройках, а не по умолчанию
+    "summarize": False,
+    "cache": False,
+    "semantic_cache": False,
+    "retrieval": False
+}
+
+# Бюджет контекста (в токенах) для истории + промпта, по семейству модели
+CONTEXT_TOKEN_BUDGETS = {
+    "gpt-5": 32000,
+    "gpt-4.1": 32000,
+    "deepseek": 24000,
+}
+DEFAULT_CONTEXT_TOKEN_BUDGET = 8000
+# Резерв под ответ модели внутри бюджета
+REPLY_TOKEN_RESERVE = 2000
+
+# Сводка ранних сообщений: запускается, когда несвёрнутая история превышает порог (в токенах)
+SUMMARY_TRIGGER_TOKENS = 6000
+# Сколько последних сообщений всегда остаются в контексте дословно
+SUMMARY_KEEP_MESSAGES = 6
+# Более дешёвая модель того же провайдера для построения сводки
+SUMMARY_MODELS = {
+    "deepseek": "deepseek-chat",
+    "openai": "gpt-4.1-nano",
+}
+
+# Кэш ответов модели
+RESPONSE_CACHE_TTL = 24 * 3600
+RESPONSE_CACHE_MAX_ENTRIES = 10000
+# Семантический уровень: локальная модель эмбеддингов и порог косинусного сходства
+SEMANTIC_CACHE_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_SIZE = 2000
+
+# Планировщик запросов к провайдерам: лимиты параллельности и скорости (токенов в минуту)
+USER_MAX_CONCURRENT = 2
+USER_TOKENS_PER_MINUTE = 60000
+PROVIDER_MAX_CONCURRENT = {
+    "deepseek": 64,
+    "openai": 64,
+}
+PROVIDER_TOKENS_PER_MINUTE = {
+    "deepseek": 2_000_000,
+    "openai": 2_000_000,
+}
+# Максимальное время ожидания в очереди, секунд
+SCHEDULER_QUEUE_TIMEOUT = 120
+
+# Вложения: лимиты загрузки, размер фрагмента и бюджет токенов на вложения в одном сообщении
+ATTACHMENT_MAX_BYTES = 5 * 1024 * 1024
+ATTACHMENT_MAX_FILES = 5
+ATTACHMENT_TTL = 24 * 3600
+ATTACHMENT_CHUNK_TOKENS = 400
+ATTACHMENT_TOKEN_BUDGET = 4000
+ATTACHMENT_WORKERS = 2
+
+# Поиск по прошлым сессиям пользователя (RAG по истории чата)
+RETRIEVAL_MODEL = SEMANTIC_CACHE_MODEL
+RETRIEVAL_TOP_K = 4
+RETRIEVAL_MIN_SCORE = 0.4
+# Сколько сообщений читается из БД и кодируется за один шаг индексации
+RETRIEVAL_BATCH_SIZE = 256
+RETRIEVAL_SNIPPET_CHARS = 600
@@ -7,7 +7,6 @@ from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
 from fastapi.responses import Response
 from jose import ExpiredSignatureError, JWTError, jwt
-from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.responses import RedirectResponse
 
@@ -15,12 +14,12 @@ from auth.service.token_refresh import create_refresh_token, SECRET_KEY, ALGORIT
 from database.db_depends import get_db
 from dao.dao import UserDAO
 from auth.service.authenticate import authenticate_user
+from auth.service.passwords import hash_password
 from auth.service.token_jvt import create_access_token
 
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 templates = Jinja2Templates(directory=["auth/templates", "app/templates", "admin_panel/templates"])
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 
@@ -45,12 +44,14 @@ async def create_user(
 
     # Проверяем, что пользователь с таким именем уже существует
     user = await UserDAO.get_by_field(db, username=username)
+    # Соединение не удерживается, пока пароль хешируется
+    await db.close()
 
     if user:
         answer = "Пользователь с таким именем уже существует"
         return templates.TemplateResponse(request=request, name="forms.html", context={"answer": answer})
     # Хешируем пароль
-    password = bcrypt_context.hash(password)
+    password = await hash_password(password)
     # Добавляем нового пользователя в базу
     new_user = await UserDAO.add(db, username=username, password=password)
     # Генерируем JWT токен
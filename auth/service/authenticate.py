@@ -4,11 +4,9 @@ from fastapi import Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
+from auth.service.passwords import verify_password
 from dao.dao import UserDAO
 from database.db_depends import get_db
-from passlib.context import CryptContext
-
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 async def authenticate_user(db: Annotated[AsyncSession, Depends(get_db)], username: str, password: str):
@@ -22,11 +20,19 @@ async def authenticate_user(db: Annotated[AsyncSession, Depends(get_db)], userna
 
     # Проверяем, что пользователь с таким именем уже существует
     user = await UserDAO.get_by_field(db, username=username)
+    # Соединение возвращается в пул до проверки пароля — bcrypt занимает сотни миллисекунд
+    await db.close()
     # Если пользователь не найден или пароли не совпадают, то возвращаем ошибку, иначе возвращаем пользователя
-    if not user or not bcrypt_context.verify(password, user.password):
+    verified, new_hash = await verify_password(password, user.password) if user else (False, None)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    # Параметры хеширования изменились — прозрачно перехешируем пароль
+    if new_hash:
+        user.password = new_hash
+        db.add(user)
+        await db.commit()
     return user
\ No newline at end of file
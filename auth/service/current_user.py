@@ -1,16 +1,12 @@
 from typing import Annotated
 from fastapi import Depends
 from auth.service.token_jvt import request_token
-from jose import jwt, ExpiredSignatureError, JWTError
+from auth.service.token_verify import verify_token
+from jose import ExpiredSignatureError, JWTError
 
-from settings import settings
 from fastapi import HTTPException, status
 
 
-SECRET_KEY = settings.SECRET_KEY
-ALGORITHM = settings.ALGORITHM
-
-
 async def get_current_user(token: Annotated[str, Depends(request_token)]):
     """
     Получаем и проверяем JWT токен из запроса, расшифровываем его и извлечь из него данные о текущем пользователе
@@ -20,7 +16,7 @@ async def get_current_user(token: Annotated[str, Depends(request_token)]):
     """
     try:
         # Расшифровываем JWT токен
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = verify_token(token)
         username: str = payload.get('sub')
         user_id: int = payload.get('id')
         is_admin: str = payload.get('is_admin')
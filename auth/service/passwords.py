@@ -0,0 +1,44 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from settings import settings
+
+# bcrypt освобождает GIL, поэтому пула потоков достаточно, чтобы не блокировать event loop
+bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+
+_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_pending = 0
+
+
+async def _run(func, *args):
+    """
+    Выполняет func в пуле потоков. Если в очереди уже PASSWORD_HASH_QUEUE_LIMIT
+    задач — сразу отвечает 429, а не копит ожидающие запросы.
+    """
+    global _pending
+    if _pending >= settings.PASSWORD_HASH_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts, try again later",
+            headers={"Retry-After": "1"},
+        )
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await _run(bcrypt_context.hash, password)
+
+
+async def verify_password(password: str, hashed: str) -> tuple[bool, str | None]:
+    """
+    Проверяет пароль. Вторым значением возвращает новый хеш, если сохранённый
+    был создан с устаревшими параметрами (например, другим BCRYPT_ROUNDS).
+    """
+    return await _run(bcrypt_context.verify_and_update, password, hashed)
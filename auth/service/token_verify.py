@@ -0,0 +1,90 @@
+import time
+from collections import OrderedDict
+
+from fastapi import Depends, HTTPException, status
+from jose import ExpiredSignatureError, JWTError, jwt
+from starlette.requests import HTTPConnection
+
+from settings import settings
+
+try:
+    # PyJWT заметно быстрее python-jose; используется, если установлен
+    import jwt as pyjwt
+except ImportError:
+    pyjwt = None
+
+SECRET_KEY = settings.SECRET_KEY
+ALGORITHM = settings.ALGORITHM
+TOKEN_CACHE_SIZE = 10000
+
+
+class _VerifiedTokenCache:
+    """Ограниченный LRU-кэш проверенных токенов: токен -> claims; учитывает exp"""
+
+    def __init__(self, maxsize: int):
+        self._maxsize = maxsize
+        self._items: OrderedDict[str, dict] = OrderedDict()
+
+    def get(self, token: str) -> dict | None:
+        claims = self._items.get(token)
+        if claims is None:
+            return None
+        exp = claims.get("exp")
+        if exp is not None and exp <= time.time():
+            del self._items[token]
+            raise ExpiredSignatureError("Signature has expired.")
+        self._items.move_to_end(token)
+        return claims
+
+    def put(self, token: str, claims: dict):
+        self._items[token] = claims
+        self._items.move_to_end(token)
+        if len(self._items) > self._maxsize:
+            self._items.popitem(last=False)
+
+
+_cache = _VerifiedTokenCache(TOKEN_CACHE_SIZE)
+
+
+def _decode(token: str) -> dict:
+    if pyjwt is None:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    # Приводим исключения PyJWT к исключениям python-jose, которые ловит остальной код
+    try:
+        return pyjwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except pyjwt.ExpiredSignatureError as e:
+        raise ExpiredSignatureError(str(e))
+    except pyjwt.PyJWTError as e:
+        raise JWTError(str(e))
+
+
+def verify_token(token: str) -> dict:
+    """
+    Проверяет JWT и возвращает claims. Повторная проверка того же токена
+    обслуживается из кэша до истечения exp.
+    :raises ExpiredSignatureError: срок действия токена истёк
+    :raises JWTError: токен повреждён или невалиден
+    """
+    claims = _cache.get(token)
+    if claims is None:
+        claims = _decode(token)
+        _cache.put(token, claims)
+    return claims
+
+
+async def optional_user_id(connection: HTTPConnection) -> int | None:
+    """user_id из access_token в cookie (HTTP и WebSocket) или None, если токена нет или он невалиден"""
+    token = connection.cookies.get("access_token")
+    if not token:
+        return None
+    try:
+        return int(verify_token(token).get("id"))
+    except (JWTError, TypeError, ValueError):
+        return None
+
+
+async def current_user_id(user_id: int | None = Depends(optional_user_id)) -> int:
+    """user_id текущего пользователя; 401, если он не аутентифицирован"""
+    if user_id is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    return user_id
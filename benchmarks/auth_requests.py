@@ -0,0 +1,60 @@
+"""
+Запросов в секунду для аутентифицированного эндпоинта: проверка JWT через
+jwt.decode (python-jose) на каждый запрос против общей зависимости с кэшем
+проверенных токенов.
+
+Запуск:
+    python -m benchmarks.auth_requests
+"""
+import asyncio
+import time
+from datetime import timedelta
+
+import httpx
+from fastapi import Depends, FastAPI, HTTPException, Request
+from jose import JWTError, jwt
+
+from auth.service.token_jvt import create_access_token
+from auth.service.token_verify import current_user_id
+from settings import settings
+
+REQUESTS = 5000
+
+app = FastAPI()
+
+
+@app.get("/before")
+async def before(request: Request):
+    token = request.cookies.get("access_token")
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        return {"id": int(payload.get("id"))}
+    except JWTError:
+        raise HTTPException(401)
+
+
+@app.get("/after")
+async def after(user_id: int = Depends(current_user_id)):
+    return {"id": user_id}
+
+
+async def run(client: httpx.AsyncClient, path: str):
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        response = await client.get(path)
+        assert response.status_code == 200
+    elapsed = time.perf_counter() - started
+    print(f"{path:8} {REQUESTS / elapsed:8.0f} req/s")
+
+
+async def main():
+    token = await create_access_token("bench", 1, False, expires_delta=timedelta(minutes=20))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench",
+                                 cookies={"access_token": token}) as client:
+        await run(client, "/before")
+        await run(client, "/after")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
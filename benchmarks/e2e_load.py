@@ -0,0 +1,412 @@
+"""
+Сквозной нагрузочный тест чата: USERS одновременных пользователей проходят
+регистрацию и логин, открывают /ws/chat и делают TURNS ходов, затем
+/reset_chat, /api/sessions и /load_session прошлой сессии.
+
+Всё поднимается локально:
+- заглушка OpenAI-совместимого API с настраиваемыми TTFT и скоростью токенов
+  (на неё указывают DEEPSEEK_BASE_URL и OPENAI_BASE_URL приложения);
+- redis-server на отдельном порту без сохранения на диск (если он есть в PATH,
+  иначе используется REDIS_URL из окружения);
+- main:app под uvicorn в одном процессе, с замером задержки event loop изнутри.
+
+База — Postgres из .env (история пишется через INSERT ... ON CONFLICT диалекта
+postgresql, поэтому SQLite не подходит); имя базы можно подменить BENCH_DB_NAME,
+миграции применяются перед запуском.
+
+Отчёт: пропускная способность и p50/p95/p99 по каждому эндпоинту, TTFT хода,
+задержка event loop сервера, память на одно открытое соединение и число
+соединений с БД, занятых простаивающими сокетами (ожидается 0). Результат
+сохраняется в JSON (по умолчанию benchmarks/results/<commit>.json), два
+результата сравниваются через --compare.
+
+Запуск:
+    BENCH_DB_NAME=chat_bench python -m benchmarks.e2e_load --users 100 --turns 3 --ttft 0.3 --tps 200
+    python -m benchmarks.e2e_load --compare benchmarks/results/a.json benchmarks/results/b.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import httpx
+import websockets
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+FAKE_PORT = 9110
+REDIS_PORT = 9111
+APP_PORT = 9112
+# Период замера задержки event loop в процессе приложения, секунд
+LAG_TICK = 0.01
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+fake_provider = FastAPI()
+
+
+@fake_provider.post("/chat/completions")
+async def chat_completions():
+    ttft = float(os.getenv("BENCH_TTFT", "0.3"))
+    tokens = int(os.getenv("BENCH_TOKENS", "100"))
+    delay = 1 / float(os.getenv("BENCH_TPS", "200"))
+
+    async def events():
+        base = {"id": "bench", "object": "chat.completion.chunk", "created": int(time.time()), "model": "bench"}
+        await asyncio.sleep(ttft)
+        for i in range(tokens):
+            if i:
+                await asyncio.sleep(delay)
+            chunk = dict(base, choices=[{"index": 0, "delta": {"content": f"слово{i} "}, "finish_reason": None}])
+            yield f"data: {json.dumps(chunk)}\n\n"
+        usage = {"prompt_tokens": 50, "completion_tokens": tokens, "total_tokens": 50 + tokens}
+        yield f"data: {json.dumps(dict(base, choices=[], usage=usage))}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+# --- процесс приложения -------------------------------------------------------
+
+async def serve():
+    """main:app под uvicorn с замером задержки event loop (/__bench__/loop_lag)"""
+    import uvicorn
+
+    from main import app
+
+    lags: list[float] = []
+
+    async def sample_lag():
+        while True:
+            expected = time.perf_counter() + LAG_TICK
+            await asyncio.sleep(LAG_TICK)
+            lags.append(max(time.perf_counter() - expected, 0) * 1000)
+
+    @app.get("/__bench__/loop_lag", include_in_schema=False)
+    async def loop_lag(reset: bool = False):
+        samples = sorted(lags)
+        if reset:
+            lags.clear()
+        return summarize(samples)
+
+    sampler = asyncio.create_task(sample_lag())
+    config = uvicorn.Config(app, host="127.0.0.1", port=APP_PORT, log_level="warning", ws_max_size=16 * 1024 * 1024)
+    try:
+        await uvicorn.Server(config).serve()
+    finally:
+        sampler.cancel()
+
+
+# --- окружение ----------------------------------------------------------------
+
+def wait_for_port(port: int, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.2)
+    raise RuntimeError(f"порт {port} не открылся")
+
+
+def rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    raise RuntimeError("VmRSS не найден")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def start_environment(args, processes: list[subprocess.Popen]) -> dict:
+    env = dict(os.environ, BENCH_TTFT=str(args.ttft), BENCH_TPS=str(args.tps), BENCH_TOKENS=str(args.tokens))
+    processes.append(subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.e2e_load:fake_provider", "--port", str(FAKE_PORT),
+         "--workers", "2", "--log-level", "warning"],
+        env=env,
+    ))
+
+    if shutil.which("redis-server"):
+        processes.append(subprocess.Popen(
+            ["redis-server", "--port", str(REDIS_PORT), "--save", "", "--appendonly", "no"],
+            stdout=subprocess.DEVNULL,
+        ))
+        wait_for_port(REDIS_PORT)
+        env["REDIS_URL"] = f"redis://127.0.0.1:{REDIS_PORT}/0"
+    if os.getenv("BENCH_DB_NAME"):
+        env["DB_NAME"] = os.environ["BENCH_DB_NAME"]
+    env.update(
+        DEEPSEEK_BASE_URL=f"http://127.0.0.1:{FAKE_PORT}",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{FAKE_PORT}",
+        LOG_LEVEL="WARNING",
+    )
+    subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], env=env, check=True)
+    wait_for_port(FAKE_PORT)
+    return env
+
+
+# --- нагрузка -----------------------------------------------------------------
+
+def summarize(samples: list[float]) -> dict:
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+
+    def percentile(q: float) -> float:
+        return round(samples[min(int(q * len(samples)), len(samples) - 1)], 2)
+
+    return {
+        "count": len(samples),
+        "mean": round(statistics.fmean(samples), 2),
+        "p50": percentile(0.5),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+        "max": round(samples[-1], 2),
+    }
+
+
+class Recorder:
+    """Задержки (мс) и ошибки по эндпоинтам"""
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    async def timed(self, name: str, call):
+        started = time.perf_counter()
+        try:
+            result = await call
+        except Exception:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            raise
+        self.add(name, started)
+        return result
+
+    def add(self, name: str, started: float):
+        self.latencies.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+
+
+def checked(response: httpx.Response) -> httpx.Response:
+    response.raise_for_status()
+    return response
+
+
+async def chat_turns(client: httpx.AsyncClient, recorder: Recorder, turns: int):
+    token = client.cookies["access_token"]
+    started = time.perf_counter()
+    async with websockets.connect(f"ws://127.0.0.1:{APP_PORT}/ws/chat", open_timeout=60,
+                                  additional_headers={"Cookie": f"access_token={token}"}) as ws:
+        while "history" not in json.loads(await ws.recv()):
+            pass
+        recorder.add("ws_connect", started)
+        for _ in range(turns):
+            started = time.perf_counter()
+            # Уникальное сообщение, чтобы не попадать в кэш ответов
+            await ws.send(json.dumps({"message": f"вопрос {uuid4().hex}"}))
+            first = True
+            while True:
+                frame = json.loads(await ws.recv())
+                if first and "delta" in frame:
+                    recorder.add("ws_ttft", started)
+                    first = False
+                if frame.get("error"):
+                    recorder.errors["ws_turn"] = recorder.errors.get("ws_turn", 0) + 1
+                if frame.get("done"):
+                    break
+            recorder.add("ws_turn", started)
+
+
+async def user_session(index: int, run_id: str, args, recorder: Recorder):
+    username, password = f"bench-{run_id}-{index}", "password"
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{APP_PORT}", timeout=120) as client:
+        checked(await recorder.timed("register", client.post(
+            "/auth/forms", data={"username": username, "password": password}
+        )))
+        client.cookies.clear()
+        checked(await recorder.timed("login", client.post(
+            "/auth/token", data={"username": username, "password": password}
+        )))
+
+        await chat_turns(client, recorder, args.turns)
+        checked(await recorder.timed("reset_chat", client.post("/reset_chat")))
+        # Прошлая сессия пишется в БД в фоне — ждём, пока она появится в списке
+        sessions = []
+        for _ in range(50):
+            sessions = checked(await recorder.timed("api_sessions", client.get("/api/sessions"))).json()["sessions"]
+            if sessions:
+                break
+            await asyncio.sleep(0.2)
+        if sessions:
+            # Сессии приходят списками [session_id, start_time, preview, ...]
+            checked(await recorder.timed("load_session", client.get(
+                "/load_session", params={"session_id": sessions[0][0]}
+            )))
+        return client.cookies["access_token"]
+
+
+async def guarded(coro):
+    try:
+        return await coro
+    except Exception as e:
+        print(f"  ошибка пользователя: {e!r}")
+        return None
+
+
+def db_pool_in_use(metrics: str) -> float | None:
+    for line in metrics.splitlines():
+        if line.startswith("db_pool_in_use "):
+            return float(line.split()[1])
+    return None
+
+
+async def idle_connections(app_pid: int, tokens: list[str], connections: int) -> dict:
+    """
+    Открывает connections простаивающих WebSocket: прирост RSS приложения на одно
+    соединение (КБ) и число занятых ими соединений с БД (должно быть 0).
+    """
+    tokens = [token for token in tokens if token]
+    if not tokens or not connections:
+        return {"memory_per_connection_kb": None, "idle_db_connections": None}
+    before = rss_kb(app_pid)
+    sockets = []
+    try:
+        for i in range(connections):
+            ws = await websockets.connect(f"ws://127.0.0.1:{APP_PORT}/ws/chat", open_timeout=60,
+                                          additional_headers={"Cookie": f"access_token={tokens[i % len(tokens)]}"})
+            await ws.recv()
+            sockets.append(ws)
+        await asyncio.sleep(1)
+        after = rss_kb(app_pid)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{APP_PORT}") as client:
+            db_connections = db_pool_in_use((await client.get("/metrics")).text)
+    finally:
+        await asyncio.gather(*(ws.close() for ws in sockets), return_exceptions=True)
+    return {"memory_per_connection_kb": round((after - before) / connections, 2), "idle_db_connections": db_connections}
+
+
+async def run(args, app_pid: int) -> dict:
+    recorder = Recorder()
+    run_id = uuid4().hex[:8]
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{APP_PORT}") as client:
+        await client.get("/__bench__/loop_lag", params={"reset": True})
+        started = time.perf_counter()
+        tokens = await asyncio.gather(*(guarded(user_session(i, run_id, args, recorder)) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+        loop_lag = (await client.get("/__bench__/loop_lag", params={"reset": True})).json()
+
+    idle = await idle_connections(app_pid, tokens, args.idle_connections)
+    endpoints = {}
+    for name, samples in sorted(recorder.latencies.items()):
+        endpoints[name] = dict(summarize(samples), rps=round(len(samples) / elapsed, 2),
+                               errors=recorder.errors.get(name, 0))
+    for name, errors in recorder.errors.items():
+        endpoints.setdefault(name, {"count": 0, "errors": errors})
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+        "elapsed_s": round(elapsed, 2),
+        "turns_per_s": round(len(recorder.latencies.get("ws_turn", ())) / elapsed, 2),
+        "endpoints": endpoints,
+        "loop_lag_ms": loop_lag,
+        **idle,
+    }
+
+
+# --- отчёт --------------------------------------------------------------------
+
+def print_report(result: dict):
+    print(f"commit {result['commit']}  {result['elapsed_s']} s  {result['turns_per_s']} turns/s")
+    print(f"{'endpoint':<14}{'count':>7}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'errors':>8}")
+    for name, stats in result["endpoints"].items():
+        print(f"{name:<14}{stats['count']:>7}{stats.get('rps', 0):>9}{stats.get('p50', '-'):>9}"
+              f"{stats.get('p95', '-'):>9}{stats.get('p99', '-'):>9}{stats['errors']:>8}")
+    lag = result["loop_lag_ms"]
+    print(f"loop lag  p50: {lag.get('p50')} ms  p99: {lag.get('p99')} ms  max: {lag.get('max')} ms")
+    print(f"memory per idle connection: {result['memory_per_connection_kb']} KB")
+    print(f"db connections held by {result['params']['idle_connections']} idle sockets: "
+          f"{result.get('idle_db_connections')}")
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def change(before, after) -> str:
+        if not isinstance(before, (int, float)) or not isinstance(after, (int, float)) or not before:
+            return f"{before} -> {after}"
+        return f"{before} -> {after} ({(after - before) / before * 100:+.1f}%)"
+
+    print(f"{old['commit']} -> {new['commit']}")
+    print(f"turns/s   {change(old['turns_per_s'], new['turns_per_s'])}")
+    for name in sorted(set(old["endpoints"]) | set(new["endpoints"])):
+        before, after = old["endpoints"].get(name, {}), new["endpoints"].get(name, {})
+        for metric in ("p50", "p99"):
+            print(f"{name:<14}{metric:<5}{change(before.get(metric), after.get(metric))}")
+    for metric in ("p50", "p99", "max"):
+        print(f"{'loop_lag':<14}{metric:<5}{change(old['loop_lag_ms'].get(metric), new['loop_lag_ms'].get(metric))}")
+    print(f"{'memory/conn':<19}{change(old['memory_per_connection_kb'], new['memory_per_connection_kb'])}")
+    print(f"{'idle db conns':<19}{change(old.get('idle_db_connections'), new.get('idle_db_connections'))}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Сквозной нагрузочный тест чата")
+    parser.add_argument("command", nargs="?", choices=["serve"], help=argparse.SUPPRESS)
+    parser.add_argument("--users", type=int, default=50, help="одновременных пользователей")
+    parser.add_argument("--turns", type=int, default=3, help="ходов чата на пользователя")
+    parser.add_argument("--ttft", type=float, default=0.3, help="задержка первого токена заглушки, с")
+    parser.add_argument("--tps", type=float, default=200, help="токенов в секунду заглушки")
+    parser.add_argument("--tokens", type=int, default=100, help="токенов в ответе заглушки")
+    parser.add_argument("--idle-connections", type=int, default=1000, help="простаивающих сокетов для замера памяти и соединений с БД")
+    parser.add_argument("--output", help="файл результата (по умолчанию benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="сравнить два результата")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "serve":
+        asyncio.run(serve())
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    processes: list[subprocess.Popen] = []
+    try:
+        env = start_environment(args, processes)
+        app = subprocess.Popen([sys.executable, "-m", "benchmarks.e2e_load", "serve"], env=env)
+        processes.append(app)
+        wait_for_port(APP_PORT)
+        result = asyncio.run(run(args, app.pid))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+
+    print_report(result)
+    output = args.output or os.path.join(RESULTS_DIR, f"{result['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"saved {output}")
+
+
+if __name__ == "__main__":
+    main()
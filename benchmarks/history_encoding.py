@@ -0,0 +1,97 @@
+"""
+Размер записей истории чата в Redis: старый JSON против msgpack и msgpack + zstd
+(app.services.history_codec) — байт на сообщение и время кодирования/декодирования.
+
+Набор — типичная переписка: короткие реплики пользователя и ответы ассистента
+разной длины, часть с кодом. Если задан REDIS_URL, дополнительно печатается
+MEMORY USAGE списка из HISTORY_LENGTH записей каждого формата.
+
+Запуск:
+    python -m benchmarks.history_encoding
+"""
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+
+from app.services.history_codec import decode_entry, encode_entry
+
+MESSAGES = 10_000
+HISTORY_LENGTH = 50
+SEED = 0
+
+WORDS = ("привет", "как", "настроить", "сервер", "база", "данных", "ошибка", "запрос", "ответ", "функция",
+         "пользователь", "история", "кэш", "индекс", "таблица", "соединение", "можно", "нужно", "почему", "спасибо")
+CODE = '''def handler(request):
+    user = await get_user(request.user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="not found")
+    return {"id": user.id, "name": user.name}
+'''
+
+
+def sample_messages(rng: random.Random) -> list[tuple[str, str]]:
+    messages = []
+    for i in range(MESSAGES):
+        if i % 2 == 0:
+            text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 30)))
+            messages.append(("user", text.capitalize() + "?"))
+        else:
+            text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 400)))
+            if rng.random() < 0.3:
+                text += "\n\n```python\n" + CODE * rng.randint(1, 4) + "```"
+            messages.append(("assistant", text.capitalize() + "."))
+    return messages
+
+
+def legacy_entry(role: str, content: str) -> bytes:
+    return json.dumps({"role": role, "content": content}).encode()
+
+
+def measure(name: str, encode, messages: list[tuple[str, str]]) -> list[bytes]:
+    started = time.perf_counter()
+    entries = [encode(role, content) for role, content in messages]
+    encode_us = (time.perf_counter() - started) / len(messages) * 1e6
+    started = time.perf_counter()
+    for entry in entries:
+        decode_entry(entry)
+    decode_us = (time.perf_counter() - started) / len(messages) * 1e6
+
+    sizes = [len(entry) for entry in entries]
+    print(f"{name:<16} {statistics.fmean(sizes):8.0f} B/msg  p50: {statistics.median(sizes):6.0f} B  "
+          f"total: {sum(sizes) / 1024 / 1024:6.2f} MiB  encode: {encode_us:5.1f} µs  decode: {decode_us:5.1f} µs")
+    return entries
+
+
+async def redis_memory(formats: dict[str, list[bytes]]):
+    import redis.asyncio as redis
+
+    client = redis.from_url(os.environ["REDIS_URL"])
+    try:
+        for name, entries in formats.items():
+            key = f"bench:history-encoding:{name}"
+            await client.delete(key)
+            await client.rpush(key, *entries[-HISTORY_LENGTH:])
+            usage = await client.memory_usage(key)
+            await client.delete(key)
+            print(f"{name:<16} MEMORY USAGE ({HISTORY_LENGTH} записей): {usage / 1024:.1f} KiB")
+    finally:
+        await client.close()
+
+
+def main():
+    messages = sample_messages(random.Random(SEED))
+    formats = {
+        "json (legacy)": measure("json (legacy)", legacy_entry, messages),
+        "msgpack(+zstd)": measure("msgpack(+zstd)", encode_entry, messages),
+    }
+    legacy, compact = (sum(map(len, entries)) for entries in formats.values())
+    print(f"экономия: {(1 - compact / legacy) * 100:.0f}%")
+    if os.getenv("REDIS_URL"):
+        asyncio.run(redis_memory(formats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Задержка обработки сообщений чата во время волны логинов.
+
+Имитирует открытый чат — задачу, которая каждые 10 мс «обрабатывает
+сообщение» — и одновременно CONCURRENT_LOGINS проверок пароля bcrypt:
+сначала прямо в event loop (как было), затем через пул потоков
+auth.service.passwords. Печатает p50/p99/max задержки сообщений.
+
+Запуск:
+    python -m benchmarks.login_latency
+"""
+import asyncio
+import statistics
+import time
+
+from auth.service.passwords import bcrypt_context, verify_password
+
+CONCURRENT_LOGINS = 20
+TICK = 0.01
+
+
+async def chat_messages(latencies: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        expected = time.perf_counter() + TICK
+        await asyncio.sleep(TICK)
+        latencies.append(max(time.perf_counter() - expected, 0) * 1000)
+
+
+async def inline_login(hashed: str):
+    bcrypt_context.verify("password", hashed)
+
+
+async def pooled_login(hashed: str):
+    await verify_password("password", hashed)
+
+
+async def run(name: str, login):
+    hashed = bcrypt_context.hash("password")
+    latencies = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(chat_messages(latencies, stop))
+    await asyncio.sleep(0.1)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(login(hashed) for _ in range(CONCURRENT_LOGINS)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await ticker
+    latencies.sort()
+    print(f"{name:7} logins: {elapsed:.2f} s   message latency ms — "
+          f"p50: {statistics.median(latencies):.1f}  "
+          f"p99: {latencies[int(len(latencies) * 0.99) - 1]:.1f}  max: {latencies[-1]:.1f}")
+
+
+async def main():
+    await run("inline", inline_login)
+    await run("pooled", pooled_login)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+"""
+Бенчмарк работы с историей чата в Redis за один ход диалога:
+число сетевых обращений (round trips) и задержка — до и после оптимизации.
+
+Запуск:
+    python -m benchmarks.redis_history                 # fakeredis
+    BENCH_REDIS_URL=redis://localhost:6379/15 python -m benchmarks.redis_history
+
+Redis выбирается отдельной переменной BENCH_REDIS_URL: REDIS_URL задан всегда —
+его требуют настройки приложения, которые импортирует app.services.gpt.
+"""
+import asyncio
+import json
+import os
+import time
+
+from app.services.context_builder import build_context
+from app.services.gpt import MAX_STORED_MESSAGES, _save_turn
+
+TURNS = 500
+HISTORY_KEY = "bench:history"
+# Фиксированная обрезка контекста в исходной реализации
+LEGACY_HISTORY_MESSAGES = 4
+
+
+class CountingRedis:
+    """Прокси над клиентом Redis, считающий обращения к серверу"""
+
+    def __init__(self, client):
+        self._client = client
+        self.round_trips = 0
+
+    def pipeline(self, *args, **kwargs):
+        return _CountingPipeline(self, self._client.pipeline(*args, **kwargs))
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        async def wrapper(*args, **kwargs):
+            self.round_trips += 1
+            return await attr(*args, **kwargs)
+
+        return wrapper
+
+
+class _CountingPipeline:
+    def __init__(self, owner: CountingRedis, pipe):
+        self._owner = owner
+        self._pipe = pipe
+
+    async def __aenter__(self):
+        await self._pipe.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc):
+        return await self._pipe.__aexit__(*exc)
+
+    async def execute(self):
+        self._owner.round_trips += 1
+        return await self._pipe.execute()
+
+    def __getattr__(self, name):
+        return getattr(self._pipe, name)
+
+
+async def legacy_turn(redis_client, user_message: str, reply: str):
+    """Исходная реализация: полный LRANGE и три последовательных записи"""
+    raw_history = await redis_client.lrange(HISTORY_KEY, 0, -1)
+    full_history = [json.loads(item) for item in raw_history]
+    _ = full_history[-LEGACY_HISTORY_MESSAGES:]
+    await redis_client.rpush(HISTORY_KEY, json.dumps({"role": "user", "content": user_message}))
+    await redis_client.rpush(HISTORY_KEY, json.dumps({"role": "assistant", "content": reply}))
+    await redis_client.ltrim(HISTORY_KEY, -MAX_STORED_MESSAGES, -1)
+
+
+async def current_turn(redis_client, user_message: str, reply: str):
+    await build_context(redis_client, HISTORY_KEY, "deepseek-chat", "system", user_message)
+    await _save_turn(redis_client, HISTORY_KEY, user_message, reply)
+
+
+async def run(name: str, turn, client):
+    counting = CountingRedis(client)
+    await client.delete(HISTORY_KEY)
+    # Заполняем историю до рабочего размера
+    for _ in range(MAX_STORED_MESSAGES // 2):
+        await turn(client, "вопрос " * 20, "ответ " * 80)
+
+    counting.round_trips = 0
+    started = time.perf_counter()
+    for _ in range(TURNS):
+        await turn(counting, "вопрос " * 20, "ответ " * 80)
+    elapsed = time.perf_counter() - started
+
+    print(f"{name:8} round trips/turn: {counting.round_trips / TURNS:.1f}   "
+          f"latency/turn: {elapsed / TURNS * 1000:.3f} ms")
+
+
+def make_client():
+    url = os.getenv("BENCH_REDIS_URL")
+    if url:
+        import redis.asyncio as redis
+        return redis.from_url(url, decode_responses=True)
+    import fakeredis
+    return fakeredis.FakeAsyncRedis(decode_responses=True)
+
+
+async def main():
+    client = make_client()
+    await run("before", legacy_turn, client)
+    await run("after", current_turn, client)
+    await client.delete(HISTORY_KEY)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""
+Индекс поиска по прошлым сессиям на MESSAGES сообщениях: время построения
+(дозапись пачками по RETRIEVAL_BATCH_SIZE) и задержка поиска p50/p99.
+
+Векторы случайные нормированные — измеряется сам индекс. Если установлен
+sentence-transformers, отдельно печатается скорость кодирования на CPU и
+оценка времени кодирования всех MESSAGES сообщений.
+
+Запуск:
+    python -m benchmarks.retrieval_index
+"""
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from app.services.retrieval import SentenceTransformer, UserIndex
+from app.utils.variables import RETRIEVAL_BATCH_SIZE, RETRIEVAL_MODEL, RETRIEVAL_TOP_K
+
+MESSAGES = 100_000
+DIM = 384
+QUERIES = 200
+ENCODE_SAMPLE = 1000
+
+
+def random_vectors(rng: np.random.Generator, n: int) -> np.ndarray:
+    vectors = rng.standard_normal((n, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build(index: UserIndex, rng: np.random.Generator):
+    started = time.perf_counter()
+    for start in range(0, MESSAGES, RETRIEVAL_BATCH_SIZE):
+        n = min(RETRIEVAL_BATCH_SIZE, MESSAGES - start)
+        records = [
+            {"id": start + i + 1, "session_id": f"s{(start + i) // 100}", "role": "user",
+             "timestamp": "2025-01-01T00:00:00", "text": f"сообщение {start + i}"}
+            for i in range(n)
+        ]
+        index.append(random_vectors(rng, n), records, start + n, RETRIEVAL_MODEL)
+    elapsed = time.perf_counter() - started
+    print(f"build   {MESSAGES} messages: {elapsed:.2f} s ({MESSAGES / elapsed:,.0f} msg/s, без кодирования)")
+
+
+def search(index: UserIndex, rng: np.random.Generator):
+    # Запросы — зашумлённые векторы из индекса, чтобы порог сходства пропускал результаты
+    stored = np.memmap(index.vec_path, dtype=np.float16, mode="r", shape=(MESSAGES, DIM))
+    queries = np.asarray(stored[rng.integers(0, MESSAGES, QUERIES)], dtype=np.float32)
+    queries += random_vectors(rng, QUERIES) * 0.5
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query, RETRIEVAL_TOP_K, exclude_session="s0")
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    print(f"search  p50: {statistics.median(latencies):.1f} ms  p99: {latencies[int(QUERIES * 0.99) - 1]:.1f} ms")
+
+
+def encode():
+    if SentenceTransformer is None:
+        print("encode  sentence-transformers не установлен — пропуск")
+        return
+    model = SentenceTransformer(RETRIEVAL_MODEL, device="cpu")
+    texts = [f"Как настроить индекс номер {i} для поиска по истории чата?" for i in range(ENCODE_SAMPLE)]
+    started = time.perf_counter()
+    model.encode(texts, batch_size=64, normalize_embeddings=True)
+    rate = ENCODE_SAMPLE / (time.perf_counter() - started)
+    print(f"encode  {rate:,.0f} msg/s на CPU, {MESSAGES} сообщений ≈ {MESSAGES / rate / 60:.1f} мин")
+
+
+def main():
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        index = UserIndex(directory, 1)
+        build(index, rng)
+        search(index, rng)
+    encode()
+
+
+if __name__ == "__main__":
+    main()
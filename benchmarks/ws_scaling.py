@@ -0,0 +1,134 @@
+"""
+Пропускная способность чата (ходов в секунду) в зависимости от числа воркеров gunicorn.
+
+Поднимает заглушку OpenAI-совместимого API (потоковый ответ из CHUNKS фрагментов),
+затем для каждого WORKERS запускает приложение под gunicorn с DEEPSEEK_BASE_URL,
+указывающим на заглушку, и гоняет CLIENTS WebSocket-клиентов по TURNS ходов.
+Пользователи регистрируются через /forms один раз, токены переиспользуются.
+
+Нужны запущенные Redis и Postgres из .env с применёнными миграциями.
+
+Запуск:
+    python -m benchmarks.ws_scaling
+"""
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from uuid import uuid4
+
+import httpx
+import websockets
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+FAKE_PORT = 9100
+APP_PORT = 9200
+WORKERS = (1, 2, 4)
+CLIENTS = 64
+TURNS = 5
+CHUNKS = 100
+CHUNK_DELAY = 0.002
+
+fake_provider = FastAPI()
+
+
+@fake_provider.post("/chat/completions")
+async def chat_completions():
+    async def events():
+        base = {"id": "bench", "object": "chat.completion.chunk", "created": int(time.time()), "model": "bench"}
+        for i in range(CHUNKS):
+            await asyncio.sleep(CHUNK_DELAY)
+            chunk = dict(base, choices=[{"index": 0, "delta": {"content": f"слово{i} "}, "finish_reason": None}])
+            yield f"data: {json.dumps(chunk)}\n\n"
+        usage = {"prompt_tokens": 50, "completion_tokens": CHUNKS, "total_tokens": 50 + CHUNKS}
+        yield f"data: {json.dumps(dict(base, choices=[], usage=usage))}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def wait_for_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.2)
+    raise RuntimeError(f"порт {port} не открылся")
+
+
+def start_app(workers: int) -> subprocess.Popen:
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), PORT=str(APP_PORT), LOG_LEVEL="WARNING",
+               DEEPSEEK_BASE_URL=f"http://127.0.0.1:{FAKE_PORT}")
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "main:app", "-c", "gunicorn.conf.py"], env=env)
+    wait_for_port(APP_PORT)
+    return process
+
+
+async def register(client: httpx.AsyncClient) -> list[str]:
+    run_id = uuid4().hex[:8]
+    tokens = []
+    for i in range(CLIENTS):
+        response = await client.post("/auth/forms", data={"username": f"bench-{run_id}-{i}", "password": "password"})
+        tokens.append(response.cookies["access_token"])
+    return tokens
+
+
+async def chat(token: str, latencies: list[float]):
+    uri = f"ws://127.0.0.1:{APP_PORT}/ws/chat"
+    async with websockets.connect(uri, additional_headers={"Cookie": f"access_token={token}"}) as ws:
+        await ws.recv()  # история
+        for _ in range(TURNS):
+            started = time.perf_counter()
+            # Уникальное сообщение, чтобы не попадать в кэш ответов
+            await ws.send(json.dumps({"message": f"вопрос {uuid4().hex}"}))
+            while "done" not in json.loads(await ws.recv()):
+                pass
+            latencies.append(time.perf_counter() - started)
+
+
+async def run(tokens: list[str]) -> float:
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*(chat(token, latencies) for token in tokens))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    rate = len(latencies) / elapsed
+    print(f"  {rate:7.1f} turns/s   p50: {latencies[len(latencies) // 2] * 1000:.0f} ms  "
+          f"p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.0f} ms")
+    return rate
+
+
+async def main():
+    fake = subprocess.Popen([sys.executable, "-m", "uvicorn", "benchmarks.ws_scaling:fake_provider",
+                             "--port", str(FAKE_PORT), "--workers", "4", "--log-level", "warning"])
+    tokens = None
+    rates = {}
+    try:
+        wait_for_port(FAKE_PORT)
+        for workers in WORKERS:
+            app = start_app(workers)
+            try:
+                if tokens is None:
+                    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{APP_PORT}", timeout=60) as client:
+                        tokens = await register(client)
+                print(f"workers: {workers}")
+                rates[workers] = await run(tokens)
+            finally:
+                app.terminate()
+                app.wait()
+    finally:
+        fake.terminate()
+        fake.wait()
+
+    base = rates[WORKERS[0]]
+    for workers, rate in rates.items():
+        print(f"workers: {workers}  speedup: {rate / base:.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,8 +1,29 @@
-from sqlalchemy import select, desc
+from datetime import datetime
+from typing import NamedTuple
+
+from sqlalchemy import select, desc, tuple_
 
 from dao.base import BaseDAO
 from auth.model import User
 from app.models.chat_history import ChatHistory
+from app.models.chat_session import ChatSession
+
+SESSIONS_PAGE_SIZE = 20
+PREVIEW_LENGTH = 40
+
+
+class SessionSummary(NamedTuple):
+    session_id: str
+    start_time: datetime
+    preview: str
+    message_count: int
+    last_time: datetime
+
+
+class SessionMessage(NamedTuple):
+    role: str
+    message: str
+    timestamp: datetime
 
 
 class UserDAO(BaseDAO):
@@ -20,4 +41,43 @@ class ChatHistoryDAO(BaseDAO):
             .order_by(desc(cls.model.timestamp))
         )
         result = await session.execute(stmt)
-        return result.scalars().all()
\ No newline at end of file
+        return result.scalars().all()
+
+    @classmethod
+    async def get_sessions_summary(cls, session, user_id: int, limit: int = SESSIONS_PAGE_SIZE,
+                                   before: tuple[datetime, str] | None = None) -> list[SessionSummary]:
+        """
+        Одна строка на сессию (новые первыми) из chat_sessions по индексу (user_id, started_at).
+        Пагинация по ключу: before — (start_time, session_id) последней строки предыдущей страницы.
+        """
+        stmt = (
+            select(
+                ChatSession.session_id,
+                ChatSession.started_at,
+                ChatSession.title,
+                ChatSession.message_count,
+                ChatSession.last_message_at,
+            )
+            .where(ChatSession.user_id == user_id)
+            .order_by(desc(ChatSession.started_at), desc(ChatSession.session_id))
+            .limit(limit)
+        )
+        if before is not None:
+            stmt = stmt.where(tuple_(ChatSession.started_at, ChatSession.session_id) < tuple_(*before))
+
+        result = await session.execute(stmt)
+        return [
+            SessionSummary(session_id, started_at, (title or "")[:PREVIEW_LENGTH], message_count, last_message_at)
+            for session_id, started_at, title, message_count, last_message_at in result.all()
+        ]
+
+    @classmethod
+    async def get_by_session(cls, session, user_id: int, session_id: str) -> list[SessionMessage]:
+        """Сообщения одной сессии по порядку — по индексу (user_id, session_id, timestamp)"""
+        stmt = (
+            select(cls.model.role, cls.model.message, cls.model.timestamp)
+            .where(cls.model.user_id == user_id, cls.model.session_id == session_id)
+            .order_by(cls.model.timestamp, cls.model.id)
+        )
+        result = await session.execute(stmt)
+        return [SessionMessage(*row) for row in result.all()]
@@ -1,18 +1,58 @@
 
-from sqlalchemy import Integer, func
+import time
+
+from sqlalchemy import Integer, event, func
 from sqlalchemy.orm import DeclarativeBase, declared_attr, Mapped, mapped_column
 from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
+from app.utils.telemetry import DB_CONNECTION_HELD_SECONDS, DB_SECONDS
 from settings import settings
 
 
 DATABASE_URL = settings.get_db_url()
 
 # Создаем асинхронный движок для работы с базой данных
-engine = create_async_engine(url=DATABASE_URL, echo=True)
+engine = create_async_engine(
+    url=DATABASE_URL,
+    echo=settings.DB_ECHO,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    connect_args={
+        # Кэш подготовленных выражений: диалекта SQLAlchemy и самого asyncpg
+        "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+    },
+)
 # Создаем фабрику сессий для взаимодействия с базой данных
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
 
+# Задержка SQL-запросов для /metrics (db_query_seconds по типу запроса)
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    DB_SECONDS.labels(statement.split(None, 1)[0].upper()).observe(time.perf_counter() - context._query_started)
+
+
+# Время удержания соединения (db_connection_held_seconds): долгие значения — сессия живёт дольше работы с БД
+@event.listens_for(engine.sync_engine, "checkout")
+def _connection_checked_out(dbapi_connection, connection_record, connection_proxy):
+    connection_record.info["checked_out"] = time.perf_counter()
+
+
+@event.listens_for(engine.sync_engine, "checkin")
+def _connection_checked_in(dbapi_connection, connection_record):
+    started = connection_record.info.pop("checked_out", None)
+    if started is not None:
+        DB_CONNECTION_HELD_SECONDS.observe(time.perf_counter() - started)
+
+
 # Базовый класс для всех моделей
 class Base(AsyncAttrs, DeclarativeBase):
     __abstract__ = True
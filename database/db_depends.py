@@ -3,5 +3,10 @@ from database.db import async_session_maker
 
 
 async def get_db() -> AsyncSession:
+    """
+    Сессия на время запроса. Соединение берётся из пула при первом запросе к БД
+    и возвращается при commit/rollback/close — долгие операции после работы с БД
+    (хеширование, Redis, рендеринг) лучше выполнять после db.close().
+    """
     async with async_session_maker() as session:
         yield session
\ No newline at end of file
@@ -0,0 +1,17 @@
+import multiprocessing
+import os
+
+# Несколько процессов uvicorn за одним портом; состояние чатов общее через Redis
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+graceful_timeout = 30
+keepalive = 5
+
+
+def child_exit(server, worker):
+    # Метрики завершившегося воркера больше не учитываются в livesum-метриках
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
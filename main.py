@@ -1,13 +1,61 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
-from app.routers import index, conf_param_ai, history
+from app.routers import index, conf_param_ai, history, metrics
+from app.services.fanout import chat_fanout
+from app.services.generations import generation_runner
+from app.services.get_ai import client_registry
+from app.services.history_writer import history_writer
+from app.services.pool_metrics import pool_metrics
+from app.services.retrieval import retrieval_index
+from app.services.scheduler import llm_scheduler
+from app.services.state_lifecycle import state_lifecycle
+from app.services.user_config import config_cache
+from app.utils.log import setup_logging
+from app.utils.loop_monitor import loop_monitor
 from auth import auth_routher
 
+setup_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Сторож задержек event loop
+    loop_monitor.start()
+    # Пул соединений к провайдерам ИИ создаётся один раз на процесс
+    client_registry.startup()
+    # Метрики насыщения пулов соединений процесса
+    pool_metrics.start()
+    # Подписка на изменения конфигов пользователей
+    config_cache.start()
+    # Фоновая запись истории чата в БД
+    history_writer.start()
+    # Планировщик запросов к провайдерам ИИ
+    llm_scheduler.start()
+    # Индексация прошлых сессий для поиска по истории
+    retrieval_index.start()
+    # TTL и учёт объёма состояния чатов в Redis
+    state_lifecycle.start()
+    yield
+    # Незавершённые генерации дописываются до остановки пулов
+    await generation_runner.stop()
+    await state_lifecycle.stop()
+    await retrieval_index.stop()
+    await chat_fanout.stop()
+    await llm_scheduler.stop()
+    await history_writer.stop()
+    await config_cache.stop()
+    await pool_metrics.stop()
+    await client_registry.aclose()
+    await loop_monitor.stop()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
 app.include_router(index.router)
 app.include_router(conf_param_ai.router)
 app.include_router(auth_routher.router)
 app.include_router(history.router)
+app.include_router(metrics.router)
@@ -0,0 +1,60 @@
+"""add history indexes and chat_sessions table
+
+Revision ID: 8f2d4a6c1e93
+Revises: 3c9e1f7a2b41
+Create Date: 2026-10-18 11:40:02.531877
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f2d4a6c1e93'
+down_revision: Union[str, None] = '3c9e1f7a2b41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_chathistorys_user_id_session_id_timestamp', 'chathistorys',
+                    ['user_id', 'session_id', 'timestamp'], unique=False)
+    op.create_index('ix_chathistorys_user_id_timestamp', 'chathistorys', ['user_id', 'timestamp'], unique=False)
+
+    op.create_table('chat_sessions',
+    sa.Column('session_id', sa.String(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('last_message_at', sa.DateTime(), nullable=False),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(), nullable=True),
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('session_id')
+    )
+    op.create_index('ix_chat_sessions_user_id_started_at', 'chat_sessions', ['user_id', 'started_at'], unique=False)
+
+    # Заполняем метаданные для уже сохранённых сессий
+    op.execute("""
+        INSERT INTO chat_sessions (session_id, user_id, started_at, last_message_at, message_count, title)
+        SELECT session_id,
+               min(user_id),
+               min(timestamp),
+               max(timestamp),
+               count(*),
+               left((array_agg(message ORDER BY timestamp) FILTER (WHERE role = 'user'))[1], 100)
+        FROM chathistorys
+        GROUP BY session_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_chat_sessions_user_id_started_at', table_name='chat_sessions')
+    op.drop_table('chat_sessions')
+    op.drop_index('ix_chathistorys_user_id_timestamp', table_name='chathistorys')
+    op.drop_index('ix_chathistorys_user_id_session_id_timestamp', table_name='chathistorys')
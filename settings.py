@@ -14,7 +14,46 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str
 
+    # Хеширование паролей: стоимость bcrypt и пул потоков с ограничением очереди
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_QUEUE_LIMIT: int = 32
 
+    # Дополнительные OpenAI-совместимые эндпоинты (JSON-список объектов
+    # {"family", "name", "base_url", "api_key", "model"}) и хеджирование запросов
+    LLM_ENDPOINTS: str = ""
+    LLM_HEDGING: bool = False
+
+    # Каталог для временных файлов загружаемых вложений (по умолчанию — системный tmp)
+    ATTACHMENTS_DIR: str = ""
+    # Каталог индексов поиска по прошлым сессиям (общий для всех воркеров одного хоста)
+    RETRIEVAL_INDEX_DIR: str = "data/retrieval"
+
+    LOG_LEVEL: str = "INFO"
+
+    # Сколько живёт в Redis состояние разговора (история, сводка, текущая сессия) без активности, секунд
+    CHAT_STATE_TTL: int = 7 * 24 * 3600
+
+    # Сериализация JSON: auto (orjson, затем msgspec, затем стандартный json), orjson, msgspec или json
+    JSON_BACKEND: str = "auto"
+    # Блокировка event loop дольше этого порога пишется в лог со стеком (0 — сторож выключен)
+    LOOP_STALL_MS: int = 100
+
+    # Пул соединений с БД на процесс: постоянные соединения, сверх них под пиковую нагрузку,
+    # ожидание свободного соединения и пересоздание старых (сек), проверка перед выдачей
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    # Кэш подготовленных выражений asyncpg на соединение (0 — для PgBouncer в режиме transaction)
+    DB_STATEMENT_CACHE_SIZE: int = 500
+    # Логирование каждого SQL-запроса — только для отладки
+    DB_ECHO: bool = False
+
+    # Адреса API провайдеров (можно направить на прокси или локальную заглушку)
+    DEEPSEEK_BASE_URL: str = "https://api.deepseek.com"
+    OPENAI_BASE_URL: str = "https://api.openai.com/v1"
 
 
     # DATABASE_SQLITE = 'sqlite+aiosqlite:///data/db.sqlite3'
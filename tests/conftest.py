@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+# Settings требует эти переменные; тестам реальные сервисы не нужны
+for name, value in {
+    "OPENAI_API_KEY": "test",
+    "DEEPSEEK_API_KEY": "test",
+    "REDIS_URL": "redis://localhost:6379/15",
+    "DB_USER": "test",
+    "DB_PASSWORD": "test",
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+    "DB_NAME": "test",
+    "SECRET_KEY": "test",
+    "ALGORITHM": "HS256",
+}.items():
+    os.environ.setdefault(name, value)
+
+# Кодировки tiktoken (cl100k_base, o200k_base) лежат в репозитории под именами кэша tiktoken
+# (sha1 URL файла) — тесты токенизации не ходят в сеть; содержимое tiktoken сверяет по sha256
+os.environ["TIKTOKEN_CACHE_DIR"] = os.path.join(os.path.dirname(__file__), "data", "tiktoken")
+
+
+@pytest.fixture
+def redis_client():
+    """Redis в памяти с тем же режимом, что и у приложения (decode_responses=True)"""
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.aioredis.FakeRedis(decode_responses=True)
+
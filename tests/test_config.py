@@ -0,0 +1,28 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from settings import settings
+
+
+def test_set_config_keeps_fields_missing_from_request(redis_client, monkeypatch):
+    from app.routers import conf_param_ai
+    from app.services.user_config import UserConfigCache
+
+    monkeypatch.setattr(conf_param_ai, "config_cache", UserConfigCache(redis_client))
+    app = FastAPI()
+    app.include_router(conf_param_ai.router)
+
+    with TestClient(app) as client:
+        client.cookies.set("access_token", jwt.encode({"sub": "user", "id": 1, "exp": 2**31}, settings.SECRET_KEY,
+                                                      algorithm=settings.ALGORITHM))
+        client.post("/config/set_config", json={"cache": True, "summarize": True})
+        # Форма без переключателей присылает только эти поля
+        client.post("/config/set_config", json={"prompt": "Отвечай кратко.", "temperature": 0.5})
+        config = client.get("/config/get_config").json()
+
+    assert config["prompt"] == "Отвечай кратко."
+    assert config["temperature"] == 0.5
+    assert config["cache"] is True
+    assert config["summarize"] is True
+    assert config["semantic_cache"] is False
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from app.services import context_builder
+from app.services.context_builder import (
+    MAX_CONTEXT_MESSAGES, MESSAGE_OVERHEAD_TOKENS, count_tokens, encoding_name_for_model, pack_history,
+    summary_start, token_counts, tokens_key,
+)
+
+
+def _history(*contents: str) -> list[dict]:
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": content} for i, content in enumerate(contents)]
+
+
+@pytest.mark.parametrize("text, encoding_name, expected", [
+    ("", "cl100k_base", 0),
+    ("hello world", "cl100k_base", 2),
+    ("tiktoken is great!", "cl100k_base", 6),
+    ("hello world", "o200k_base", 2),
+])
+def test_count_tokens_matches_tokenizer(text, encoding_name, expected):
+    assert count_tokens(text, encoding_name) == expected
+
+
+def test_encoding_name_for_model():
+    assert encoding_name_for_model("gpt-4.1-mini") == "o200k_base"
+    assert encoding_name_for_model("deepseek-chat") == "cl100k_base"
+
+
+@pytest.mark.parametrize("budget, expected", [
+    (15, ["a", "b", "c"]),  # всё помещается ровно
+    (14, ["b", "c"]),
+    (10, ["b", "c"]),
+    (9, ["c"]),
+    (5, ["c"]),
+    (4, []),
+    (0, []),
+])
+def test_pack_history_keeps_newest_messages_within_budget(budget, expected):
+    history = _history("a", "b", "c")
+    packed = pack_history(history, [5, 5, 5], budget)
+    assert [msg["content"] for msg in packed] == expected
+
+
+def test_pack_history_stops_at_first_message_that_does_not_fit():
+    # Короткое старое сообщение не «перепрыгивает» через длинное, не поместившееся
+    history = _history("short", "long", "new")
+    assert [msg["content"] for msg in pack_history(history, [1, 100, 5], 10)] == ["new"]
+
+
+def test_token_counts_match_tokenizer(redis_client):
+    history = _history("hello world", "tiktoken is great!")
+    counts = asyncio.run(token_counts(redis_client, "chat:1:history", "cl100k_base", history))
+    assert counts == [2 + MESSAGE_OVERHEAD_TOKENS, 6 + MESSAGE_OVERHEAD_TOKENS]
+
+
+def test_token_counts_caches_per_message(redis_client, monkeypatch):
+    history_key = "chat:1:history"
+    calls = []
+
+    def by_words(text, encoding_name):
+        calls.append(text)
+        return len(text.split())
+
+    monkeypatch.setattr(context_builder, "count_tokens", by_words)
+    history = _history("один два", "три четыре пять")
+
+    async def run():
+        first = await token_counts(redis_client, history_key, "cl100k_base", history)
+        cached = await redis_client.hvals(tokens_key(history_key))
+        # Повторно токенизируется только новое сообщение, остальные берутся из кэша
+        second = await token_counts(redis_client, history_key, "cl100k_base", history + _history("шесть"))
+        # Кэш ведётся отдельно для каждой кодировки
+        await token_counts(redis_client, history_key, "o200k_base", history[:1])
+        return first, cached, second
+
+    first, cached, second = asyncio.run(run())
+    assert first == [2 + MESSAGE_OVERHEAD_TOKENS, 3 + MESSAGE_OVERHEAD_TOKENS]
+    assert sorted(cached) == ["2", "3"]
+    assert second == first + [1 + MESSAGE_OVERHEAD_TOKENS]
+    assert calls == ["один два", "три четыре пять", "шесть", "один два"]
+
+
+def test_token_counts_trims_cache_of_evicted_messages(redis_client, monkeypatch):
+    history_key = "chat:1:history"
+    monkeypatch.setattr(context_builder, "count_tokens", lambda text, encoding_name: 1)
+    old = _history(*(f"старое {i}" for i in range(2 * MAX_CONTEXT_MESSAGES)))
+
+    async def run():
+        await token_counts(redis_client, history_key, "cl100k_base", old)
+        full = await redis_client.hlen(tokens_key(history_key))
+        # Хэш перерос предел — в нём остаются только сообщения текущей истории
+        await token_counts(redis_client, history_key, "cl100k_base", _history("новое"))
+        return full, await redis_client.hlen(tokens_key(history_key))
+
+    assert asyncio.run(run()) == (2 * MAX_CONTEXT_MESSAGES, 1)
+
+
+def test_summary_start_uses_position_not_content():
+    # Одинаковые реплики: сводка покрывает первые четыре сообщения из шести
+    history = _history("да", "ок", "да", "ок", "да", "ок")
+    assert summary_start(history, {"content": "…", "until": 4}, end=6) == 4
+    # Список обрезан: в нём последние три сообщения из 9, свёрнуты первые 7
+    assert summary_start(history[:3], {"content": "…", "until": 7}, end=9) == 1
+    # Свёрнутые сообщения вытеснены из списка целиком
+    assert summary_start(history, {"content": "…", "until": 2}, end=20) == 0
+    # Сводка старого формата с дайджестом текста вместо позиции
+    assert summary_start(history, {"content": "…", "until": "5f2b51ca2fdc5baa"}, end=6) == 0
+    assert summary_start(history, None, end=6) == 0
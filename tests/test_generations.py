@@ -0,0 +1,65 @@
+import asyncio
+
+from app.services import generations
+from app.services.fanout import Subscription
+from app.services.generations import GenerationRunner, current_generation_key
+
+
+async def _frames(*frames, wait: asyncio.Event | None = None):
+    for frame in frames:
+        yield frame
+    if wait is not None:
+        await wait.wait()
+    yield {"done": True}
+
+
+async def _drain(runner: GenerationRunner, subscription: Subscription) -> list[dict]:
+    await subscription.queue.put(None)
+    return [frame async for frame in runner.frames(subscription)]
+
+
+def test_resume_replays_only_own_generation(redis_client):
+    runner = GenerationRunner(redis_client)
+
+    async def run():
+        owner = Subscription(1)
+        generation_id = await runner.start(owner, "привет", "deepseek-chat", _frames({"delta": "При"}, {"delta": "вет"}))
+        await asyncio.gather(*runner._tasks)
+
+        # Другая вкладка владельца догоняет генерацию с начала
+        tab = Subscription(1)
+        await runner.resume(tab, generation_id, "0-0")
+        replayed = await _drain(runner, tab)
+
+        # Чужой пользователь с тем же id генерации ничего не получает
+        stranger = Subscription(2)
+        await runner.resume(stranger, generation_id, "0-0")
+        return replayed, await _drain(runner, stranger)
+
+    replayed, stolen = asyncio.run(run())
+    assert [frame.get("delta") for frame in replayed] == ["При", "вет", None]
+    assert replayed[-1]["done"] is True
+    assert stolen == []
+
+
+def test_current_generation_marker_is_kept_alive_by_heartbeat(redis_client, monkeypatch):
+    monkeypatch.setattr(generations, "GENERATION_LIVENESS_TTL", 1)
+    monkeypatch.setattr(generations, "GENERATION_HEARTBEAT_INTERVAL", 0.2)
+    runner = GenerationRunner(redis_client)
+
+    async def run():
+        finish = asyncio.Event()
+        generation_id = await runner.start(Subscription(1), "привет", "deepseek-chat", _frames(wait=finish))
+        ttl = await redis_client.ttl(current_generation_key(1))
+        # Дольше срока жизни отметки: её продлевает живая генерация
+        await asyncio.sleep(1.5)
+        during = await runner.current(1)
+        finish.set()
+        await asyncio.gather(*runner._tasks)
+        return generation_id, ttl, during, await runner.current(1)
+
+    generation_id, ttl, during, after = asyncio.run(run())
+    assert 0 < ttl <= 1
+    assert during == {"generation": generation_id, "message": "привет"}
+    assert after is None
+
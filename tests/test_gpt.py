@@ -0,0 +1,141 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.services import context_builder, gpt
+from app.services.context_builder import build_context, load_history, summary_start
+from app.services.gpt import MAX_STORED_MESSAGES, _save_turn, stream_message, summarize_history
+from app.services.response_cache import ResponseCache
+from app.utils.variables import SUMMARY_KEEP_MESSAGES
+
+
+class FakeUsage(SimpleNamespace):
+    def model_dump(self):
+        return dict(vars(self))
+
+
+def _chunk(content=None, usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=content))] if content is not None else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+class FakeStreamingClient:
+    """OpenAI-совместимый клиент, который отдаёт заранее заданные фрагменты ответа"""
+
+    def __init__(self, parts: list[str]):
+        self.parts = parts
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        self.requests.append(kwargs)
+
+        async def stream():
+            for part in self.parts:
+                yield _chunk(part)
+            yield _chunk(usage=FakeUsage(prompt_tokens=10, completion_tokens=len(self.parts), total_tokens=13))
+
+        return stream()
+
+
+def test_stream_message_forwards_chunks_and_saves_history(redis_client):
+    client = FakeStreamingClient(["При", "вет", "!"])
+    history_key = "chat:1:history"
+
+    async def run():
+        frames = [frame async for frame in stream_message(
+            user_message="Здравствуй",
+            redis_client=redis_client,
+            system_prompt="Ты помощник.",
+            history_key=history_key,
+            model="deepseek-chat",
+            client=client,
+            temperature=0.2,
+            frequency_penalty=0,
+            presence_penalty=0,
+        )]
+        history, _, _ = await load_history(redis_client, history_key)
+        return frames, history
+
+    frames, history = asyncio.run(run())
+
+    assert [frame["delta"] for frame in frames if "delta" in frame] == ["При", "вет", "!"]
+    assert frames[-1] == {"done": True, "usage": {"prompt_tokens": 10, "completion_tokens": 3, "total_tokens": 13}}
+    assert history == [
+        {"role": "user", "content": "Здравствуй"},
+        {"role": "assistant", "content": "Привет!"},
+    ]
+    # В запрос к модели ушли системный промпт и новое сообщение
+    messages = client.requests[0]["messages"]
+    assert messages[0] == {"role": "system", "content": "Ты помощник."}
+    assert messages[-1] == {"role": "user", "content": "Здравствуй"}
+
+
+def test_empty_reply_is_not_cached(redis_client, monkeypatch):
+    monkeypatch.setattr(gpt, "response_cache", ResponseCache(redis_client))
+    client = FakeStreamingClient([])
+
+    async def run():
+        # Разные пользователи без истории: запросы к модели совпадают целиком
+        for user_id in (1, 2):
+            frames = [frame async for frame in stream_message(
+                user_message="Здравствуй",
+                redis_client=redis_client,
+                system_prompt="Ты помощник.",
+                history_key=f"chat:{user_id}:history",
+                model="deepseek-chat",
+                client=client,
+                temperature=0.2,
+                frequency_penalty=0,
+                presence_penalty=0,
+                cache=True,
+            )]
+        return frames
+
+    frames = asyncio.run(run())
+    # Второй такой же запрос снова уходит к провайдеру, а не получает пустой ответ из кэша
+    assert len(client.requests) == 2
+    assert "cached" not in frames[-1]
+
+
+class FakeSummaryClient:
+    """Клиент без потоковой выдачи: отвечает заданной сводкой и запоминает переданную переписку"""
+
+    def __init__(self, content: str):
+        self.content = content
+        self.transcripts = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        self.transcripts.append(kwargs["messages"][-1]["content"])
+        message = SimpleNamespace(content=self.content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+def test_summary_boundary_survives_repeated_messages_and_trimming(redis_client, monkeypatch):
+    # Короткие повторяющиеся реплики: граница по тексту совпала бы с более поздним повтором
+    monkeypatch.setattr(context_builder, "count_tokens", lambda text, encoding_name: 1)
+    monkeypatch.setattr(gpt, "SUMMARY_TRIGGER_TOKENS", 0)
+    history_key = "chat:1:history"
+    client = FakeSummaryClient("Пользователь соглашался.")
+
+    async def run():
+        for i in range(10):
+            await _save_turn(redis_client, history_key, "да", f"ответ {i}")
+        await summarize_history(redis_client, history_key, "deepseek-chat", client)
+        summarized = await build_context(redis_client, history_key, "deepseek-chat", "Ты помощник.", "ещё")
+
+        # История перерастает MAX_STORED_MESSAGES и обрезается — граница сводки не сдвигается
+        for i in range(10, 10 + MAX_STORED_MESSAGES // 2):
+            await _save_turn(redis_client, history_key, "да", f"ответ {i}")
+        _, summary, end = await load_history(redis_client, history_key, MAX_STORED_MESSAGES)
+        return summarized, summary, end
+
+    summarized, summary, end = asyncio.run(run())
+
+    # 20 сообщений, последние SUMMARY_KEEP_MESSAGES остаются дословно
+    assert summary["until"] == 20 - SUMMARY_KEEP_MESSAGES
+    assert client.transcripts[0].count("user: да") == (20 - SUMMARY_KEEP_MESSAGES) // 2
+    history = [msg["content"] for msg in summarized[2:-1]]
+    assert history == [content for i in range(7, 10) for content in ("да", f"ответ {i}")]
+    assert end == 20 + MAX_STORED_MESSAGES
+    assert summary_start([{}] * MAX_STORED_MESSAGES, summary, end) == 0
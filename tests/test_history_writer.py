@@ -0,0 +1,29 @@
+import asyncio
+
+from app.services import history_writer
+from app.services.history_writer import GROUP_NAME, STREAM_KEY, HistoryWriter
+
+
+def test_prune_consumers_removes_only_idle_consumers_without_pending(redis_client, monkeypatch):
+    monkeypatch.setattr(history_writer, "redis_client", redis_client)
+    monkeypatch.setattr(history_writer, "CONSUMER_IDLE_MS", 0)
+    writer = HistoryWriter("host-1")
+
+    async def run():
+        await writer._ensure_group()
+        await redis_client.xadd(STREAM_KEY, {"turn_id": "a"})
+        await redis_client.xadd(STREAM_KEY, {"turn_id": "b"})
+        # Остановленный воркер успел подтвердить всё, что прочитал
+        (_, [(entry_id, _)]), = await redis_client.xreadgroup(GROUP_NAME, "host-0", {STREAM_KEY: ">"}, count=1)
+        await redis_client.xack(STREAM_KEY, GROUP_NAME, entry_id)
+        # Упавший воркер оставил неподтверждённую запись — её заберёт XAUTOCLAIM
+        await redis_client.xreadgroup(GROUP_NAME, "host-crashed", {STREAM_KEY: ">"}, count=1)
+        await redis_client.xreadgroup(GROUP_NAME, writer.consumer_name, {STREAM_KEY: ">"}, count=1)
+
+        removed = await writer.prune_consumers()
+        consumers = await redis_client.xinfo_consumers(STREAM_KEY, GROUP_NAME)
+        return removed, sorted(consumer["name"] for consumer in consumers)
+
+    removed, remaining = asyncio.run(run())
+    assert removed == ["host-0"]
+    assert remaining == ["host-1", "host-crashed"]
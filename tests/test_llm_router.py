@@ -0,0 +1,174 @@
+import asyncio
+import json
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from openai import AsyncOpenAI
+
+from app.services.get_ai import _CountingTransport
+from app.services.llm_router import MIN_SAMPLES_FOR_HEDGE, Endpoint, LLMRouter
+
+MODEL = "mock-model"
+
+
+def mock_provider(reply: str = "ok", status: int = 200, first_chunk_delay: float = 0.0) -> FastAPI:
+    """
+    OpenAI-совместимый сервер chat.completions. first_chunk_delay — пауза между
+    заголовками потокового ответа и первым чанком (медленная генерация).
+    """
+    app = FastAPI()
+    app.state.requests = 0
+    app.state.disconnected = 0
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        app.state.requests += 1
+        body = await request.json()
+        if status != 200:
+            return JSONResponse({"error": {"message": "upstream error", "type": "server_error"}}, status_code=status)
+        if not body.get("stream"):
+            return {
+                "id": "cmpl", "object": "chat.completion", "created": 0, "model": MODEL,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            }
+
+        async def events():
+            try:
+                await asyncio.sleep(first_chunk_delay)
+                for part in reply:
+                    chunk = {
+                        "id": "cmpl", "object": "chat.completion.chunk", "created": 0, "model": MODEL,
+                        "choices": [{"index": 0, "delta": {"content": part}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                yield "data: [DONE]\n\n"
+            except asyncio.CancelledError:
+                app.state.disconnected += 1
+                raise
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+class MockServers:
+    """Запускает mock-провайдеры на свободных локальных портах в текущем цикле событий"""
+
+    def __init__(self, *apps: FastAPI):
+        self.apps = apps
+        self._servers = []
+        self._tasks = []
+
+    async def __aenter__(self) -> list[str]:
+        urls = []
+        for app in self.apps:
+            server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="error"))
+            self._servers.append(server)
+            self._tasks.append(asyncio.create_task(server.serve()))
+            while not server.started:
+                await asyncio.sleep(0.01)
+            port = server.servers[0].sockets[0].getsockname()[1]
+            urls.append(f"http://127.0.0.1:{port}/v1")
+        return urls
+
+    async def __aexit__(self, *exc):
+        for server in self._servers:
+            server.should_exit = True
+        await asyncio.gather(*self._tasks)
+
+
+def _router(hedging: bool) -> LLMRouter:
+    # Без повторов внутри клиента: переключением между эндпоинтами занимается роутер
+    return LLMRouter(lambda base_url, api_key: AsyncOpenAI(base_url=base_url, api_key=api_key, max_retries=0),
+                     hedging=hedging)
+
+
+def _endpoint(name: str, base_url: str, latency: float | None = None) -> Endpoint:
+    endpoint = Endpoint(family="mock", name=name, base_url=base_url, api_key="test")
+    if latency is not None:
+        # Статистика, достаточная для хеджирования: p50 = p95 = latency
+        for _ in range(MIN_SAMPLES_FOR_HEDGE):
+            endpoint.record(latency, ok=True)
+    return endpoint
+
+
+async def _read(stream) -> str:
+    return "".join([chunk.choices[0].delta.content async for chunk in stream if chunk.choices])
+
+
+def test_failover_to_next_endpoint_on_error():
+    broken, working = mock_provider(status=500), mock_provider(reply="from backup")
+
+    async def run():
+        async with MockServers(broken, working) as (broken_url, working_url):
+            router = _router(hedging=False)
+            primary = _endpoint("broken", broken_url)
+            router.add(primary)
+            router.add(_endpoint("working", working_url))
+            response = await router.client("mock").chat.completions.create(model=MODEL, messages=[])
+            return response.choices[0].message.content, primary
+
+    content, primary = asyncio.run(run())
+    assert content == "from backup"
+    assert (broken.state.requests, working.state.requests) == (1, 1)
+    assert primary.consecutive_failures == 1
+
+
+def test_hedged_primary_failing_fast_falls_back_to_backup():
+    broken, working = mock_provider(status=500), mock_provider(reply="from backup")
+
+    async def run():
+        async with MockServers(broken, working) as (broken_url, working_url):
+            router = _router(hedging=True)
+            # p95 primary — секунда: ошибка приходит раньше, чем сработал бы хедж
+            router.add(_endpoint("broken", broken_url, latency=1.0))
+            router.add(_endpoint("working", working_url, latency=2.0))
+            stream = await router.client("mock").chat.completions.create(model=MODEL, messages=[], stream=True)
+            return await _read(stream)
+
+    assert asyncio.run(run()) == "from backup"
+    assert (broken.state.requests, working.state.requests) == (1, 1)
+
+
+def test_hedge_wins_with_backup_and_closes_slow_primary_stream():
+    slow, fast = mock_provider(reply="slow", first_chunk_delay=5.0), mock_provider(reply="fast")
+
+    async def run():
+        async with MockServers(slow, fast) as (slow_url, fast_url):
+            router = _router(hedging=True)
+            router.add(_endpoint("slow", slow_url, latency=0.05))
+            router.add(_endpoint("fast", fast_url, latency=0.1))
+            stream = await router.client("mock").chat.completions.create(model=MODEL, messages=[], stream=True)
+            content = await _read(stream)
+            # Отменённый запрос к primary закрыл свой поток — сервер видит разрыв соединения
+            for _ in range(100):
+                if slow.state.disconnected:
+                    break
+                await asyncio.sleep(0.02)
+            return content
+
+    assert asyncio.run(asyncio.wait_for(run(), 10)) == "fast"
+    assert (slow.state.requests, fast.state.requests) == (1, 1)
+    assert slow.state.disconnected == 1
+
+
+def test_stream_closed_when_consumer_stops_early():
+    provider = mock_provider(reply="длинный ответ")
+    transport = _CountingTransport()
+
+    async def run():
+        async with MockServers(provider) as (url,):
+            router = LLMRouter(lambda base_url, api_key: AsyncOpenAI(
+                base_url=base_url, api_key=api_key, max_retries=0, http_client=httpx.AsyncClient(transport=transport),
+            ), hedging=False)
+            router.add(_endpoint("mock", url))
+            stream = await router.client("mock").chat.completions.create(model=MODEL, messages=[], stream=True)
+            # Потребитель прочитал один чанк и остановился (отмена, ошибка Redis в генерации)
+            await anext(stream)
+            in_use = transport.in_flight
+            await stream.aclose()
+            return in_use, transport.in_flight
+
+    assert asyncio.run(run()) == (1, 0)
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from settings import settings
+
+
+def _token(is_admin: bool) -> str:
+    return jwt.encode({"sub": "user", "id": 1, "is_admin": is_admin, "exp": 2**31}, settings.SECRET_KEY,
+                      algorithm=settings.ALGORITHM)
+
+
+@pytest.mark.parametrize("path", ["/api/provider_pool", "/api/llm_endpoints", "/api/response_cache"])
+def test_service_endpoints_require_admin(path):
+    from main import app
+
+    # Без контекстного менеджера lifespan не запускается: фоновым сервисам Redis не нужен
+    client = TestClient(app)
+    assert client.get(path).status_code == 401
+    client.cookies.set("access_token", _token(is_admin=False))
+    assert client.get(path).status_code == 403
+    client.cookies.set("access_token", _token(is_admin=True))
+    assert client.get(path).status_code == 200
+
+
+def test_redis_pool_counts_leased_connections():
+    fakeredis = pytest.importorskip("fakeredis")
+    from app.utils.redis import _CountingConnectionPool
+
+    async def run():
+        client = fakeredis.aioredis.FakeRedis(decode_responses=True, connection_pool_class=_CountingConnectionPool)
+        pool = client.connection_pool
+        await client.set("key", "value")
+        idle = pool.in_use
+        # Подписка держит соединение, пока не закрыта
+        pubsub = client.pubsub()
+        await pubsub.subscribe("channel")
+        subscribed = pool.in_use
+        await pubsub.close()
+        return idle, subscribed, pool.in_use
+
+    assert asyncio.run(run()) == (0, 1, 0)
+
+
+def test_pool_gauges_are_collected_in_multiprocess_mode(tmp_path):
+    # Режим multiprocess выбирается при импорте prometheus_client — проверяем в отдельном процессе
+    script = textwrap.dedent("""
+        import tests.conftest
+        from prometheus_client import CollectorRegistry, generate_latest, multiprocess
+        from app.services.pool_metrics import pool_metrics
+
+        pool_metrics.sample()
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        print(generate_latest(registry).decode())
+    """)
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+    output = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(__file__))).stdout
+    assert f"db_pool_size {float(settings.DB_POOL_SIZE)}" in output
+    assert "redis_pool_size 50.0" in output
+    assert "redis_pool_in_use 0.0" in output
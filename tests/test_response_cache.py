@@ -0,0 +1,31 @@
+import asyncio
+
+import numpy as np
+
+from app.services import response_cache as response_cache_module
+from app.services.response_cache import ResponseCache
+
+
+def test_semantic_miss_embeds_prompt_once(redis_client, monkeypatch):
+    # Сама модель эмбеддингов не нужна: считаем вызовы _embed
+    monkeypatch.setattr(response_cache_module, "SentenceTransformer", object)
+    cache = ResponseCache(redis_client)
+    embedded = []
+
+    async def embed(text):
+        embedded.append(text)
+        return np.ones(4, dtype=np.float32) / 2
+
+    cache._embed = embed
+    messages = [{"role": "system", "content": "Ты помощник."}, {"role": "user", "content": "Сколько будет 2+2?"}]
+
+    async def run():
+        lookup = await cache.lookup(messages, "deepseek-chat", 0.2, 0, 0, semantic=True)
+        assert lookup.reply is None
+        await cache.store(lookup, "4")
+        return await cache.lookup(messages[:1] + [{"role": "user", "content": "2+2?"}], "deepseek-chat", 0.2, 0, 0,
+                                  semantic=True)
+
+    similar = asyncio.run(run())
+    assert embedded == ["Сколько будет 2+2?", "2+2?"]
+    assert (similar.reply, similar.tier) == ("4", "semantic")
@@ -0,0 +1,40 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.services import retrieval
+from app.services.retrieval import RetrievalIndex, enqueue
+
+
+class FakeConfigCache:
+    async def get(self, user_id):
+        return SimpleNamespace(retrieval=True)
+
+
+def test_every_host_indexes_its_own_copy(redis_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(retrieval, "config_cache", FakeConfigCache())
+    hosts = [RetrievalIndex(redis_client, str(tmp_path / host), host=host) for host in ("host-a", "host-b")]
+    indexed = []
+
+    async def index_user(self, user_id):
+        indexed.append((self.host, user_id))
+        return 0
+
+    monkeypatch.setattr(RetrievalIndex, "index_user", index_user)
+
+    async def run():
+        for index in hosts:
+            await index._ensure_group()
+        # Другой воркер хоста A сейчас дописывает индекс пользователя 1
+        await redis_client.set("chat:retrieval:lock:host-a:1", 1)
+        await enqueue(redis_client.pipeline(transaction=False), 1, 2, 1).execute()
+        polled = [await index.poll() for index in hosts]
+        await redis_client.delete("chat:retrieval:lock:host-a:1")
+        # Пользователь 1 возвращён в очередь и индексируется хостом A после снятия блокировки
+        return polled, [await index.poll() for index in hosts]
+
+    polled, again = asyncio.run(run())
+    assert polled == [[1, 2], [1, 2]]
+    # Хост B прочитал повторное событие вместе с остальными в одной порции
+    assert again == [[1], []]
+    # Блокировка хоста A не мешает хосту B обновить свою копию индекса
+    assert indexed == [("host-a", 2), ("host-b", 1), ("host-b", 2), ("host-a", 1)]
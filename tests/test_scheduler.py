@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from app.services.scheduler import DISPATCH_INTERVAL, LLMScheduler, estimate_cost
+from app.utils.variables import USER_TOKENS_PER_MINUTE
+
+
+def _bucket(redis_client, name):
+    return redis_client.hget(f"sched:bucket:{name}", "tokens")
+
+
+def test_acquire_reserves_estimated_cost_and_release_settles(redis_client):
+    cost = USER_TOKENS_PER_MINUTE * 2 // 3
+
+    async def run():
+        scheduler = LLMScheduler(redis_client)
+        first = scheduler.submit(1, "deepseek", cost=cost)
+        second = scheduler.submit(1, "deepseek", cost=cost)
+        await asyncio.wait_for(scheduler.wait(first), 5)
+        # Несколько проходов диспетчера: второй запрос не помещается в остаток bucket'а
+        await asyncio.sleep(5 * DISPATCH_INTERVAL)
+        second_waiting = not second.granted
+        reserved = float(await _bucket(redis_client, "user:1"))
+
+        # Фактический расход меньше оценки — разница возвращается в bucket, и второй запрос проходит
+        await scheduler.release(first, tokens_used=cost // 4)
+        await asyncio.wait_for(scheduler.wait(second), 5)
+        await scheduler.release(second, tokens_used=cost)
+        await scheduler.stop()
+        return second_waiting, reserved, float(await _bucket(redis_client, "user:1"))
+
+    second_waiting, reserved, settled = asyncio.run(run())
+    # Bucket пополняется на USER_TOKENS_PER_MINUTE / 60 в секунду — отсюда допуск сравнений
+    assert second_waiting
+    assert reserved == pytest.approx(USER_TOKENS_PER_MINUTE - cost, abs=2000)
+    assert settled == pytest.approx(USER_TOKENS_PER_MINUTE - cost // 4 - cost, abs=2000)
+
+
+def test_dispatch_is_one_redis_call_for_all_waiting_tickets(redis_client):
+    async def run():
+        scheduler = LLMScheduler(redis_client)
+        calls = []
+        script = scheduler._dispatch_script
+
+        async def counted(**kwargs):
+            calls.append(kwargs)
+            return await script(**kwargs)
+
+        scheduler._dispatch_script = counted
+        # Двое пользователей по три запроса: по два слота каждому, третьи ждут
+        tickets = [scheduler.submit(user_id, "openai", cost=100) for user_id in (1, 2) for _ in range(3)]
+        await asyncio.wait_for(scheduler.wait(tickets[0]), 5)
+        await scheduler.stop()
+        return calls, tickets
+
+    calls, tickets = asyncio.run(run())
+    assert len(calls[0]["keys"]) == 4 * len(tickets)
+    assert [ticket.granted for ticket in tickets] == [True, True, False, True, True, False]
+    assert {ticket.position for ticket in tickets if not ticket.granted} == {0, 1}
+
+
+def test_estimate_cost_counts_prompt_and_reply():
+    messages = [{"role": "system", "content": "а" * 30}, {"role": "user", "content": "б" * 60}]
+    assert estimate_cost(messages, reply_tokens=100) == 130
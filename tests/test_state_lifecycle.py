@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+from redis.asyncio.client import Pipeline
+
+from app.services.history_writer import GROUP_NAME, STREAM_KEY
+from app.services.state_lifecycle import StateLifecycle, conversation_keys, is_conversation_key, key_kind
+
+
+@pytest.mark.parametrize("key, kind, conversation", [
+    ("chat:42:history", "history", True),
+    ("chat:42:history:tokens", "history:tokens", True),
+    ("chat:42:session", "session", True),
+    ("chat:42:attachment:ab12", "attachment", False),
+    (STREAM_KEY, "history:stream", False),
+    ("chat:history:summary", "history", False),
+    ("chat:lifecycle:lock", "lifecycle", False),
+])
+def test_only_per_user_keys_are_conversation_keys(key, kind, conversation):
+    assert key_kind(key) == kind
+    assert is_conversation_key(key) is conversation
+
+
+def test_sweep_assigns_ttl_to_conversation_keys_only(redis_client, monkeypatch):
+    # В fakeredis нет MEMORY USAGE — размер ключа здесь не проверяется
+    monkeypatch.setattr(Pipeline, "memory_usage", lambda self, key: self.exists(key), raising=False)
+    lifecycle = StateLifecycle(redis_client, ttl=3600)
+
+    async def run():
+        for key in conversation_keys(42)[:2]:
+            await redis_client.set(key, "1")
+        # Очередь HistoryWriter с группой потребителей не должна истечь
+        await redis_client.xadd(STREAM_KEY, {"turn": "1"})
+        await redis_client.xgroup_create(STREAM_KEY, GROUP_NAME, id="0")
+        report = await lifecycle.sweep()
+        ttls = [await redis_client.ttl(key) for key in conversation_keys(42)[:2]]
+        return report, ttls, await redis_client.ttl(STREAM_KEY)
+
+    report, ttls, stream_ttl = asyncio.run(run())
+    assert all(0 < ttl <= 3600 for ttl in ttls)
+    assert stream_ttl == -1
+    assert report["ttl_assigned"] == 2
+    assert report["kinds"]["history:stream"]["without_ttl"] == 1
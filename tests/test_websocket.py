@@ -0,0 +1,79 @@
+from contextlib import ExitStack, asynccontextmanager
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from settings import settings
+
+IDLE_SOCKETS = 20
+
+
+def _token(user_id: int) -> str:
+    return jwt.encode({"sub": f"user{user_id}", "id": user_id, "exp": 2**31}, settings.SECRET_KEY,
+                      algorithm=settings.ALGORITHM)
+
+
+def test_idle_websockets_hold_no_db_connections(redis_client, monkeypatch):
+    from app.routers import index
+    from app.services.fanout import ChatFanout
+    from app.services.generations import GenerationRunner
+    from app.services.user_config import UserConfigCache
+    from database.db import engine
+
+    fanout = ChatFanout(redis_client)
+    monkeypatch.setattr(index, "redis_client", redis_client)
+    monkeypatch.setattr(index, "chat_fanout", fanout)
+    monkeypatch.setattr(index, "generation_runner", GenerationRunner(redis_client))
+    monkeypatch.setattr(index, "config_cache", UserConfigCache(redis_client))
+
+    pool = engine.sync_engine.pool
+    checkouts = []
+    connect = pool.connect
+    monkeypatch.setattr(pool, "connect", lambda: checkouts.append(1) or connect())
+
+    # Только роутер чата: lifespan приложения подключился бы к настоящему Redis
+    app = FastAPI()
+    app.include_router(index.router)
+    with TestClient(app) as client:
+        with ExitStack() as sockets:
+            for i in range(IDLE_SOCKETS):
+                client.cookies.set("access_token", _token(i % 5 + 1))
+                ws = sockets.enter_context(client.websocket_connect("/ws/chat"))
+                # Сокет принят и получил историю — дальше он только простаивает
+                assert ws.receive_json() == {"history": []}
+            checked_out = pool.checkedout()
+        client.portal.call(fanout.stop)
+
+    assert checked_out == 0
+    assert checkouts == []
+
+
+def test_load_unknown_session_keeps_current_history(redis_client, monkeypatch):
+    from app.routers import index
+    from app.services.history_writer import session_key
+
+    @asynccontextmanager
+    async def no_db():
+        yield None
+
+    async def no_messages(db, user_id, session_id):
+        return []
+
+    monkeypatch.setattr(index, "redis_client", redis_client)
+    monkeypatch.setattr(index, "async_session_maker", no_db)
+    monkeypatch.setattr(index.ChatHistoryDAO, "get_by_session", no_messages)
+    app = FastAPI()
+    app.include_router(index.router)
+
+    with TestClient(app) as client:
+        client.portal.call(redis_client.set, session_key(1), "current")
+        client.portal.call(redis_client.rpush, "chat:1:history", "entry")
+        client.cookies.set("access_token", _token(1))
+        response = client.get("/load_session", params={"session_id": "unknown"})
+        session = client.portal.call(redis_client.get, session_key(1))
+        history = client.portal.call(redis_client.lrange, "chat:1:history", 0, -1)
+
+    assert response.status_code == 404
+    assert session == "current"
+    assert history == ["entry"]